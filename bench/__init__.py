@@ -0,0 +1,6 @@
+###############################################################################
+# Name: bench                                                                 #
+#                                                                             #
+# Benchmarks for the router, controller and switch programs. Each module is   #
+# run from the repository root, e.g. "python -m bench.incremental".           #
+###############################################################################
@@ -0,0 +1,113 @@
+###############################################################################
+# Name: batch.py                                                              #
+#                                                                             #
+# Compares computing the flow tables of many sources one Dijkstra run at a    #
+# time with the router's batched AllSourcesSPF, on random sparse graphs,      #
+# and optionally the router's worker pool at several sizes. Every batched     #
+# or pooled result is checked against the per-source run.                     #
+###############################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from array import array
+import argparse
+import random
+import time
+
+import router
+from bench.topology import RandomGraph, ToColumns
+
+###############################################################################
+# Func: Run                                                                   #
+# Desc: Times both ways of computing the tables of one graph.                 #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       degree {float} - the average node degree.                             #
+#       numSources {int} - the number of sources (0 for every node).          #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - timing results.                                              #
+###############################################################################
+def Run(numNodes, degree, numSources, rng):
+	router.BuildCSR(numNodes, *ToColumns(RandomGraph(numNodes, degree, rng)))
+	if numSources <= 0 or numSources >= numNodes:
+		sources = list(range(numNodes))
+	else:
+		sources = rng.sample(range(numNodes), numSources)
+	start = time.perf_counter()
+	single = {}
+	for router.sourceVertex in sources:
+		prev, egress, _ = router.Dijkstra(numNodes)
+		single[router.sourceVertex] = (prev, egress)
+	singleTime = time.perf_counter() - start
+	start = time.perf_counter()
+	batch = {source: (prev, egress) for source, prev, egress
+		in router.AllSourcesSPF(sources, numNodes)}
+	batchTime = time.perf_counter() - start
+	if batch != single:
+		raise AssertionError("batched tables differ from per-source runs")
+	return {"nodes": numNodes, "sources": len(sources),
+		"single_s": singleTime, "batch_s": batchTime}
+
+###############################################################################
+# Func: RunPool                                                               #
+# Desc: Times the flow tables of the given sources, over the topology of      #
+#       the last Run, on a worker pool. The time includes copying the         #
+#       topology to shared memory and loading it in the workers.              #
+# Args: sources {list: int} - IDs of the source vertices.                     #
+#       numNodes {int} - the number of nodes.                                 #
+#       workers {int} - the number of worker processes.                       #
+# Retn: {float} - the run time in seconds.                                    #
+###############################################################################
+def RunPool(sources, numNodes, workers):
+	router.addressList = array("I", range(numNodes))
+	expected = {}
+	for source, router.prevList, router.portList in router.AllSourcesSPF(
+			sources, numNodes):
+		expected[source] = router.CreateBinaryFlowTablePacket(
+			router.BuildTable(numNodes))
+	router.numWorkers = workers
+	router.workerPool = ProcessPoolExecutor(workers, get_context("spawn"),
+		initializer=router.WorkerInit, initargs=(router.useLinkCost,
+		router.useEcmp))
+	router.workerPool.submit(router.WorkerInit, router.useLinkCost,
+		router.useEcmp).result()
+	start = time.perf_counter()
+	key = ("%d:%d:%d" % (id(router.linkDst), numNodes, workers)).encode()
+	pooled = dict(router.PoolSPF(sources, numNodes, key))
+	elapsed = time.perf_counter() - start
+	router.workerPool.shutdown()
+	if pooled != expected:
+		raise AssertionError("pooled tables differ from inline tables")
+	return elapsed
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Batched vs. per-source SPF.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[1000, 10000], help="graph sizes to run")
+	parser.add_argument("-d", "--degree", type=float, default=4,
+		help="average node degree")
+	parser.add_argument("-k", "--sources", type=int, default=256,
+		help="sources per graph (0 for every node)")
+	parser.add_argument("-w", "--weighted", action="store_true",
+		help="use link costs instead of hop count")
+	parser.add_argument("-p", "--workers", type=int, nargs="*", default=[],
+		help="also time the router's worker pool with these sizes")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	router.useLinkCost = args.weighted
+	rng = random.Random(args.seed)
+	print("nodes      sources   per-source (s)   batched (s)   speedup")
+	for numNodes in args.nodes:
+		result = Run(numNodes, args.degree, args.sources, rng)
+		print("%-10d %-9d %-16.3f %-13.3f %.1fx" % (numNodes,
+			result["sources"], result["single_s"], result["batch_s"],
+			result["single_s"]/max(result["batch_s"], 1e-9)))
+		if len(args.workers) > 0:
+			sources = list(range(numNodes))[:result["sources"]]
+			for workers in args.workers:
+				print("           %d worker(s): %.3f s" % (workers,
+					RunPool(sources, numNodes, workers)))
+	if router.sharedTopology is not None:
+		router.sharedTopology[1].close()
+		router.sharedTopology[1].unlink()
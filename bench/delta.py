@@ -0,0 +1,126 @@
+###############################################################################
+# Name: delta.py                                                              #
+#                                                                             #
+# Measures versioned flow table deltas against full flow tables on random     #
+# sparse graphs under single-link churn (a bidirectional link is deleted,     #
+# then added back): bytes on the wire and the time the switch takes to apply  #
+# each one. Every patched table is checked against the full table.            #
+###############################################################################
+
+from array import array
+import argparse
+import random
+import time
+
+import controller
+import router
+import switch
+from bench.topology import RandomGraph, ToColumns
+from protocol import deltaHeader
+
+###############################################################################
+# Func: FlowTablePackets                                                      #
+# Desc: Runs the router on its current topology.                              #
+# Args: numNodes {int} - the number of nodes.                                 #
+# Retn: {bytes} - the binary Flow Table Packet.                               #
+#       {string} - the text Flow Table Packet.                                #
+###############################################################################
+def FlowTablePackets(numNodes):
+	router.prevList, router.portList, _ = router.Dijkstra(numNodes)
+	table = router.BuildTable(numNodes)
+	return (router.CreateBinaryFlowTablePacket(table),
+		router.CreateFlowTablePacket(table))
+
+###############################################################################
+# Func: Timed                                                                 #
+# Desc: Runs a function and times it.                                         #
+# Args: func {function} - the function to run.                                #
+#       *args - its arguments.                                                #
+# Retn: {any} - the return value.                                             #
+#       {float} - the run time in milliseconds.                               #
+###############################################################################
+def Timed(func, *args):
+	start = time.perf_counter()
+	result = func(*args)
+	return result, 1000*(time.perf_counter() - start)
+
+###############################################################################
+# Func: Run                                                                   #
+# Desc: Runs the flap stream on one graph size.                               #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       degree {float} - the average node degree.                             #
+#       flaps {int} - the number of links to flap.                            #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - averages per update.                                         #
+###############################################################################
+def Run(numNodes, degree, flaps, rng):
+	links = RandomGraph(numNodes, degree, rng)
+	router.sourceVertex = rng.randrange(numNodes)
+	router.addressList = array("I", range(10 << 24, (10 << 24) + numNodes))
+	history = controller.FlowHistory()
+	held = (0, 0)
+	totals = dict.fromkeys(["text_bytes", "full_bytes", "delta_bytes", "rows",
+		"text_apply_ms", "full_apply_ms", "delta_apply_ms"], 0.0)
+	updates = 0
+	version = 0
+	for flap in range(flaps + 1):
+		u, v = rng.choice(list(links))
+		down = dict(links)
+		del down[(u, v)]
+		del down[(v, u)]
+		for state in (down, links):				# Link down, then back up.
+			router.BuildCSR(numNodes, *ToColumns(state))
+			full, text = FlowTablePackets(numNodes)
+			version += 1
+			history.Record(full, version)
+			delta = history.Delta(held)
+			held = (controller.flowEpoch, history.seq)
+			_, deltaTime = Timed(switch.ApplyFlowDelta, delta)
+			patched = switch.flowTable
+			if flap == 0:						# Warm-up: the first table.
+				continue
+			_, fullTime = Timed(switch.ParseBinaryFlowTablePacket, full)
+			if patched.hosts != switch.flowTable.hosts:
+				raise AssertionError("patched table differs from full table")
+			_, textTime = Timed(switch.ParseFlowTablePacket, text)
+			switch.flowTable = patched
+			switch.flowEpoch, switch.flowSeq = held
+			upserts, removals = deltaHeader.unpack_from(delta)[3:]
+			totals["text_bytes"] += len(text)
+			totals["full_bytes"] += len(full)
+			totals["delta_bytes"] += len(delta)
+			totals["rows"] += upserts + removals
+			totals["text_apply_ms"] += textTime
+			totals["full_apply_ms"] += fullTime
+			totals["delta_apply_ms"] += deltaTime
+			updates += 1
+	result = {key: total/updates for key, total in totals.items()}
+	result.update({"nodes": numNodes, "updates": updates})
+	return result
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Flow table deltas vs. full "
+		+ "tables under link churn.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[1000, 10000, 50000], help="graph sizes to run")
+	parser.add_argument("-d", "--degree", type=float, default=4,
+		help="average node degree")
+	parser.add_argument("-f", "--flaps", type=int, default=20,
+		help="number of single-link flaps per graph")
+	parser.add_argument("-w", "--weighted", action="store_true",
+		help="use link costs instead of hop count")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	router.useLinkCost = args.weighted
+	rng = random.Random(args.seed)
+	print("nodes    rows changed   bytes text / full / delta      "
+		+ "apply text / full / delta (ms)")
+	for numNodes in args.nodes:
+		result = Run(numNodes, args.degree, args.flaps, rng)
+		print("%-8d %-14.1f %-30s %.3f / %.3f / %.3f" % (numNodes,
+			result["rows"], "%d / %d / %d" % (result["text_bytes"],
+			result["full_bytes"], result["delta_bytes"]),
+			result["text_apply_ms"], result["full_apply_ms"],
+			result["delta_apply_ms"]))
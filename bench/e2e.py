@@ -0,0 +1,200 @@
+###############################################################################
+# Name: e2e.py                                                                #
+#                                                                             #
+# End-to-end update latency over loopback. The router and controller are      #
+# started as separate processes on free ports, with the controller loading a  #
+# synthetic topology, and this program plays a switch: it flaps one of its    #
+# links (DELETE, then ADD back) and times each Update Packet until its flow   #
+# table arrives. Other switches can be subscribed so every update also pushes #
+# their tables. The per-stage latencies both programs recorded (their STATS   #
+# answer) are kept with the results. Extra arguments for either program are   #
+# passed through, e.g.                                                        #
+#   python -m bench.e2e -k fattree -n 1000 --router-args="--incremental"      #
+###############################################################################
+
+from socket import create_connection, IPPROTO_TCP, TCP_NODELAY
+import argparse
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench.report import Summary, WriteReport
+from bench.topology import Generate, HostAddress, WriteTopology, generators
+from protocol import *
+from stats import GetStats
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+###############################################################################
+# Func: StartProgram                                                          #
+# Desc: Starts one of the programs and waits for it to start listening.       #
+# Args: script {string} - the program, e.g. "router.py".                      #
+#       args {list: string} - its arguments.                                  #
+#       logName {string} - file its output goes to.                           #
+#       timeout {float} - seconds to wait.                                    #
+# Retn: {Popen} - the process.                                                #
+#       {int} - the port it listens on.                                       #
+###############################################################################
+def StartProgram(script, args, logName, timeout=60):
+	with open(logName, 'w') as log:
+		process = subprocess.Popen([sys.executable, os.path.join(repoRoot,
+			script)] + args, stdout=log, stderr=subprocess.STDOUT,
+			cwd=os.path.dirname(logName))
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		with open(logName, 'r') as log:
+			match = re.search(r"listening on port (\d+)", log.read())
+		if match is not None:
+			return process, int(match.group(1))
+		if process.poll() is not None:
+			break
+		time.sleep(0.05)
+	process.kill()
+	with open(logName, 'r') as log:
+		raise RuntimeError(script + " did not start:\n" + log.read())
+
+###############################################################################
+# Func: Subscribe                                                             #
+# Desc: Subscribes a switch and reads (and drops) every table pushed to it    #
+#       on a daemon thread.                                                   #
+# Args: port {int} - the controller's port.                                   #
+#       switchID {int} - ID of the switch.                                    #
+# Retn: {socket} - the subscription.                                          #
+###############################################################################
+def Subscribe(port, switchID):
+	sock = create_connection(("localhost", port))
+	SendPacket(sock, MSG_SUBSCRIBE, str(switchID), 1)
+	RecvFrame(sock)
+	def Drain():
+		try:
+			while RecvFrame(sock)[2] is not None:
+				pass
+		except (OSError, ProtocolError):
+			pass
+	threading.Thread(target=Drain, daemon=True).start()
+	return sock
+
+###############################################################################
+# Func: Flap                                                                  #
+# Desc: Deletes and re-adds one link of a switch, again and again, and times  #
+#       every update. The switch states the flow table version it holds, as   #
+#       switch.py does, so binary replies are deltas.                         #
+# Args: port {int} - the controller's port.                                   #
+#       srcID {int} - ID of the switch.                                       #
+#       linkPort {int} - the port of the link on the switch.                  #
+#       dstAddr {string} - address at the other end of the link.              #
+#       count {int} - the number of updates to time.                          #
+#       warmup {int} - updates to send first, untimed.                        #
+# Retn: {list: float} - the latency of each update in seconds.                #
+###############################################################################
+def Flap(port, srcID, linkPort, dstAddr, count, warmup):
+	sock = create_connection(("localhost", port))
+	sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+	held = "0:0"
+	latencies = []
+	for update in range(warmup + count):
+		if update % 2 == 0:
+			packet = "%d, DELETE, %d, 0.0.0.0, %s" % (srcID, linkPort, held)
+		else:
+			packet = "%d, ADD, %d, %s, %s" % (srcID, linkPort, dstAddr, held)
+		start = time.perf_counter()
+		SendPacket(sock, MSG_UPDATE, packet, update + 1)
+		msgType, requestID, reply = RecvFrame(sock)
+		elapsed = time.perf_counter() - start
+		if reply is None or requestID != update + 1:
+			raise RuntimeError("no flow table for update " + str(update))
+		if msgType == MSG_FLOW_DELTA:
+			epoch, _, seq = deltaHeader.unpack_from(reply)[:3]
+			held = "%d:%d" % (epoch, seq)
+		if update >= warmup:
+			latencies.append(elapsed)
+	sock.close()
+	return latencies
+
+###############################################################################
+# Func: Run                                                                   #
+# Desc: Starts the programs on one topology and times the updates.            #
+# Args: kind {string} - the kind of topology.                                 #
+#       numNodes {int} - about how many nodes.                                #
+#       args {Namespace} - the benchmark's arguments.                         #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - latency results.                                             #
+###############################################################################
+def Run(kind, numNodes, args, rng):
+	links, numNodes = Generate(kind, numNodes, rng)
+	(srcID, dstID), (linkPort, _) = rng.choice(sorted(links.items()))
+	with tempfile.TemporaryDirectory() as tmpDir:
+		topoName = os.path.join(tmpDir, "topology.txt")
+		WriteTopology(links, numNodes, topoName, True)
+		processes = []
+		try:
+			routerProcess, routerPort = StartProgram("router.py", ["--port",
+				"0"] + shlex.split(args.router_args),
+				os.path.join(tmpDir, "router.log"))
+			processes.append(routerProcess)
+			controllerProcess, port = StartProgram("controller.py", ["--port",
+				"0", "--router-port", str(routerPort), "--topology", topoName]
+				+ shlex.split(args.controller_args),
+				os.path.join(tmpDir, "controller.log"))
+			processes.append(controllerProcess)
+			subscribers = [Subscribe(port, ID) for ID in rng.sample(
+				range(numNodes), min(args.subscribers, numNodes))]
+			latencies = Flap(port, srcID, linkPort, HostAddress(dstID),
+				args.updates, args.warmup)
+			stats = GetStats("localhost", port)
+			for sock in subscribers:
+				sock.close()
+		finally:
+			for process in processes:
+				process.terminate()
+				process.wait()
+	result = {"topology": kind, "nodes": numNodes, "links": len(links)//2,
+		"subscribers": len(subscribers), "updates": len(latencies),
+		"updates_per_s": len(latencies)/sum(latencies)}
+	result.update(Summary(latencies))
+	result["stages"] = stats
+	return result
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="End-to-end update latency "
+		+ "over loopback.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[10, 1000, 10000], help="topology sizes to run")
+	parser.add_argument("-k", "--kinds", nargs="+", choices=generators,
+		default=["fattree"], help="kinds of topology to run")
+	parser.add_argument("-u", "--updates", type=int, default=200,
+		help="updates to time per topology")
+	parser.add_argument("--warmup", type=int, default=10,
+		help="updates to send first, untimed")
+	parser.add_argument("-S", "--subscribers", type=int, default=0,
+		help="other switches to subscribe")
+	parser.add_argument("--router-args", default="",
+		help="extra arguments for router.py")
+	parser.add_argument("--controller-args", default="",
+		help="extra arguments for controller.py")
+	parser.add_argument("-j", "--json", metavar="FILE",
+		help="also write the results to FILE as JSON (- for stdout)")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	results = []
+	print("topology   nodes     links     updates   p50 (ms)   p99 (ms)   "
+		+ "max (ms)   updates/s")
+	for kind in args.kinds:
+		for numNodes in args.nodes:
+			result = Run(kind, numNodes, args, rng)
+			print("%-10s %-9d %-9d %-9d %-10.3f %-10.3f %-10.3f %.1f" % (kind,
+				result["nodes"], result["links"], result["updates"],
+				1000*result["p50_s"], 1000*result["p99_s"],
+				1000*result["max_s"], result["updates_per_s"]))
+			results.append(result)
+	if args.json is not None:
+		WriteReport(args.json, "e2e", args, results)
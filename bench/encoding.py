@@ -0,0 +1,125 @@
+###############################################################################
+# Name: encoding.py                                                           #
+#                                                                             #
+# Compares the text and binary encodings of the Adj. Matrix and Flow Table    #
+# Packets: packet size, the time to create each packet and the time to parse  #
+# it back, on random sparse topologies.                                       #
+###############################################################################
+
+import argparse
+import random
+import time
+
+import controller
+import router
+import switch
+from bench.topology import RandomGraph
+
+###############################################################################
+# Func: LoadController                                                        #
+# Desc: Replaces the controller's topology with the given links.              #
+# Args: links {dict} - (u, v) -> (port, cost).                                #
+#       numNodes {int} - the number of nodes.                                 #
+# Retn: N/A                                                                   #
+###############################################################################
+def LoadController(links, numNodes):
+	controller.addressMapList = []
+	controller.idByAddr = {}
+	controller.packedAddrs = controller.array("I")
+	controller.portMap = []
+	controller.neighborMap = []
+	controller.freePorts = []
+	controller.nextPort = []
+	controller.routerSync = controller.TopologySync()
+	for ID in range(numNodes):
+		controller.AddHost("10.%d.%d.%d" % (ID >> 16, (ID >> 8) & 255, ID & 255))
+	for (u, v), (port, cost) in links.items():
+		controller.Link(u, port, v, cost)
+
+###############################################################################
+# Func: Timed                                                                 #
+# Desc: Runs a function and times it.                                         #
+# Args: func {function} - the function to run.                                #
+#       *args - its arguments.                                                #
+# Retn: {any} - the return value.                                             #
+#       {float} - the run time in milliseconds.                               #
+###############################################################################
+def Timed(func, *args):
+	start = time.perf_counter()
+	result = func(*args)
+	return result, 1000*(time.perf_counter() - start)
+
+###############################################################################
+# Func: Run                                                                   #
+# Desc: Creates and parses both packets in both encodings for one topology.   #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       degree {float} - the average node degree.                             #
+#       rng {Random} - random number generator.                               #
+# Retn: {list: dict} - one result per packet and encoding.                    #
+###############################################################################
+def Run(numNodes, degree, rng):
+	LoadController(RandomGraph(numNodes, degree, rng), numNodes)
+	source = rng.randrange(numNodes)
+	results = []
+
+	# Adj. Matrix Packet, controller -> router.
+	text, createText = Timed(lambda: "".join(
+		controller.CreateAdjMatrixPacket(source)).encode())
+	binary, createBinary = Timed(controller.CreateBinaryAdjPacket, source)
+	_, parseText = Timed(router.ParseAdjMatrixPacket, text.decode())
+	textTable = router.CreateFlowTablePacket(BuildTable(numNodes))
+	_, parseBinary = Timed(router.ParseBinaryAdjPacket, binary)
+	binaryTable = router.CreateBinaryFlowTablePacket(BuildTable(numNodes))
+	results.append({"packet": "adjacency", "nodes": numNodes,
+		"text_bytes": len(text), "binary_bytes": len(binary),
+		"text_create_ms": createText, "binary_create_ms": createBinary,
+		"text_parse_ms": parseText, "binary_parse_ms": parseBinary})
+
+	# Flow Table Packet, router -> switch.
+	_, parseText = Timed(switch.ParseFlowTablePacket, textTable)
+	textFlows = sorted((flow.address, flow.port)
+		for flow in switch.flowTable.Flows())
+	_, parseBinary = Timed(switch.ParseBinaryFlowTablePacket, binaryTable)
+	binaryFlows = sorted((flow.address, flow.port)
+		for flow in switch.flowTable.Flows())
+	if textFlows != binaryFlows:
+		raise AssertionError("text and binary flow tables differ")
+	results.append({"packet": "flow table", "nodes": numNodes,
+		"text_bytes": len(textTable), "binary_bytes": len(binaryTable),
+		"text_create_ms": None, "binary_create_ms": None,
+		"text_parse_ms": parseText, "binary_parse_ms": parseBinary})
+	return results
+
+###############################################################################
+# Func: BuildTable                                                            #
+# Desc: Runs Dijkstra and BuildTable on the topology the router last parsed.  #
+# Args: numNodes {int} - the number of nodes.                                 #
+# Retn: {list: Flow} - flow table.                                            #
+###############################################################################
+def BuildTable(numNodes):
+	router.prevList, router.portList, _ = router.Dijkstra(numNodes)
+	return router.BuildTable(numNodes)
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Text vs. binary packets.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[100, 1000, 3000], help="topology sizes to run")
+	parser.add_argument("-d", "--degree", type=float, default=4,
+		help="average node degree")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	print("packet       nodes   text (B)     binary (B)   text create/parse "
+		+ "(ms)   binary create/parse (ms)")
+	for numNodes in args.nodes:
+		for result in Run(numNodes, args.degree, rng):
+			text = "%.3f" % result["text_parse_ms"]
+			binary = "%.3f" % result["binary_parse_ms"]
+			if result["text_create_ms"] is not None:
+				text = "%.3f / %s" % (result["text_create_ms"], text)
+				binary = "%.3f / %s" % (result["binary_create_ms"], binary)
+			print("%-12s %-7d %-12d %-12d %-23s %s" % (result["packet"],
+				result["nodes"], result["text_bytes"], result["binary_bytes"],
+				text, binary))
@@ -0,0 +1,94 @@
+###############################################################################
+# Name: incremental.py                                                        #
+#                                                                             #
+# Compares the router's full Dijkstra with IncrementalDijkstra on random      #
+# sparse graphs under a stream of single-link flaps (a bidirectional link is  #
+# deleted, then added back). Each flap reaches the router as Topology Delta   #
+# Packets, as the controller sends it, or with --reload as the whole          #
+# topology. Every repaired tree is checked against the full run before it is  #
+# timed.                                                                      #
+###############################################################################
+
+from collections import OrderedDict
+import argparse
+import random
+import time
+
+from protocol import EncodeTopologyDelta
+import router
+from bench.topology import RandomGraph, ToColumns
+
+###############################################################################
+# Func: Run                                                                   #
+# Desc: Runs the flap stream on one graph size.                               #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       degree {float} - the average node degree.                             #
+#       flaps {int} - the number of links to flap.                            #
+#       rng {Random} - random number generator.                               #
+#       reload {bool} - load the whole topology after every change instead    #
+#                       of applying a delta.                                  #
+# Retn: {dict} - timing results.                                              #
+###############################################################################
+def Run(numNodes, degree, flaps, rng, reload=False):
+	links = RandomGraph(numNodes, degree, rng)
+	router.sourceVertex = rng.randrange(numNodes)
+	router.spfTrees = OrderedDict()
+	router.useIncremental = True
+	router.addressList = list(range(numNodes))
+	router.BuildCSR(numNodes, *ToColumns(links))
+	router.syncEpoch = 0 if reload else 1		# As ComputeTopologySync does.
+	router.IncrementalDijkstra(numNodes)			# Build the first tree.
+	full = 0.0
+	incremental = 0.0
+	updates = 0
+	for _ in range(flaps):
+		u, v = rng.choice(list(links))
+		down = dict(links)
+		del down[(u, v)]
+		del down[(v, u)]
+		(portUV, costUV), (portVU, costVU) = links[(u, v)], links[(v, u)]
+		deltas = (EncodeTopologyDelta([], [], [], [], [], [u, v],
+			[portUV, portVU]), EncodeTopologyDelta([], [u, v], [v, u],
+			[costUV, costVU], [portUV, portVU], [], []))
+		for state, delta in zip((down, links), deltas):	# Down, then back up.
+			if reload:
+				router.BuildCSR(numNodes, *ToColumns(state))
+			else:
+				router.ApplyTopologyDelta(delta)
+			start = time.perf_counter()
+			prev, egress, _ = router.Dijkstra(numNodes)
+			full += time.perf_counter() - start
+			start = time.perf_counter()
+			prevInc, egressInc = router.IncrementalDijkstra(numNodes)
+			incremental += time.perf_counter() - start
+			if prev != prevInc or egress != egressInc:
+				raise AssertionError("repaired tree differs from full run")
+			updates += 1
+	return {"nodes": numNodes, "updates": updates,
+		"full_ms": 1000*full/updates, "incremental_ms": 1000*incremental/updates}
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Incremental vs. full SPF.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[1000, 10000, 50000], help="graph sizes to run")
+	parser.add_argument("-d", "--degree", type=float, default=4,
+		help="average node degree")
+	parser.add_argument("-f", "--flaps", type=int, default=50,
+		help="number of single-link flaps per graph")
+	parser.add_argument("-w", "--weighted", action="store_true",
+		help="use link costs instead of hop count")
+	parser.add_argument("--reload", action="store_true",
+		help="load the whole topology after every change, as for Adj. "
+			+ "Matrix Packets, instead of applying Topology Delta Packets")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	router.useLinkCost = args.weighted
+	rng = random.Random(args.seed)
+	print("nodes      updates   full (ms)   incremental (ms)   speedup")
+	for numNodes in args.nodes:
+		result = Run(numNodes, args.degree, args.flaps, rng, args.reload)
+		print("%-10d %-9d %-11.3f %-18.3f %.1fx" % (numNodes, result["updates"],
+			result["full_ms"], result["incremental_ms"],
+			result["full_ms"]/max(result["incremental_ms"], 1e-9)))
@@ -0,0 +1,91 @@
+###############################################################################
+# Name: load.py                                                               #
+#                                                                             #
+# Times loading a topology in the dense matrix and the sparse edge list       #
+# formats, on random sparse graphs: the controller reading the file and the   #
+# router parsing the same text as a packet. The dense format is O(N^2) in     #
+# size, so it is only run up to --dense-max nodes. Both loads of a graph are  #
+# checked to give the same topology.                                          #
+###############################################################################
+
+from array import array
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import controller
+import router
+from bench.topology import RandomGraph, WriteTopology
+
+###############################################################################
+# Func: ResetController                                                       #
+# Desc: Empties the controller's topology indexes.                            #
+# Args: N/A                                                                   #
+# Retn: N/A                                                                   #
+###############################################################################
+def ResetController():
+	controller.addressMapList = []
+	controller.idByAddr = {}
+	controller.packedAddrs = array("I")
+	controller.portMap = []
+	controller.neighborMap = []
+	controller.freePorts = []
+	controller.nextPort = []
+
+###############################################################################
+# Func: TimeLoad                                                              #
+# Desc: Loads one topology file in the controller and in the router.          #
+# Args: fileName {string} - the topology file.                                #
+# Retn: {float} - the controller load time in seconds.                        #
+#       {float} - the router parse time in seconds.                           #
+#       {tuple} - the topology loaded by each, for checking.                  #
+###############################################################################
+def TimeLoad(fileName):
+	ResetController()
+	start = time.perf_counter()
+	controller.loadNetTopo(fileName)
+	controllerTime = time.perf_counter() - start
+	with open(fileName, 'r') as topoFile:
+		text = topoFile.read()
+	start = time.perf_counter()
+	router.ParseAdjMatrixPacket(text)
+	routerTime = time.perf_counter() - start
+	links = sorted((entry.srcID, entry.dstID, entry.port, entry.cost)
+		for ports in controller.portMap for entry in ports.values())
+	adjacency = [sorted(row) for row in router.AdjacencyRows()]
+	return controllerTime, routerTime, (links, adjacency)
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Dense vs. sparse topology "
+		+ "load times.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[1000, 5000, 100000], help="graph sizes to run")
+	parser.add_argument("-d", "--degree", type=float, default=4,
+		help="average node degree")
+	parser.add_argument("--dense-max", type=int, default=5000,
+		help="largest graph to also load in the dense format")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	print("nodes     links      format   file (MB)   controller (s)   router (s)")
+	with tempfile.TemporaryDirectory() as tmpDir:
+		for numNodes in args.nodes:
+			links = RandomGraph(numNodes, args.degree, rng)
+			loaded = None
+			for sparse in (False, True):
+				if not sparse and numNodes > args.dense_max:
+					continue
+				fileName = os.path.join(tmpDir, "topology.txt")
+				WriteTopology(links, numNodes, fileName, sparse)
+				size = os.path.getsize(fileName)/1e6
+				controllerTime, routerTime, topology = TimeLoad(fileName)
+				if loaded is not None and topology != loaded:
+					raise AssertionError("dense and sparse loads differ")
+				loaded = topology
+				print("%-9d %-10d %-8s %-11.1f %-16.3f %.3f" % (numNodes,
+					len(links), "sparse" if sparse else "dense", size,
+					controllerTime, routerTime))
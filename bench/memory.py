@@ -0,0 +1,158 @@
+###############################################################################
+# Name: memory.py                                                             #
+#                                                                             #
+# Reports the memory taken by the routing state, measured with tracemalloc,   #
+# in the layouts used before the compact representations (one object per     #
+# flow, host and link, none with __slots__, and the router's adjacency list   #
+# of tuples) and in the current ones (array columns, CSR link arrays and      #
+# __slots__ objects). Flow tables are measured at --flows entries and         #
+# topologies at --nodes nodes, by default 1M and 100k.                        #
+#   python -m bench.memory --json memory.json                                 #
+###############################################################################
+
+from array import array
+import argparse
+import random
+import tracemalloc
+
+import controller
+import router
+import switch
+from bench.report import WriteReport
+from bench.topology import Generate, ToColumns, generators
+from protocol import IntToAddr
+
+###############################################################################
+# Class: OldFlow                                                              #
+# Description: A flow table row as the router and switch kept it before,      #
+#              without __slots__.                                             #
+###############################################################################
+class OldFlow:
+	def __init__(self, address, port):
+		self.address = address
+		self.port = port
+
+###############################################################################
+# Class: OldAddrMap                                                           #
+# Description: A host as the router and controller kept it before, without    #
+#              __slots__.                                                     #
+###############################################################################
+class OldAddrMap:
+	def __init__(self, ID, address):
+		self.ID = ID
+		self.address = address
+
+###############################################################################
+# Class: OldSrcPortDstMap                                                     #
+# Description: A link as the controller kept it before, without __slots__.    #
+###############################################################################
+class OldSrcPortDstMap:
+	def __init__(self, srcID, port, dstID, cost=1):
+		self.srcID = srcID
+		self.port = port
+		self.dstID = dstID
+		self.cost = cost
+
+###############################################################################
+# Func: Measure                                                               #
+# Desc: Returns how much memory a structure holds on to once it is built      #
+#       (what is freed while building it is not counted).                     #
+# Args: build {function} - builds the structure.                              #
+# Retn: {int} - bytes.                                                        #
+###############################################################################
+def Measure(build):
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	kept = build()
+	size = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	del kept
+	return size
+
+###############################################################################
+# Func: FlowTables                                                            #
+# Desc: Measures a flow table of numFlows host routes, as the router builds   #
+#       it (packed addresses) and as the switch lists it (dotted addresses).  #
+# Args: numFlows {int} - the number of rows.                                  #
+#       rng {Random} - random number generator.                               #
+# Retn: {list: tuple} - (structure, bytes before, bytes now) per row.         #
+###############################################################################
+def FlowTables(numFlows, rng):
+	addresses = array("I", range(10 << 24, (10 << 24) + numFlows))
+	ports = array("H", [rng.randint(1, 48) for _ in range(numFlows)])
+	return [("router flow table",
+		Measure(lambda: [OldFlow(address, port)
+			for address, port in zip(addresses, ports)]),
+		Measure(lambda: (array("I", addresses), array("H", ports)))),
+		("switch Flows()",
+		Measure(lambda: [OldFlow(IntToAddr(address), port)
+			for address, port in zip(addresses, ports)]),
+		Measure(lambda: [switch.Flow(IntToAddr(address), port)
+			for address, port in zip(addresses, ports)]))]
+
+###############################################################################
+# Func: Topologies                                                            #
+# Desc: Measures a topology as the router keeps it (hosts and links) and as   #
+#       the controller keeps its links.                                       #
+# Args: links {dict} - (u, v) -> (port, cost).                                #
+#       numNodes {int} - the number of nodes.                                 #
+# Retn: {list: tuple} - (structure, bytes before, bytes now) per row.         #
+###############################################################################
+def Topologies(links, numNodes):
+	columns = ToColumns(links)
+	def OldRouter():
+		adjList = [[] for _ in range(numNodes)]
+		for u, v, port, cost in zip(*columns):
+			adjList[u].append((v, port, cost))
+		return adjList, [OldAddrMap(ID, (10 << 24) + ID)
+			for ID in range(numNodes)]
+	def Router():
+		router.BuildCSR(numNodes, *[array(column.typecode, column)
+			for column in columns])
+		router.addressList = array("I", range(10 << 24, (10 << 24) + numNodes))
+		return (router.linkStart, router.linkDst, router.linkPort,
+			router.linkCost, router.addressList)
+	def PortMap(Link):
+		portMap = [{} for _ in range(numNodes)]
+		for u, v, port, cost in zip(*columns):
+			portMap[u][port] = Link(u, port, v, cost)
+		return portMap
+	return [("router topology", Measure(OldRouter), Measure(Router)),
+		("controller links", Measure(lambda: PortMap(OldSrcPortDstMap)),
+		Measure(lambda: PortMap(controller.SrcPortDstMap))),
+		("controller hosts",
+		Measure(lambda: [OldAddrMap(ID, IntToAddr((10 << 24) + ID))
+			for ID in range(numNodes)]),
+		Measure(lambda: [controller.AddrMap(ID, IntToAddr((10 << 24) + ID))
+			for ID in range(numNodes)]))]
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Memory taken by the flow "
+		+ "tables and topology, before and now.")
+	parser.add_argument("-f", "--flows", type=int, default=1000000,
+		help="flow table rows")
+	parser.add_argument("-n", "--nodes", type=int, default=100000,
+		help="about how many topology nodes")
+	parser.add_argument("-k", "--kind", choices=generators, default="random",
+		help="kind of topology")
+	parser.add_argument("-j", "--json", metavar="FILE",
+		help="also write the results to FILE as JSON (- for stdout)")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	links, numNodes = Generate(args.kind, args.nodes, rng)
+	rows = [(args.flows, "flows", row) for row in FlowTables(args.flows, rng)]
+	rows += [(numNodes, "nodes", row) for row in Topologies(links, numNodes)]
+	results = []
+	print("structure            size              before (MB)   now (MB)   "
+		+ "ratio")
+	for size, unit, (structure, before, now) in rows:
+		print("%-20s %-17s %-13.1f %-10.1f %.1fx" % (structure,
+			"%d %s" % (size, unit), before/2**20, now/2**20,
+			before/max(now, 1)))
+		results.append({"structure": structure, unit: size,
+			"before_bytes": before, "now_bytes": now})
+	if args.json is not None:
+		WriteReport(args.json, "memory", args, results)
@@ -0,0 +1,90 @@
+###############################################################################
+# Name: micro.py                                                              #
+#                                                                             #
+# Times the main stages of a flow table update one at a time, on synthetic    #
+# topologies of each kind: the controller's CreateAdjMatrixPacket, the        #
+# router's ParseAdjMatrixPacket, Dijkstra and BuildTable, and the switch's    #
+# ParseFlowTablePacket. The text Adj. Matrix Packet is timed as the sparse    #
+# edge list, and as the dense matrix up to --dense-max nodes.                 #
+#   python -m bench.micro -n 10 1000 100000 --json micro.json                 #
+###############################################################################
+
+import argparse
+import random
+
+import controller
+import router
+import switch
+from bench.encoding import LoadController
+from bench.report import Repeat, Summary, WriteReport
+from bench.topology import Generate, generators
+
+###############################################################################
+# Func: Run                                                                   #
+# Desc: Times every stage on one topology.                                    #
+# Args: kind {string} - the kind of topology.                                 #
+#       numNodes {int} - about how many nodes.                                #
+#       repeat {int} - runs per stage.                                        #
+#       denseMax {int} - largest topology to time the dense matrix on.        #
+#       rng {Random} - random number generator.                               #
+# Retn: {list: dict} - one result per stage.                                  #
+###############################################################################
+def Run(kind, numNodes, repeat, denseMax, rng):
+	links, numNodes = Generate(kind, numNodes, rng)
+	LoadController(links, numNodes)
+	source = rng.randrange(numNodes)
+	results = []
+	def Stage(stage, func, *args):
+		result, times = Repeat(repeat, func, *args)
+		row = {"topology": kind, "nodes": numNodes, "links": len(links)//2,
+			"stage": stage}
+		row.update(Summary(times))
+		results.append(row)
+		return result
+
+	formats = [True] if numNodes > denseMax else [False, True]
+	for sparse in formats:
+		name = " (sparse)" if sparse else " (dense)"
+		packet = Stage("CreateAdjMatrixPacket" + name, lambda: "".join(
+			controller.CreateAdjMatrixPacket(source, sparse)))
+		Stage("ParseAdjMatrixPacket" + name, router.ParseAdjMatrixPacket,
+			packet)
+	router.prevList, router.portList, _ = Stage("Dijkstra", router.Dijkstra,
+		numNodes)
+	table = Stage("BuildTable", router.BuildTable, numNodes)
+	Stage("ParseFlowTablePacket", switch.ParseFlowTablePacket,
+		router.CreateFlowTablePacket(table))
+	return results
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Per-stage microbenchmarks.")
+	parser.add_argument("-n", "--nodes", type=int, nargs="+",
+		default=[10, 1000, 100000], help="topology sizes to run")
+	parser.add_argument("-k", "--kinds", nargs="+", choices=generators,
+		default=generators, help="kinds of topology to run")
+	parser.add_argument("-r", "--repeat", type=int, default=3,
+		help="runs per stage")
+	parser.add_argument("--dense-max", type=int, default=3000,
+		help="largest topology to also time the dense matrix on")
+	parser.add_argument("-w", "--weighted", action="store_true",
+		help="use link costs instead of hop count")
+	parser.add_argument("-j", "--json", metavar="FILE",
+		help="also write the results to FILE as JSON (- for stdout)")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	router.useLinkCost = args.weighted
+	rng = random.Random(args.seed)
+	results = []
+	print("topology   nodes     links     stage                            "
+		+ "p50 (ms)     min (ms)")
+	for kind in args.kinds:
+		for numNodes in args.nodes:
+			for result in Run(kind, numNodes, args.repeat, args.dense_max, rng):
+				print("%-10s %-9d %-9d %-32s %-12.3f %.3f" % (kind,
+					result["nodes"], result["links"], result["stage"],
+					1000*result["p50_s"], 1000*result["min_s"]))
+				results.append(result)
+	if args.json is not None:
+		WriteReport(args.json, "micro", args, results)
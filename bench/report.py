@@ -0,0 +1,98 @@
+###############################################################################
+# Name: report.py                                                             #
+#                                                                             #
+# Timing and JSON output shared by the benchmarks. A report holds the         #
+# benchmark's name and arguments, where and when it ran (host, Python,        #
+# numpy, git commit) and a list of result rows, so runs can be kept and       #
+# compared to catch regressions.                                              #
+###############################################################################
+
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+###############################################################################
+# Func: Percentile                                                            #
+# Desc: Returns a percentile of some samples (nearest rank).                  #
+# Args: samples {list: float} - the samples.                                  #
+#       percent {float} - the percentile, 0 to 100.                           #
+# Retn: {float} - the percentile.                                             #
+###############################################################################
+def Percentile(samples, percent):
+	ordered = sorted(samples)
+	rank = max(math.ceil(percent*len(ordered)/100), 1)
+	return ordered[min(rank, len(ordered)) - 1]
+
+###############################################################################
+# Func: Repeat                                                                #
+# Desc: Runs a function several times and times each run.                     #
+# Args: repeat {int} - the number of runs.                                    #
+#       func {function} - the function to run.                                #
+#       *args - its arguments.                                                #
+# Retn: {any} - the return value of the last run.                             #
+#       {list: float} - the run times in seconds.                             #
+###############################################################################
+def Repeat(repeat, func, *args):
+	times = []
+	for _ in range(max(repeat, 1)):
+		start = time.perf_counter()
+		result = func(*args)
+		times.append(time.perf_counter() - start)
+	return result, times
+
+###############################################################################
+# Func: Summary                                                               #
+# Desc: Summarizes run times.                                                 #
+# Args: times {list: float} - the run times in seconds.                       #
+# Retn: {dict} - runs and the min, median, p99 and max in seconds.            #
+###############################################################################
+def Summary(times):
+	return {"runs": len(times), "min_s": min(times),
+		"p50_s": Percentile(times, 50), "p99_s": Percentile(times, 99),
+		"max_s": max(times)}
+
+###############################################################################
+# Func: Environment                                                           #
+# Desc: Describes where the benchmark ran.                                    #
+# Args: N/A                                                                   #
+# Retn: {dict} - the environment.                                             #
+###############################################################################
+def Environment():
+	try:
+		import numpy
+		numpyVersion = numpy.__version__
+	except ImportError:
+		numpyVersion = None
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"],
+			capture_output=True, text=True, timeout=10,
+			cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except (OSError, subprocess.SubprocessError):
+		commit = ""
+	return {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+		"host": platform.node(), "platform": platform.platform(),
+		"cpus": os.cpu_count(), "python": sys.version.split()[0],
+		"numpy": numpyVersion, "commit": commit or None}
+
+###############################################################################
+# Func: WriteReport                                                           #
+# Desc: Writes a benchmark report as JSON.                                    #
+# Args: fileName {string} - the file to write ("-" for stdout).               #
+#       name {string} - the benchmark.                                        #
+#       args {Namespace} - its arguments.                                     #
+#       results {list: dict} - the result rows.                               #
+# Retn: N/A                                                                   #
+###############################################################################
+def WriteReport(fileName, name, args, results):
+	report = {"benchmark": name, "args": vars(args),
+		"environment": Environment(), "results": results}
+	if fileName == "-":
+		json.dump(report, sys.stdout, indent=1)
+		print()
+		return
+	with open(fileName, 'w') as reportFile:
+		json.dump(report, reportFile, indent=1)
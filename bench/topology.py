@@ -0,0 +1,240 @@
+###############################################################################
+# Name: topology.py                                                           #
+#                                                                             #
+# Synthetic topologies for the benchmarks. A topology is a dict of directed   #
+# links, (u, v) -> (port, cost), with both directions of every link present.  #
+# Fat-tree, ring, line, grid and random sparse graphs can be written to a     #
+# topology file for the controller, e.g. "python -m bench.topology fattree    #
+# 1000 fatTree.txt" (see Generate for how the size is rounded).               #
+###############################################################################
+
+from array import array
+import argparse
+import random
+
+###############################################################################
+# Func: NewLinks                                                              #
+# Desc: Starts an empty topology. Ports are numbered from 1 on every node,    #
+#       in the order its links are made, and each link gets a random cost.    #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - (u, v) -> (port, cost), filled by Connect.                   #
+#       {function} - Connect(u, v) adds both directions of a link (a loop or  #
+#                    a repeated link is ignored).                             #
+###############################################################################
+def NewLinks(numNodes, rng):
+	links = {}
+	nextPort = [1]*numNodes
+	def Connect(u, v):
+		if u == v or (u, v) in links:
+			return
+		cost = rng.randint(1, 10)
+		links[(u, v)] = (nextPort[u], cost)
+		links[(v, u)] = (nextPort[v], cost)
+		nextPort[u] += 1
+		nextPort[v] += 1
+	return links, Connect
+
+
+###############################################################################
+# Func: RandomGraph                                                           #
+# Desc: Creates a random connected sparse graph: a random spanning tree plus  #
+#       extra random links. Ports are numbered from 1 on every node.          #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       degree {float} - the average node degree.                             #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+###############################################################################
+def RandomGraph(numNodes, degree, rng):
+	links, Connect = NewLinks(numNodes, rng)
+	for v in range(1, numNodes):
+		Connect(v, rng.randrange(v))
+	for _ in range(int(numNodes*(degree - 2)/2)):
+		Connect(rng.randrange(numNodes), rng.randrange(numNodes))
+	return links
+
+###############################################################################
+# Func: ToColumns                                                             #
+# Desc: Converts a link dict to the link columns the router's BuildCSR        #
+#       takes, sorted by (u, v), e.g.                                         #
+#       router.BuildCSR(numNodes, *ToColumns(links)).                         #
+# Args: links {dict} - (u, v) -> (port, cost).                                #
+# Retn: {array: I} - source of every link.                                    #
+#       {array: I} - destination of every link.                               #
+#       {array: H} - port of every link.                                      #
+#       {array: I} - cost of every link.                                      #
+###############################################################################
+def ToColumns(links):
+	ordered = sorted(links.items())
+	return (array("I", [u for (u, v), _ in ordered]),
+		array("I", [v for (u, v), _ in ordered]),
+		array("H", [port for _, (port, cost) in ordered]),
+		array("I", [cost for _, (port, cost) in ordered]))
+
+###############################################################################
+# Func: FatTree                                                               #
+# Desc: Creates a k-ary fat-tree: (k/2)^2 core switches, then k pods of k/2   #
+#       aggregation and k/2 edge switches, then k/2 hosts per edge switch.    #
+#       Every edge switch links to every aggregation switch of its pod, and   #
+#       aggregation switch i of each pod to core switches i*k/2 to            #
+#       (i+1)*k/2 - 1.                                                        #
+# Args: k {int} - the (even) number of pods.                                  #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+#       {int} - the number of nodes, 5k^2/4 + k^3/4.                          #
+###############################################################################
+def FatTree(k, rng):
+	half = k//2
+	numCore = half*half
+	numSwitches = numCore + k*k
+	numNodes = numSwitches + k*half*half
+	links, Connect = NewLinks(numNodes, rng)
+	for pod in range(k):
+		aggs = [numCore + pod*k + i for i in range(half)]
+		edges = [numCore + pod*k + half + i for i in range(half)]
+		for i, agg in enumerate(aggs):
+			for core in range(i*half, (i + 1)*half):
+				Connect(agg, core)
+			for edge in edges:
+				Connect(edge, agg)
+		for i, edge in enumerate(edges):
+			for host in range(half):
+				Connect(edge, numSwitches + (pod*half + i)*half + host)
+	return links, numNodes
+
+###############################################################################
+# Func: Ring                                                                  #
+# Desc: Creates a ring, each node linked to the next.                         #
+# Args: numNodes {int} - the number of nodes (at least 3).                    #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+###############################################################################
+def Ring(numNodes, rng):
+	links, Connect = NewLinks(numNodes, rng)
+	for u in range(numNodes):
+		Connect(u, (u + 1) % numNodes)
+	return links
+
+###############################################################################
+# Func: Line                                                                  #
+# Desc: Creates a line (a chain), each node linked to the next, so the        #
+#       shortest paths from one end are as long as the topology is large.     #
+# Args: numNodes {int} - the number of nodes.                                 #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+###############################################################################
+def Line(numNodes, rng):
+	links, Connect = NewLinks(numNodes, rng)
+	for u in range(numNodes - 1):
+		Connect(u, u + 1)
+	return links
+
+###############################################################################
+# Func: Grid                                                                  #
+# Desc: Creates a rows x cols grid, each node linked to its right and lower   #
+#       neighbours. Node (r, c) has ID r*cols + c.                            #
+# Args: rows {int} - the number of rows.                                      #
+#       cols {int} - the number of columns.                                   #
+#       rng {Random} - random number generator.                               #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+###############################################################################
+def Grid(rows, cols, rng):
+	links, Connect = NewLinks(rows*cols, rng)
+	for r in range(rows):
+		for c in range(cols):
+			if c + 1 < cols:
+				Connect(r*cols + c, r*cols + c + 1)
+			if r + 1 < rows:
+				Connect(r*cols + c, (r + 1)*cols + c)
+	return links
+
+###############################################################################
+# Func: Generate                                                              #
+# Desc: Creates a topology of one of the kinds in generators with about       #
+#       numNodes nodes: a fat-tree has the largest even k that fits (at       #
+#       least k = 2, 7 nodes) and a grid is the squarest one that fits.       #
+# Args: kind {string} - a key of generators.                                  #
+#       numNodes {int} - the number of nodes wanted.                          #
+#       rng {Random} - random number generator.                               #
+#       degree {float} - the average node degree of a random graph.           #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+#       {int} - the actual number of nodes.                                   #
+###############################################################################
+def Generate(kind, numNodes, rng, degree=4):
+	if kind == "fattree":
+		k = 2
+		while 5*(k + 2)**2//4 + (k + 2)**3//4 <= numNodes:
+			k += 2
+		return FatTree(k, rng)
+	if kind == "ring":
+		numNodes = max(numNodes, 3)
+		return Ring(numNodes, rng), numNodes
+	if kind == "line":
+		numNodes = max(numNodes, 2)
+		return Line(numNodes, rng), numNodes
+	if kind == "grid":
+		rows = max(int(numNodes**0.5), 1)
+		cols = max(numNodes//rows, 1)
+		return Grid(rows, cols, rng), rows*cols
+	if kind == "random":
+		numNodes = max(numNodes, 2)
+		return RandomGraph(numNodes, degree, rng), numNodes
+	raise ValueError("unknown topology " + repr(kind))
+
+###############################################################################
+# Func: HostAddress                                                           #
+# Desc: Returns the address a topology file gives a host: 10.0.0.0 plus its   #
+#       ID.                                                                   #
+# Args: ID {int} - the ID of the host.                                        #
+# Retn: {string} - IPv4 address.                                              #
+###############################################################################
+def HostAddress(ID):
+	return "10.%d.%d.%d" % (ID >> 16, (ID >> 8) & 0xff, ID & 0xff)
+
+###############################################################################
+# Func: WriteTopology                                                         #
+# Desc: Writes a topology file, with the addresses from HostAddress.          #
+# Args: links {dict} - (u, v) -> (port, cost).                                #
+#       numNodes {int} - the number of nodes.                                 #
+#       fileName {string} - the file to write.                                #
+#       sparse {bool} - whether to write the edge list instead of the matrix. #
+# Retn: N/A                                                                   #
+###############################################################################
+def WriteTopology(links, numNodes, fileName, sparse):
+	with open(fileName, 'w') as topoFile:
+		topoFile.write("0, %d%s\n" % (numNodes, ", sparse" if sparse else ""))
+		for ID in range(numNodes):
+			topoFile.write("%d = %s\n" % (ID, HostAddress(ID)))
+		topoFile.write("\n")
+		if sparse:
+			for (u, v), (port, cost) in sorted(links.items()):
+				topoFile.write("%d, %d, %d:%d\n" % (u, v, port, cost))
+			return
+		rows = [{} for _ in range(numNodes)]
+		for (u, v), (port, cost) in links.items():
+			rows[u][v] = "%d:%d" % (port, cost)
+		for row in rows:
+			topoFile.write(", ".join(row.get(v, "0") for v in range(numNodes))
+				+ "\n")
+
+###############################################################################
+generators = ["fattree", "ring", "line", "grid", "random"]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Writes a synthetic "
+		+ "topology file.")
+	parser.add_argument("kind", choices=generators)
+	parser.add_argument("nodes", type=int, help="about how many nodes")
+	parser.add_argument("output", help="topology file to write")
+	parser.add_argument("-d", "--degree", type=float, default=4,
+		help="average node degree of a random graph")
+	parser.add_argument("--dense", action="store_true",
+		help="write the dense matrix instead of the sparse edge list")
+	parser.add_argument("-s", "--seed", type=int, default=4272)
+	args = parser.parse_args()
+
+	links, numNodes = Generate(args.kind, args.nodes,
+		random.Random(args.seed), args.degree)
+	WriteTopology(links, numNodes, args.output, not args.dense)
+	print("Wrote %d nodes and %d links to %s." % (numNodes, len(links)//2,
+		args.output))
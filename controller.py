@@ -10,100 +10,359 @@
 ###############################################################################
 
 from socket import *
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from heapq import heappush, heappop
+from struct import Struct
+from time import perf_counter
+import argparse
+import asyncio
+import itertools
+import json
+import mmap
+import os
+import queue
+import random
+import threading
+import zlib
+
+from metrics import LOG_INFO, LOG_VERBOSE, Count, EncodeReport, Lap, Log
+from metrics import Record, Report
+from protocol import *
+import metrics
+import protocol
 
 ###############################################################################
 # Class: AddrMap                                                              #
 # Description: Maps host IDs to IP address.                                   #
 ###############################################################################
 class AddrMap:
+	__slots__ = ("ID", "address")
+
 	def __init__(self, ID: int, address):
 		self.ID = ID
 		self.address = address
 
 ###############################################################################
 # Class: SrcPortDstMap                                                        #
-# Description: Maps [sourceAddr]->[port]->[destinationAddr] triples.          #
+# Description: Maps [sourceAddr]->[port]->[destinationAddr] triples. Also     #
+#              holds the link cost used by the router's weighted mode.        #
 ###############################################################################
 class SrcPortDstMap:
-	def __init__(self, srcID: int, port: int, dstID: int):
+	__slots__ = ("srcID", "port", "dstID", "cost")
+
+	def __init__(self, srcID: int, port: int, dstID: int, cost: int = 1):
 		self.srcID = srcID
 		self.port = port
 		self.dstID = dstID
+		self.cost = cost
+
+###############################################################################
+# Class: RouterConnection                                                     #
+# Description: One persistent connection to the router. Every request is      #
+#              sent with its own ID, and a reader thread hands each reply     #
+#              to the Future waiting on that ID, so any number of requests    #
+#              can be in flight at once. Requests are written by a writer     #
+#              thread, so Send never blocks its caller (the event loop). If   #
+#              the connection drops, every waiting Future fails with the      #
+#              error.                                                         #
+###############################################################################
+class RouterConnection:
+	def __init__(self, host, port):
+		self.sock = create_connection((host, port))
+		self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+		self.outbox = queue.SimpleQueue()	# Requests to write, None to stop.
+		self.pending = {}				# Request ID -> Future.
+		self.alive = True
+		threading.Thread(target=self.Reader, daemon=True).start()
+		threading.Thread(target=self.Writer, daemon=True).start()
+
+	def Send(self, requestID, msgType, payload):
+		future = Future()
+		self.pending[requestID] = future
+		self.outbox.put((msgType, payload, requestID))
+		if not self.alive:				# Closed while registering.
+			self.Close(ConnectionError("router connection lost"))
+		return future
+
+	def Writer(self):
+		while True:
+			request = self.outbox.get()
+			if request is None:
+				return
+			try:
+				SendPacket(self.sock, *request)
+			except OSError as error:
+				self.Close(error)
+				return
+
+	def Reader(self):
+		error = ConnectionError("router closed the connection")
+		try:
+			while True:
+				msgType, requestID, payload = RecvFrame(self.sock)
+				if payload is None:
+					break
+				future = self.pending.pop(requestID, None)
+				if future is not None:
+					future.set_result((msgType, payload))
+		except (OSError, ProtocolError) as readError:
+			error = ConnectionError("router connection lost: " + str(readError))
+		self.Close(error)
+
+	def Close(self, error):
+		self.alive = False
+		self.outbox.put(None)
+		try:
+			self.sock.shutdown(SHUT_RDWR)	# Wakes the reader and writer.
+		except OSError:
+			pass
+		self.sock.close()
+		pending, self.pending = self.pending, {}
+		for future in pending.values():
+			if not future.done():
+				future.set_exception(error)
+
+###############################################################################
+# Class: RouterPool                                                           #
+# Description: A small pool of persistent router connections, used round      #
+#              robin. A dead connection is replaced on its next use, and a    #
+#              request that was lost with a connection is resent once on a    #
+#              fresh one, so a restarted router is picked up automatically.   #
+#              Connecting blocks, so it is left to the pool's own thread and  #
+#              never done by the caller (the event loop).                     #
+###############################################################################
+class RouterPool:
+	def __init__(self, host, port, size):
+		self.host = host
+		self.port = port
+		self.slots = [None]*max(size, 1)
+		self.lock = threading.Lock()
+		self.nextSlot = itertools.count()
+		self.nextID = itertools.count(1)
+		self.connector = ThreadPoolExecutor(1)
+
+	def Connection(self, connect):
+		slot = next(self.nextSlot) % len(self.slots)
+		with self.lock:
+			connection = self.slots[slot]
+		if connection is not None and connection.alive:
+			return connection
+		if not connect:
+			return None
+		fresh = RouterConnection(self.host, self.port)	# Not under the lock.
+		with self.lock:
+			connection = self.slots[slot]
+			if connection is None or not connection.alive:
+				connection = self.slots[slot] = fresh
+		if connection is not fresh:		# Replaced meanwhile.
+			fresh.Close(ConnectionError("router connection not needed"))
+		return connection
+
+	def Submit(self, msgType, payload, retries=1):
+		result = Future()
+		def Attempt(retriesLeft, connect):
+			if result.done():				# Cancelled (timed out).
+				return
+			try:
+				connection = self.Connection(connect)
+				if connection is None:		# Connect off the caller's thread.
+					self.connector.submit(Attempt, retriesLeft, True)
+					return
+				inner = connection.Send(next(self.nextID) % (1 << 32),
+					msgType, payload)
+			except OSError as error:		# Router is not running.
+				Finish(None, error)
+				return
+			def Done(inner):
+				error = inner.exception()
+				if error is None:
+					Finish(inner.result(), None)
+				elif retriesLeft > 0:
+					Attempt(retriesLeft - 1, False)
+				else:
+					Finish(None, error)
+			inner.add_done_callback(Done)
+		def Finish(reply, error):
+			if result.set_running_or_notify_cancel():
+				if error is None:
+					result.set_result(reply)
+				else:
+					result.set_exception(error)
+		Attempt(retries, False)
+		return result
+
+	def Request(self, msgType, payload):
+		return self.Submit(msgType, payload).result()
 
 ###############################################################################
 # Func: loadNetTopo                                                           #
-# Desc: Loads the initial network topology from file "adjMatrix.txt".         #
-# Args: N/A                                                                   #
+# Desc: Loads the initial network topology from file (by default              #
+#       "adjMatrix.txt"), in one pass over its lines. The file is either a    #
+#       dense adjacency matrix, where an entry is a port number or            #
+#       "port:cost", or, if line 0 ends in ", sparse", an edge list with one  #
+#       directed link per line: "srcID, dstID, port" or "srcID, dstID,        #
+#       port:cost". The format is detected from line 0.                       #
+# Args: fileName {string} - the topology file.                                #
 # Retn: N/A                                                                   #
 ###############################################################################
-def loadNetTopo():
-	global addressMapList, connectionList
+def loadNetTopo(fileName="adjMatrix.txt"):
 	numVertex = 0
+	sparse = False
 	k = 0	# k is the index in adj matrix part of packet.
 	lineIndex = 0
-	for line in open("adjMatrix.txt", 'r'):
+	for line in open(fileName, 'r'):
 		# Line 0.
 		if lineIndex == 0:											
-			line = line.replace(" ", "")
-			numVertex = int(line.split(",")[1])
+			fields = line.replace(" ", "").strip().split(",")
+			numVertex = int(fields[1])
+			sparse = len(fields) > 2 and fields[2] == "sparse"
 		# Lines [1...numVertex]: ID->Addr map.
 		elif lineIndex <= numVertex:							
 			line = line.replace(" ", "")
 			line = line.replace("\n", "")
 			ID = int(line.split("=")[0])
 			address = line.split("=")[1]
-			addressMapList.append(AddrMap(ID, address))
+			AddHost(address)
+		# Edge list: one link per line (ignore blank lines).
+		elif sparse:
+			line = line.replace(" ", "").strip()
+			if line != "":
+				srcID, dstID, entry = line.split(",")
+				port, _, cost = entry.partition(":")
+				Link(int(srcID), int(port), int(dstID),
+					int(cost) if cost else 1)
 		# The actual adjacency matrix (ignore blank line).
 		elif line != "\n":										
 			line = line.replace(" ", "")
 			for i, entry in enumerate(line.split(",")):
-				if int(entry) != 0:
-					connection = SrcPortDstMap(int(k), int(entry), int(i))
-					connectionList.append(connection)
+				port, _, cost = entry.partition(":")
+				if int(port) != 0:
+					Link(int(k), int(port), int(i), int(cost) if cost else 1)
 			k += 1
 		lineIndex += 1
 
+###############################################################################
+# Func: AddHost                                                               #
+# Desc: Adds a host to the network and to every index. IDs are handed out     #
+#       in order, so a host's ID is also its index in addressMapList.         #
+# Args: address {string} - the IPv4 address of the host.                      #
+# Retn: {int} - the ID of the new host.                                       #
+###############################################################################
+def AddHost(address):
+	global addressMapList, idByAddr, packedAddrs, routerSync
+	global portMap, neighborMap, freePorts, nextPort
+	ID = len(addressMapList)
+	addressMapList.append(AddrMap(ID, address))
+	idByAddr[address] = ID
+	packedAddrs.append(AddrToInt(address))
+	routerSync.AddHost(packedAddrs[ID])
+	portMap.append({})
+	neighborMap.append({})
+	freePorts.append([])
+	nextPort.append(1)
+	return ID
+
+###############################################################################
+# Func: Link                                                                  #
+# Desc: Adds one direction of a connection (src -> dst) to the indexes.       #
+# Args: srcID {int} - the ID of source of the connection.                     #
+#       port {int} - the port number on the source.                           #
+#       dstID {int} - the ID of the destination host.                         #
+#       cost {int} - the link cost.                                           #
+# Retn: N/A                                                                   #
+###############################################################################
+def Link(srcID, port, dstID, cost=1):
+	global portMap, neighborMap, routerSync
+	portMap[srcID][port] = SrcPortDstMap(srcID, port, dstID, cost)
+	neighborMap[srcID][dstID] = port
+	routerSync.Link(srcID, port, dstID, cost)
+
+###############################################################################
+# Func: Unlink                                                                #
+# Desc: Removes one direction of a connection (src -> dst) from the indexes   #
+#       and releases its port for reuse.                                      #
+# Args: srcID {int} - the ID of source of the connection.                     #
+#       port {int} - the port number on the source.                           #
+# Retn: {SrcPortDstMap} - the removed connection.                             #
+###############################################################################
+def Unlink(srcID, port):
+	global portMap, neighborMap, freePorts, nextPort, routerSync
+	connection = portMap[srcID].pop(port)
+	del neighborMap[srcID][connection.dstID]
+	routerSync.Unlink(srcID, port)
+	if port < nextPort[srcID]:			# Ports >= nextPort are found by scan.
+		heappush(freePorts[srcID], port)
+	return connection
+
 ###############################################################################
 # Func: CreateAdjMatrixPacket                                                 #
-# Desc: Creates the Adjacency Matrix Packet to send to the router.            #
+# Desc: Creates the Adjacency Matrix Packet to send to the router. Each row   #
+#       is filled straight from the port index of its host. The sparse        #
+#       packet lists the links instead, one per line in the same layout as    #
+#       a sparse topology file, sorted by source then destination.            #
 # Args: srcID {int} - ID of source vertex.                                    #
+#       sparse {bool} - whether to send the edge list instead of the matrix.  #
 # Retn: {list: string} - the packet.                                          #
 ###############################################################################
-def CreateAdjMatrixPacket(srcID):
-	global addressMapList, connectionList
+def CreateAdjMatrixPacket(srcID, sparse=False):
+	global addressMapList, portMap
 
 	packet = []
 	numHost = len(addressMapList)
 	# Src host and number of host.
-	packet.append(str(srcID) + ", " + str(numHost)+"\n")
+	packet.append(str(srcID) + ", " + str(numHost)
+		+ (", sparse" if sparse else "") + "\n")
 	# Host IDs and addresses.
 	for host in addressMapList:
 		packet.append(str(host.ID)+" = " +str(host.address)+"\n")
 	packet.append("\n")
-	
-	matrix = [[0]*numHost for _ in range(numHost)]
-	# Build matrix.
-	for entry in connectionList:
-		srcID = entry.srcID
-		portNum = entry.port
-		dstID = entry.dstID
-		matrix[srcID][dstID] = portNum
-
-	# Matrix as string (packet).
-	y=0
-	while y < numHost:
-		x=0
-		line = ""
-		while x < numHost:
-			line += str(matrix[y][x])
-			line += ", " if (x < numHost-1) else "\n"
-			x += 1
-		packet.append(line)
-		y += 1
-	i=0
+
+	# Edge list as string (packet), one line per link.
+	if sparse:
+		for host in range(numHost):
+			for entry in sorted(portMap[host].values(),
+					key=lambda entry: entry.dstID):
+				portNum = str(entry.port)
+				if entry.cost != 1:		# Only non-default costs are sent.
+					portNum += ":" + str(entry.cost)
+				packet.append(str(host) + ", " + str(entry.dstID) + ", "
+					+ portNum + "\n")
+		return packet
+
+	# Matrix as string (packet), one row per host.
+	for host in range(numHost):
+		row = ["0"]*numHost
+		for entry in portMap[host].values():
+			portNum = str(entry.port)
+			if entry.cost != 1:			# Only non-default costs are sent.
+				portNum += ":" + str(entry.cost)
+			row[entry.dstID] = portNum
+		packet.append(", ".join(row) + "\n")
 
 	return packet
 
+###############################################################################
+# Func: CreateBinaryAdjPacket                                                 #
+# Desc: Creates the binary Adj. Matrix Packet to send to the router. Only     #
+#       the links that exist are sent, as (src, dst, cost, port) columns.     #
+# Args: srcID {int} - ID of source vertex.                                    #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def CreateBinaryAdjPacket(srcID):
+	global packedAddrs, portMap
+	linkSrc, linkDst, linkCost, linkPort = \
+		array("I"), array("I"), array("I"), array("H")
+	for host, ports in enumerate(portMap):
+		for entry in ports.values():
+			linkSrc.append(host)
+			linkDst.append(entry.dstID)
+			linkCost.append(entry.cost)
+			linkPort.append(entry.port)
+	return EncodeAdjacency(srcID, packedAddrs, linkSrc, linkDst, linkCost,
+		linkPort)
+
 ###############################################################################
 # Func: GetAddr                                                               #
 # Desc: Returns the address of a host from its ID.                            #
@@ -112,11 +371,9 @@ def CreateAdjMatrixPacket(srcID):
 ###############################################################################
 def GetAddr(ID: int):
 	global addressMapList
-	addr = -1
-	for entry in addressMapList:
-		if entry.ID == ID:
-			addr = entry.address
-	return addr
+	if 0 <= ID < len(addressMapList):
+		return addressMapList[ID].address
+	return -1
 
 ###############################################################################
 # Func: GetID                                                                 #
@@ -125,34 +382,30 @@ def GetAddr(ID: int):
 # Retn: {int} - the ID or -1 if host DNE.                                     #
 ###############################################################################
 def GetID(addr):
-	global addressMapList
-	ID = -1
-	for entry in addressMapList:
-		if entry.address == addr:
-			ID = entry.ID
-	return ID
+	global idByAddr
+	return idByAddr.get(addr, -1)
 
 ###############################################################################
 # Func: FindAvailablePort                                                     #
 # Desc: Find an unused port number on a host for the sake of establishing a   #
 #       connection. Used by AddConnection to find an ingress port on the      #
-#       destination host.                                                     #
+#       destination host. Every unused port below nextPort[host] is kept in   #
+#       the freePorts[host] min-heap (used ones are dropped lazily), so the   #
+#       lowest free port is either the top of the heap or found by scanning   #
+#       up from nextPort[host].                                               #
 # Retn: {int} - port number.                                                  #
 ###############################################################################
 def FindAvailablePort(host):
-	ports = []
-	ports.append(0)		# 0 is not a vailid port, but list must not be empty.
-	for entry in connectionList:			# Get list of ports in use.
-		if entry.srcID == host:
-			ports.append(int(entry.port))
-	
-	test = 1
-	while True:								# Find an unused port number
-		if test in ports:
-			test += 1
-		else:
-			break
-	return test
+	global portMap, freePorts, nextPort
+	ports = portMap[host]
+	free = freePorts[host]
+	while len(free) > 0 and free[0] in ports:	# Drop reused ports.
+		heappop(free)
+	if len(free) > 0:
+		return free[0]
+	while nextPort[host] in ports:				# Find an unused port number
+		nextPort[host] += 1
+	return nextPort[host]
 
 ###############################################################################
 # Func: AddConnection                                                         #
@@ -162,130 +415,1059 @@ def FindAvailablePort(host):
 #       dstID {int} - the ID of the destination host.                         #
 #       dstAddr {int} - the address of the destination host. Needed if the    #
 #                       host is new to the network.                           #
-# Retn: N/A                                                                   #
+#       cost {int} - the link cost (in both directions).                      #
+# Retn: {bool} - whether the connection was added.                            #
 ###############################################################################
-def AddConnection(srcID, port, dstID, dstAddr):
-	global addressMapList, connectionList
+def AddConnection(srcID, port, dstID, dstAddr, cost=1):
+	global neighborMap, portMap, topologyLog
 	srcAddr = GetAddr(srcID)
 
 	# Error handling.
-	for entry in connectionList:
-		# If connection already exist -> fail.
-		if entry.srcID == srcID and entry.dstID == dstID:
-			print("│   ├─»Error: Connection between host already exist.\n"
-				+ "│   │         Redundant connections forbidden.")
-			print("│   └─»Add request failed.")
-			return
-		# If port number in use -> fail.
-		if entry.srcID == srcID and entry.port == port:
-			print("│   ├─»Error: Port number " + str(port) + " already in use.")
-			print("│   └─»Add request failed.")
-			return
+	# If connection to itself -> fail (a switch has one port per neighbor).
+	if dstID == srcID:
+		Log(LOG_INFO, "│   ├─»Error: Connection to itself forbidden.")
+		Log(LOG_INFO, "│   └─»Add request failed.")
+		return False
+	# If connection already exist -> fail.
+	if dstID in neighborMap[srcID]:
+		Log(LOG_INFO, "│   ├─»Error: Connection between host already exist.\n"
+			"│   │         Redundant connections forbidden.")
+		Log(LOG_INFO, "│   └─»Add request failed.")
+		return False
+	# If port number out of range -> fail (it would overflow the uint16
+	# columns, or be read as a backup port).
+	if not 1 <= port <= MAX_PORT:
+		Log(LOG_INFO, "│   ├─»Error: Port number ", port, " out of range (1-",
+			MAX_PORT, ").")
+		Log(LOG_INFO, "│   └─»Add request failed.")
+		return False
+	# If port number in use -> fail.
+	if port in portMap[srcID]:
+		Log(LOG_INFO, "│   ├─»Error: Port number ", port, " already in use.")
+		Log(LOG_INFO, "│   └─»Add request failed.")
+		return False
+	# If dst has no port left -> fail.
+	if dstID != -1 and FindAvailablePort(dstID) > MAX_PORT:
+		Log(LOG_INFO, "│   ├─»Error: No free port on ", dstAddr, ".")
+		Log(LOG_INFO, "│   └─»Add request failed.")
+		return False
 
 	# If dst DNE -> add host.
 	if dstID == -1:
-		print("│   ├─»Destination host DNE on network.")
-		print("│   ├─»Adding host to network.")
-		dstID = len(addressMapList)
-		addressMapList.append(AddrMap(dstID, dstAddr))
+		Log(LOG_VERBOSE, "│   ├─»Destination host DNE on network.")
+		Log(LOG_VERBOSE, "│   ├─»Adding host to network.")
+		dstID = AddHost(dstAddr)
 		
 	# Success.
-	print("│   └─»Adding port " + str(port) 
-		+ " ("+str(srcAddr) + " ⭩ " + str(dstAddr) + ").")
-	print("│   └─»Adding port " + str(FindAvailablePort(dstID)) 
-		+ " ("+str(dstAddr) + " ⭩ " + str(srcAddr) + ").")
-	connectionList.append(SrcPortDstMap(srcID, port, dstID))
-	connectionList.append(SrcPortDstMap(dstID, FindAvailablePort(dstID), srcID))
+	Link(srcID, port, dstID, cost)
+	dstPort = FindAvailablePort(dstID)
+	Link(dstID, dstPort, srcID, cost)
+	if topologyLog is not None:
+		topologyLog.Append(walAdd, srcID, port, dstID, dstPort, cost,
+			AddrToInt(dstAddr))
+	Log(LOG_VERBOSE, "│   └─»Adding port ", port, " (", srcAddr, " ⭩ ",
+		dstAddr, ").")
+	Log(LOG_VERBOSE, "│   └─»Adding port ", dstPort, " (", dstAddr, " ⭩ ",
+		srcAddr, ").")
+	return True
 
 ###############################################################################
 # Func: DeleteConnection                                                      #
 # Desc: Remove connection from the network.                                   #
 # Args: srcID {int} - the ID of source of the connection.                     #
 #       port {int} - the port number on the source to use.                    #
-# Retn: N/A                                                                   #
+# Retn: {bool} - whether the connection was removed.                          #
 ###############################################################################
 def DeleteConnection(srcID, port):
-	global connectionList
+	global portMap, neighborMap, topologyLog
 	srcAddr = GetAddr(srcID)
 
-	connDNE=True
-	for entry in connectionList:
-		# If connection exist -> delete it (src -> dst).
-		if entry.srcID == srcID and entry.port == port:
-			connDNE = False
-			dstID = entry.dstID
-			connectionList.remove(entry)
-			print("│   ├─»Deleting port "+ str(port)
-				+ " (" + str(srcAddr) + " ⭩ " + str(GetAddr(entry.dstID)) + ").")
+	# If dst -> fail.
+	if port not in portMap[srcID]:
+		Log(LOG_INFO, "│   ├─»Error: No such connection on network.")
+		Log(LOG_INFO, "│   └─»Delete request failed.")
+		return False
 
+	# If connection exist -> delete it (src -> dst).
+	dstID = Unlink(srcID, port).dstID
+	Log(LOG_VERBOSE, "│   ├─»Deleting port ", port, " (", srcAddr, " ⭩ ",
+		GetAddr(dstID), ").")
 	# Remove the parallel connection (from dst -> src).
-	if not connDNE:
-		for entry in connectionList:
-			if entry.srcID == dstID and entry.dstID == srcID:
-				connectionList.remove(entry)
-				print("│   └─»Deleting port "+ str(entry.port)
-					+ " (" + GetAddr(entry.srcID) + " ⭩ " + GetAddr(entry.dstID) + ").")
-	# If dst -> fail.
-	else:
-		print("│   ├─»Error: No such connection on network.")
-		print("│   └─»Delete request failed.")
+	if srcID in neighborMap[dstID]:
+		dstPort = Unlink(dstID, neighborMap[dstID][srcID]).port
+		Log(LOG_VERBOSE, "│   └─»Deleting port ", dstPort, " (",
+			GetAddr(dstID), " ⭩ ", GetAddr(srcID), ").")
+	if topologyLog is not None:
+		topologyLog.Append(walDelete, srcID, port)
+	return True
 
 ###############################################################################
-addressMapList = []
-connectionList = []
-routerHost = 'localhost'
-routerPort = 1234
-
-loadNetTopo()									# Load initial network topology.
-
-controllerPort = 2345
-controllerSocket = socket(AF_INET, SOCK_STREAM)
-controllerSocket.bind(('', controllerPort))
-controllerSocket.listen(1)
-
-while True:										# Run forever.
+# Func: ApplyOperation                                                        #
+# Desc: Applies one ADD or DELETE to the network.                             #
+# Args: srcID {int} - ID of the switch.                                       #
+#       command {string} - "ADD" or "DELETE".                                 #
+#       port {int} - the port on the switch.                                  #
+#       dstAddr {string} - the address at the other end (ADD).                #
+# Retn: {bool} - whether the network changed.                                 #
+###############################################################################
+def ApplyOperation(srcID, command, port, dstAddr):
+	if command == "ADD":
+		Log(LOG_VERBOSE, "│   ├─»Add request.")
+		return AddConnection(srcID, port, GetID(dstAddr), dstAddr)
+	if command == "DELETE":
+		Log(LOG_VERBOSE, "│   ├─»Delete request.")
+		return DeleteConnection(srcID, port)
+	return False
 
-	print("Controller listening on port " + str(controllerPort) +".")
-	switch, addr = controllerSocket.accept()
-	packetUpdate = switch.recv(2048).decode()
+###############################################################################
+# Func: ApplyUpdate                                                           #
+# Desc: Applies an Update Packet to the network. An ADD or DELETE that        #
+#       changes the network bumps topologyVersion; a failed one leaves it,    #
+#       so it does not cost a flow table computation or push.                 #
+# Args: packetUpdate {string} - the packet.                                   #
+# Retn: {int} - ID of the switch that sent it.                                #
+###############################################################################
+def ApplyUpdate(packetUpdate):
+	global topologyVersion
 	srcID = int(packetUpdate.split(", ")[0])
 	command = packetUpdate.split(", ")[1]
 	port = int(packetUpdate.split(", ")[2])
 	dstAddr = packetUpdate.split(", ")[3]
-	dstID = int(GetID(dstAddr))
-	srcAddr = GetAddr(srcID)
-	print("Connected to switch " + srcAddr + ".")
-	print("├─»Update Packet received.")
+	Log(LOG_VERBOSE, "├─»Update Packet received from switch ", GetAddr(srcID),
+		".")
 	# ADD or DELETE port.
 	if port != 0:
+		if ApplyOperation(srcID, command, port, dstAddr):
+			topologyVersion += 1
+	else:
+		Log(LOG_VERBOSE, "│   └─»Flow table request.")
+	return srcID
+
+###############################################################################
+# Func: ValidateUpdates                                                       #
+# Desc: Checks that every operation of a Multi-Update Packet would succeed,   #
+#       in order, by playing them on a copy of the switch's ports (the        #
+#       only state AddConnection and DeleteConnection can fail on).           #
+# Args: srcID {int} - ID of the switch.                                       #
+#       operations {list: tuple} - (command, port, dstAddr) of each.          #
+# Retn: {string} - why the packet must be rejected, or None.                  #
+###############################################################################
+def ValidateUpdates(srcID, operations):
+	global portMap
+	ports = {port: GetAddr(link.dstID) for port, link in portMap[srcID].items()}
+	neighbors = set(ports.values())
+	srcAddr = GetAddr(srcID)
+	for command, port, dstAddr in operations:
 		if command == "ADD":
-			print("│   ├─»Add request.")
-			AddConnection(srcID, port, dstID, dstAddr)
+			if dstAddr == srcAddr:
+				return "Connection to itself forbidden."
+			if dstAddr in neighbors:
+				return "Connection to " + dstAddr + " already exists."
+			if not 1 <= port <= MAX_PORT:
+				return ("Port number " + str(port) + " out of range (1-" +
+					str(MAX_PORT) + ").")
+			if port in ports:
+				return "Port number " + str(port) + " already in use."
+			dstID = GetID(dstAddr)
+			if dstID != -1 and FindAvailablePort(dstID) > MAX_PORT:
+				return "No free port on " + dstAddr + "."
+			ports[port] = dstAddr
+			neighbors.add(dstAddr)
 		elif command == "DELETE":
-			print("│   ├─»Delete request.")
-			DeleteConnection(srcID, port)				
+			if port not in ports:
+				return "No connection on port " + str(port) + "."
+			neighbors.discard(ports.pop(port))
+		else:
+			return "Unknown command " + command + "."
+	return None
+
+###############################################################################
+# Func: ApplyUpdates                                                          #
+# Desc: Applies a Multi-Update Packet to the network as one change: either    #
+#       all of its operations or, if any of them would fail, none. The        #
+#       whole packet bumps topologyVersion once, so it costs one flow table   #
+#       computation however many ports it brings up or down, and its log      #
+#       records are written as one transaction.                               #
+# Args: packetUpdate {string} - the packet.                                   #
+# Retn: {int} - ID of the switch that sent it.                                #
+###############################################################################
+def ApplyUpdates(packetUpdate):
+	global topologyVersion, topologyLog
+	srcID = None
+	operations = []
+	for line in packetUpdate.splitlines():
+		fields = line.split(", ")
+		if srcID is None:
+			srcID = int(fields[0])
+		elif int(fields[0]) != srcID:
+			raise ProtocolError("Multi-Update Packet from several switches")
+		if int(fields[2]) != 0:				# Port 0 only asks for the table.
+			operations.append((fields[1], int(fields[2]), fields[3]))
+	if srcID is None:
+		raise ProtocolError("empty Multi-Update Packet")
+	Log(LOG_VERBOSE, "├─»Multi-Update Packet (", len(operations),
+		" operation(s)) received from switch ", GetAddr(srcID), ".")
+	error = ValidateUpdates(srcID, operations)
+	if error is not None:
+		Log(LOG_INFO, "│   ├─»Error: ", error)
+		Log(LOG_INFO, "│   └─»Multi-update rejected, nothing applied.")
+		return srcID
+	if len(operations) == 0:
+		Log(LOG_VERBOSE, "│   └─»Flow table request.")
+		return srcID
+	topologyVersion += 1
+	if topologyLog is not None and len(operations) > 1:
+		topologyLog.Begin(len(operations))
+	for command, port, dstAddr in operations:
+		ApplyOperation(srcID, command, port, dstAddr)
+	return srcID
+
+###############################################################################
+# Func: WriteFileDurably                                                      #
+# Desc: Replaces a file in one step: the data is written and fsynced under a  #
+#       temporary name, then renamed over the file, so a crash leaves either  #
+#       the old file or the new one.                                          #
+# Args: fileName {string} - the file to replace.                              #
+#       data {bytes} - its new contents.                                      #
+# Retn: N/A                                                                   #
+###############################################################################
+def WriteFileDurably(fileName, data):
+	tmpName = fileName + ".tmp"
+	with open(tmpName, 'wb') as tmpFile:
+		tmpFile.write(data)
+		tmpFile.flush()
+		os.fsync(tmpFile.fileno())
+	os.replace(tmpName, fileName)
+	dirFD = os.open(os.path.dirname(os.path.abspath(fileName)), os.O_RDONLY)
+	try:
+		os.fsync(dirFD)							# Make the rename durable.
+	finally:
+		os.close(dirFD)
+
+###############################################################################
+# Class: TopologyLog                                                          #
+# Description: Keeps the network across controller restarts. Every ADD and    #
+#              DELETE is appended to a write-ahead log (NAME.wal) and made    #
+#              durable before the switch is answered. Appends are fsynced in  #
+#              batches: updates arriving within interval seconds of each      #
+#              other share one fsync. After every snapshotEvery records the   #
+#              whole network is written to a binary snapshot (NAME.snap, the  #
+#              binary Adj. Matrix Packet behind a small header) and the log   #
+#              is started over, so a restart maps the snapshot and replays    #
+#              at most snapshotEvery records, however long the controller     #
+#              has been running. Records are checksummed, and a record torn   #
+#              by a crash ends the log. The records of a Multi-Update Packet  #
+#              follow a BEGIN record giving their count and are replayed      #
+#              only if all of them made it to disk; no snapshot is taken      #
+#              in the middle of one.                                          #
+###############################################################################
+class TopologyLog:
+	def __init__(self, name, interval, snapshotEvery):
+		self.snapName = name + ".snap"
+		self.logName = name + ".wal"
+		self.interval = interval
+		self.snapshotEvery = max(snapshotEvery, 1)
+		self.seq = 0					# Records since the network was created.
+		self.snapSeq = 0				# seq the snapshot was taken at.
+		self.durable = 0				# Last seq known to be on disk.
+		self.file = None
+		self.batch = None				# Task of the next batched fsync.
+		self.pending = 0				# Records still due in a transaction.
+
+	def Recover(self, topologyFile):
+		if not os.path.exists(self.snapName):
+			loadNetTopo(topologyFile)
+			self.Snapshot()				# The topology file is not read again.
+			Log(LOG_INFO, "Created ", self.snapName, " from ", topologyFile, ".")
+			return
+		self.LoadSnapshot()
+		replayed = self.Replay()
+		Log(LOG_INFO, "Recovered ", len(addressMapList), " hosts from ",
+			self.snapName, " and replayed ", replayed, " update(s) from ",
+			self.logName, ".")
+
+	def LoadSnapshot(self):
+		with open(self.snapName, 'rb') as snapFile:
+			with mmap.mmap(snapFile.fileno(), 0, access=mmap.ACCESS_READ) \
+					as mapped:
+				view = memoryview(mapped)
+				try:
+					magic, _, self.seq = snapHeader.unpack_from(view)
+					if magic != b"SDNS":
+						raise ValueError(self.snapName + " is not a snapshot")
+					_, addrs, linkSrc, linkDst, linkCost, linkPort = \
+						DecodeAdjacency(view[snapHeader.size:])
+				finally:
+					view.release()
+		for address in addrs:
+			AddHost(IntToAddr(address))
+		for srcID, dstID, cost, port in zip(linkSrc, linkDst, linkCost,
+				linkPort):
+			Link(srcID, port, dstID, cost)
+		self.snapSeq = self.durable = self.seq
+
+	def Replay(self):
+		global addressMapList, neighborMap
+		if not os.path.exists(self.logName):
+			self.Snapshot()
+			return 0
+		with open(self.logName, 'rb') as logFile:
+			data = logFile.read()
+		if len(data) < logHeader.size or data[:4] != b"SDNW":
+			raise ValueError(self.logName + " is not a write-ahead log")
+		seq = logHeader.unpack_from(data)[2]
+		if seq > self.seq:
+			raise ValueError(self.logName + " is newer than " + self.snapName)
+		offset = logHeader.size
+		replayed = 0
+		while offset + walRecord.size + walCRC.size <= len(data):
+			end = offset + walRecord.size
+			if zlib.crc32(data[offset:end]) != walCRC.unpack_from(data, end)[0]:
+				break							# Torn by a crash.
+			op, srcID, port, dstID, dstPort, cost, address = \
+				walRecord.unpack_from(data, offset)
+			if op == walBegin and not self.Complete(data, end + walCRC.size,
+					dstID):
+				break							# Transaction torn by a crash.
+			offset = end + walCRC.size
+			seq += 1
+			if seq <= self.seq:					# Already in the snapshot.
+				continue
+			if op == walAdd:
+				if dstID == len(addressMapList):
+					AddHost(IntToAddr(address))
+				Link(srcID, port, dstID, cost)
+				Link(dstID, dstPort, srcID, cost)
+			elif op == walDelete:
+				dstID = Unlink(srcID, port).dstID
+				if srcID in neighborMap[dstID]:
+					Unlink(dstID, neighborMap[dstID][srcID])
+			self.seq = seq
+			replayed += 1
+		self.file = open(self.logName, 'r+b')
+		self.file.truncate(offset)				# Drop a torn record.
+		self.file.seek(offset)
+		self.durable = self.seq
+		return replayed
+
+	def Complete(self, data, offset, count):
+		for _ in range(count):
+			end = offset + walRecord.size
+			if end + walCRC.size > len(data) or (zlib.crc32(data[offset:end])
+					!= walCRC.unpack_from(data, end)[0]):
+				return False
+			offset = end + walCRC.size
+		return True
+
+	def Begin(self, count):
+		self.pending = count
+		self.Append(walBegin, 0, 0, count)
+
+	def Append(self, op, srcID, port, dstID=0, dstPort=0, cost=0, address=0):
+		record = walRecord.pack(op, srcID, port, dstID, dstPort, cost, address)
+		self.file.write(record + walCRC.pack(zlib.crc32(record)))
+		self.seq += 1
+		if op != walBegin and self.pending > 0:
+			self.pending -= 1
+		if self.pending == 0 and self.seq - self.snapSeq >= self.snapshotEvery:
+			self.Snapshot()
+
+	async def Sync(self):
+		if self.durable >= self.seq:
+			return
+		if self.batch is None:
+			self.batch = asyncio.ensure_future(self.Commit())
+		await asyncio.shield(self.batch)
+
+	async def Commit(self):
+		await asyncio.sleep(self.interval)	# Let more updates join the batch.
+		self.batch = None
+		seq = self.seq
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.durable = max(self.durable, seq)
+
+	def Snapshot(self):
+		if self.file is not None:
+			self.file.flush()
+			os.fsync(self.file.fileno())
+		WriteFileDurably(self.snapName, snapHeader.pack(b"SDNS", 1, self.seq)
+			+ CreateBinaryAdjPacket(0))
+		WriteFileDurably(self.logName, logHeader.pack(b"SDNW", 1, self.seq))
+		if self.file is not None:
+			self.file.close()
+		self.file = open(self.logName, 'ab')
+		self.snapSeq = self.durable = self.seq
+
+###############################################################################
+# Class: TopologySync                                                         #
+# Description: What the router has been sent of the network. The router       #
+#              keeps the topology between requests, so after the first        #
+#              request, which sends all of it, each request carries only the  #
+#              hosts and links changed since the one before, and the          #
+#              topology version they bring the router to. Changes are         #
+#              collected as they are made, the last change to a link          #
+#              replacing earlier ones. If the router does not hold the        #
+#              version a delta starts from (it restarted, or two requests     #
+#              crossed), it answers MSG_TOPO_STALE and is sent the whole      #
+#              topology again.                                                #
+###############################################################################
+class TopologySync:
+	def __init__(self):
+		self.version = None				# Version last sent (None: send all).
+		self.hosts = array("I")			# Packed addresses of new hosts.
+		self.links = {}					# (srcID, port) -> (dstID, cost), or
+										# None if removed.
+
+	def AddHost(self, address):
+		if self.version is not None:
+			self.hosts.append(address)
+
+	def Link(self, srcID, port, dstID, cost):
+		if self.version is not None:
+			self.links[(srcID, port)] = (dstID, cost)
+
+	def Unlink(self, srcID, port):
+		if self.version is not None:
+			self.links[(srcID, port)] = None
+
+	def Reset(self):
+		self.version = None
+		self.hosts = array("I")
+		self.links = {}
+
+	def Packet(self, sources):
+		global topologyVersion, flowEpoch
+		base = self.version
+		if base is None:
+			body = CreateBinaryAdjPacket(0)
+		else:
+			upserts = {key: link for key, link in self.links.items()
+				if link is not None}
+			removed = [key for key, link in self.links.items() if link is None]
+			body = EncodeTopologyDelta(self.hosts,
+				array("I", [srcID for srcID, port in upserts]),
+				array("I", [dstID for dstID, cost in upserts.values()]),
+				array("I", [cost for dstID, cost in upserts.values()]),
+				array("H", [port for srcID, port in upserts]),
+				array("I", [srcID for srcID, port in removed]),
+				array("H", [port for srcID, port in removed]))
+		self.version = topologyVersion
+		self.hosts = array("I")
+		self.links = {}
+		return EncodeTopologySync(base is None, flowEpoch, base or 0,
+			topologyVersion, sources, body)
+
+###############################################################################
+# Func: CreateRouterPacket                                                    #
+# Desc: Creates the packet to send to the router for the flow table of one    #
+#       switch: a Topology Sync Packet, or the text Adj. Matrix Packet with   #
+#       --text. The text packet is the sparse edge list, unless in legacy     #
+#       mode, where an older router may only read the dense matrix.           #
+# Args: srcID {int} - ID of source vertex.                                    #
+# Retn: {int} - the MSG_* type of the packet.                                 #
+#       {string|bytes} - the packet.                                          #
+###############################################################################
+def CreateRouterPacket(srcID):
+	global textPackets, routerSync
+	if textPackets:
+		return MSG_ADJ_MATRIX, "".join(CreateAdjMatrixPacket(srcID,
+			not protocol.legacyMode))
+	return MSG_TOPO_SYNC, routerSync.Packet([srcID])
+
+###############################################################################
+# Func: RouterRequest                                                         #
+# Desc: Sends an Adj. Matrix Packet to the router and waits for the flow      #
+#       table without blocking the event loop. Framed requests go through     #
+#       the router pool; legacy requests open a connection each. A router     #
+#       that takes longer than routerTimeout is given up on, and one that     #
+#       failed to compute the table answers with an error.                    #
+# Args: adjType {int} - the MSG_* type of the packet.                         #
+#       packetAdjMatix {string|bytes} - the packet.                           #
+# Retn: {int} - the MSG_* type of the Flow Table Packet.                      #
+#       {bytes} - the Flow Table Packet.                                      #
+###############################################################################
+async def RouterRequest(adjType, packetAdjMatix):
+	global routerPool, routerHost, routerPort, routerTimeout
+	async def Legacy():
+		reader, writer = await asyncio.open_connection(routerHost, routerPort)
+		try:
+			WriteFrame(writer, adjType, packetAdjMatix)
+			await writer.drain()
+			flowType, requestID, flowTable = await ReadFrame(reader)
+		finally:
+			writer.close()
+		return flowType, flowTable
+	if protocol.legacyMode:
+		reply = Legacy()
+	else:
+		reply = asyncio.wrap_future(routerPool.Submit(adjType, packetAdjMatix))
+	try:
+		flowType, flowTable = await asyncio.wait_for(reply, routerTimeout)
+	except asyncio.TimeoutError:
+		raise ConnectionError("router did not answer in "
+			+ str(routerTimeout) + " s") from None
+	if flowType == MSG_ERROR:
+		raise ProtocolError("router failed: "
+			+ flowTable.decode(errors="replace"))
+	return flowType, flowTable
+
+###############################################################################
+# Func: SyncRequest                                                           #
+# Desc: Sends a Topology Sync Packet to the router and waits for the flow     #
+#       tables. If the router does not hold the version the packet's delta    #
+#       starts from, the whole topology is sent again, as it is now.          #
+# Args: packet {bytes} - the Topology Sync Packet.                            #
+#       version {int} - topology version the packet brings the router to.     #
+# Retn: {int} - topology version the tables were computed from.               #
+#       {list: tuple} - (switch ID, binary Flow Table Packet) pairs.          #
+###############################################################################
+async def SyncRequest(packet, version):
+	global routerSync, topologyLock, topologyVersion
+	replyType, payload = await RouterRequest(MSG_TOPO_SYNC, packet)
+	if replyType == MSG_TOPO_STALE:
+		Log(LOG_INFO, "├─»Router is out of sync, sending the whole topology.")
+		Count("router_resyncs")
+		sources = list(DecodeTopologySync(packet)[4])
+		async with topologyLock:
+			routerSync.Reset()
+			version = topologyVersion
+			packet = routerSync.Packet(sources)
+		replyType, payload = await RouterRequest(MSG_TOPO_SYNC, packet)
+	if replyType != MSG_FLOW_BATCH:
+		raise ProtocolError("unexpected answer to a Topology Sync Packet")
+	return version, DecodeFlowBatch(payload)
+
+###############################################################################
+# Class: FlowHistory                                                          #
+# Description: The last few flow tables of one switch, numbered from 1 in     #
+#              the order they were made, so a switch holding any of them      #
+#              can be sent just the rows that changed.                        #
+###############################################################################
+class FlowHistory:
+	def __init__(self):
+		self.seq = 0
+		self.version = -1				# Topology version of the newest table.
+		self.tables = OrderedDict()		# seq -> {(address, length): port}
+										# (a tuple of ports with ECMP).
+
+	def Record(self, flowTable, version):
+		global historySize
+		if version < self.version:		# A newer table is already recorded.
+			return
+		self.version = version
+		addrs, ports, lengths = DecodeFlowTable(flowTable)
+		table = GroupPorts(addrs, lengths, ports)
+		if self.seq > 0 and table == self.tables[self.seq]:
+			return
+		self.seq += 1
+		self.tables[self.seq] = table
+		while len(self.tables) > historySize:
+			self.tables.popitem(last=False)
+
+	def Delta(self, held):
+		global flowEpoch
+		heldEpoch, heldSeq = held
+		current = self.tables[self.seq]
+		base = self.tables.get(heldSeq) if heldEpoch == flowEpoch else None
+		if base is None:				# Versions diverged: send everything.
+			heldSeq, base = 0, {}
+		upAddrs = array("I")
+		upLengths = array("B")
+		upPorts = array("H")
+		for prefix, port in current.items():
+			if base.get(prefix) != port:
+				if type(port) is tuple:		# A port set: a row per port.
+					upAddrs.extend([prefix[0]]*len(port))
+					upLengths.extend([prefix[1]]*len(port))
+					upPorts.extend(port)
+				else:
+					upAddrs.append(prefix[0])
+					upLengths.append(prefix[1])
+					upPorts.append(port)
+		removed = [prefix for prefix in base if prefix not in current]
+		return EncodeFlowDelta(flowEpoch, heldSeq, self.seq, upAddrs, upLengths,
+			upPorts, array("I", [address for address, _ in removed]),
+			array("B", [length for _, length in removed]))
+
+###############################################################################
+# Func: ParseHeldVersion                                                      #
+# Desc: Reads the flow table version a switch says it holds.                  #
+# Args: fields {list: string} - the fields of the packet.                     #
+#       index {int} - index of the "epoch:seq" field.                         #
+# Retn: {tuple: int} - (epoch, seq); (0, 0) if the switch holds none.         #
+###############################################################################
+def ParseHeldVersion(fields, index):
+	if len(fields) <= index:
+		return (0, 0)
+	epoch, _, seq = fields[index].partition(":")
+	return (int(epoch), int(seq or 0))
+
+###############################################################################
+# Func: RecordFlowTable                                                       #
+# Desc: Adds a flow table from the router to its switch's history. Only       #
+#       binary tables are versioned.                                          #
+# Args: switchID {int} - ID of the switch.                                    #
+#       flowType {int} - the MSG_* type of the table.                         #
+#       flowTable {bytes} - the Flow Table Packet.                            #
+#       version {int} - topology version it was computed from.                #
+# Retn: N/A                                                                   #
+###############################################################################
+def RecordFlowTable(switchID, flowType, flowTable, version):
+	global flowHistory
+	if flowType == MSG_FLOW_BINARY:
+		if switchID not in flowHistory:
+			flowHistory[switchID] = FlowHistory()
+		flowHistory[switchID].Record(flowTable, version)
+
+###############################################################################
+# Func: FlowReply                                                             #
+# Desc: Creates the flow table message for a switch: a delta from the         #
+#       version it holds to the newest recorded table, or the text table as   #
+#       the router sent it.                                                   #
+# Args: switchID {int} - ID of the switch.                                    #
+#       flowType {int} - the MSG_* type of the table from the router.         #
+#       flowTable {bytes} - the Flow Table Packet from the router.            #
+#       version {int} - topology version it was computed from.                #
+#       held {tuple: int} - (epoch, seq) the switch holds.                    #
+# Retn: {int} - the MSG_* type of the message.                                #
+#       {bytes} - the message.                                                #
+#       {tuple|bytes} - identifies the table sent.                            #
+#       {int} - topology version of the table sent.                           #
+###############################################################################
+def FlowReply(switchID, flowType, flowTable, version, held):
+	global flowHistory, flowEpoch
+	if flowType != MSG_FLOW_BINARY:
+		return flowType, flowTable, flowTable, version
+	history = flowHistory[switchID]
+	return (MSG_FLOW_DELTA, history.Delta(held), (flowEpoch, history.seq),
+		history.version)
+
+###############################################################################
+# Class: Subscription                                                         #
+# Description: A switch connection that gets new flow tables pushed to it.    #
+#              What the switch was last sent (its version, or the text        #
+#              table) and the topology version it was made from are kept      #
+#              so unchanged or out of date tables are never pushed.           #
+###############################################################################
+class Subscription:
+	def __init__(self, switchID, writer, held):
+		self.switchID = switchID
+		self.writer = writer
+		self.held = held
+		self.version = -1
+
+	def Send(self, replyType, payload, tag, version, requestID=0):
+		if requestID == 0 and (version < self.version or tag == self.held):
+			return False
+		WriteFrame(self.writer, replyType, payload, requestID)
+		self.held = tag
+		self.version = max(self.version, version)
+		return True
+
+###############################################################################
+# Func: BatchFlowTables                                                       #
+# Desc: Computes the flow tables of many switches from one view of the        #
+#       network and adds them to their histories. Binary tables are           #
+#       computed by one Topology Sync Packet to the router; text tables by    #
+#       concurrent single requests.                                           #
+# Args: switchIDs {list: int} - IDs of the switches.                          #
+# Retn: {int} - topology version the tables were computed from.               #
+#       {dict} - switch ID -> (MSG_* type, Flow Table Packet).                #
+###############################################################################
+async def BatchFlowTables(switchIDs):
+	global topologyLock, topologyVersion, textPackets, routerSync
+	start = perf_counter()
+	async with topologyLock:
+		version = topologyVersion
+		if textPackets:
+			packets = [CreateRouterPacket(ID) for ID in switchIDs]
+		else:
+			batch = routerSync.Packet(switchIDs)
+	start = Lap("push_build", start)
+	if textPackets:
+		results = await asyncio.gather(*(RouterRequest(adjType, packet)
+			for adjType, packet in packets), return_exceptions=True)
+		results = zip(switchIDs, results)
 	else:
-		print("│   └─»Flow table request.")
-	# Send adj matrix to Router.
-	print("├─»Creating Adjacency Matrix Packet.")
-	packetAdjMatix = CreateAdjMatrixPacket(srcID)
-	router = socket(AF_INET, SOCK_STREAM)
-	router.connect((routerHost, routerPort))
-	print("├─»Connected to router.")
-	
-	router.send(("".join(packetAdjMatix)).encode())
-	print("│  ├─»Sending Adjacency Matrix Packet to router.")
-	# Listen for response from Router.
-	flowTable = router.recv(2048).decode()
-	print("│  ├─»Flow table received from router.")
-	print("│  └─»Disconnecting from router.")
-	router.close()
-
-	# Send flow table to switch.
-	print("├─»Sending flow table to switch.")
-	switch.send(flowTable.encode())
-	print("└─»Disconnected from switch.")
+		version, results = await SyncRequest(batch, version)
+		results = [(ID, (MSG_FLOW_BINARY, table)) for ID, table in results]
+	Lap("push_router", start)
+	tables = {}
+	for ID, result in results:
+		if not isinstance(result, BaseException):
+			RecordFlowTable(ID, result[0], result[1], version)
+			tables[ID] = result
+	return version, tables
 
+###############################################################################
+# Func: SendPushes                                                            #
+# Desc: Pushes new flow tables to the subscriptions whose table changed, as   #
+#       deltas from the version each switch holds.                            #
+# Args: version {int} - topology version of the tables.                       #
+#       tables {dict} - switch ID -> (MSG_* type, Flow Table Packet).         #
+#       skip {set} - connections not to push to (they are being answered).    #
+# Retn: N/A                                                                   #
+###############################################################################
+def SendPushes(version, tables, skip=()):
+	global subscriptions
+	start = perf_counter()
+	pushed = 0
+	for sub in list(subscriptions.values()):
+		if sub.switchID not in tables or sub.writer in skip:
+			continue
+		flowType, flowTable = tables[sub.switchID]
+		held = sub.held if isinstance(sub.held, tuple) else (0, 0)
+		if sub.Send(*FlowReply(sub.switchID, flowType, flowTable, version,
+				held)):
+			Log(LOG_VERBOSE, "│  ├─»Pushed new flow table to switch ",
+				GetAddr(sub.switchID), ".")
+			pushed += 1
+	Count("pushes", pushed)
+	Log(LOG_VERBOSE, "│  └─»", len(subscriptions) - pushed,
+		" subscription(s) unchanged.")
+	Lap("push_send", start)
 
+###############################################################################
+# Func: PushFlowTables                                                        #
+# Desc: Computes the flow table of every subscribed switch and pushes the     #
+#       ones that changed.                                                    #
+# Args: N/A                                                                   #
+# Retn: N/A                                                                   #
+###############################################################################
+async def PushFlowTables():
+	global subscriptions
+	switchIDs = sorted({sub.switchID for sub in subscriptions.values()})
+	if len(switchIDs) == 0:
+		return
+	Log(LOG_VERBOSE, "├─»Computing flow tables of ", len(switchIDs),
+		" subscribed switch(es).")
+	try:
+		version, tables = await BatchFlowTables(switchIDs)
+	except (OSError, ProtocolError) as error:
+		Log(LOG_INFO, "│  └─»Error: Router unavailable (", error, ").")
+		return
+	SendPushes(version, tables)
 
+###############################################################################
+# Func: CoalescedTable                                                        #
+# Desc: Gets the flow table of a switch from the next coalesced recompute     #
+#       (--debounce). The first request opens a window of debounceWindow      #
+#       seconds; every request that arrives in it, from any switch, is        #
+#       answered by the same recompute, which computes each switch's table    #
+#       once however many updates it sent.                                    #
+# Args: switchID {int} - ID of the switch.                                    #
+#       writer {StreamWriter} - the connection the table will be sent on.     #
+# Retn: {int} - the MSG_* type of the Flow Table Packet.                      #
+#       {bytes} - the Flow Table Packet.                                      #
+#       {int} - topology version it was computed from.                        #
+###############################################################################
+async def CoalescedTable(switchID, writer):
+	global pendingTables, pendingWriters, pendingFlush
+	pendingWriters.add(writer)
+	future = pendingTables.get(switchID)
+	if future is None:
+		future = pendingTables[switchID] = \
+			asyncio.get_running_loop().create_future()
+	if pendingFlush is None:
+		pendingFlush = asyncio.ensure_future(FlushUpdates())
+	return await asyncio.shield(future)
 
+###############################################################################
+# Func: FlushUpdates                                                          #
+# Desc: Runs a coalesced recompute once its window closes: one batch for      #
+#       the switches waiting on it and, if the network changed since the      #
+#       last push, every subscribed switch, whose new tables are pushed.      #
+#       However it ends, no request is left waiting: one the recompute did    #
+#       not answer fails with the error.                                      #
+# Args: N/A                                                                   #
+# Retn: N/A                                                                   #
+###############################################################################
+async def FlushUpdates():
+	global pendingTables, pendingWriters, pendingFlush, pushedVersion
+	global debounceWindow, subscriptions, topologyVersion
+	await asyncio.sleep(debounceWindow)
+	pending, writers = pendingTables, pendingWriters
+	pendingTables, pendingWriters, pendingFlush = {}, set(), None
+	# Requests from now on wait for the next recompute.
+	push = topologyVersion != pushedVersion
+	switchIDs = set(pending)
+	if push:
+		switchIDs.update(sub.switchID for sub in subscriptions.values())
+	Log(LOG_VERBOSE, "├─»Coalesced ", len(pending), " request(s), computing ",
+		len(switchIDs), " flow table(s).")
+	Count("coalesced", len(pending))
+	error = OSError("no flow table from router")
+	try:
+		version, tables = await BatchFlowTables(sorted(switchIDs))
+		for ID, future in pending.items():
+			if ID in tables:
+				future.set_result(tables[ID] + (version,))
+		if push:
+			pushedVersion = max(pushedVersion, version)
+			SendPushes(version, tables, writers)
+	except (OSError, ProtocolError) as batchError:
+		error = batchError
+	except Exception as batchError:
+		Log(LOG_INFO, "├─»Error: Coalesced recompute failed (",
+			type(batchError).__name__, ": ", batchError, ").")
+		error = OSError("flow table recompute failed")
+	finally:
+		for future in pending.values():
+			if not future.done():
+				future.set_exception(error)
+
+###############################################################################
+# Func: StatsReport                                                           #
+# Desc: Creates the answer to a STATS message: the controller's stage         #
+#       latencies and counters, and the router's if it answers.               #
+# Args: N/A                                                                   #
+# Retn: {bytes} - the STATS payload (JSON).                                   #
+###############################################################################
+async def StatsReport():
+	global addressMapList, subscriptions, topologyVersion
+	report = {"controller": Report(), "router": None}
+	report["controller"]["counters"].update({"hosts": len(addressMapList),
+		"subscriptions": len(subscriptions),
+		"topology_version": topologyVersion})
+	try:
+		_, payload = await RouterRequest(MSG_STATS, b"")
+		report["router"] = json.loads(payload)
+	except (OSError, ValueError):			# Router down or too old.
+		pass
+	return EncodeReport(report)
+
+###############################################################################
+# Func: SwitchHandler                                                         #
+# Desc: Serves one switch connection; many run at once on the event loop.     #
+#       Changes to the network (and the Adj. Matrix Packet built from them)   #
+#       are serialized by topologyLock, so every packet sees a consistent     #
+#       network, but the lock is released while waiting on the router.        #
+#       Framed connections may carry any number of Update Packets, and a      #
+#       Subscribe Packet turns the connection into a subscription: the        #
+#       switch gets its flow table right away and again whenever a change     #
+#       made by any switch alters it. A Multi-Update Packet is applied as     #
+#       one change. With --debounce, flow tables come from the coalesced      #
+#       recompute (CoalescedTable) instead of a router request each. The      #
+#       time spent in each stage of a request (receive, mutate, build, wal,   #
+#       router, send) is recorded, and a STATS message is answered with the   #
+#       recorded latencies.                                                   #
+# Args: reader {StreamReader} - the switch connection.                        #
+#       writer {StreamWriter} - the switch connection.                        #
+# Retn: N/A                                                                   #
+###############################################################################
+async def SwitchHandler(reader, writer):
+	global topologyLock, sessionLimit, subscriptions, topologyVersion
+	global topologyLog, debounceWindow
+	coalesce = debounceWindow > 0 and not protocol.legacyMode
+	Log(LOG_INFO, "Connected to switch ", writer.get_extra_info("peername"),
+		".")
+	try:
+		while True:
+			msgType, requestID, packetUpdate = await ReadFrame(reader)
+			if packetUpdate is None:
+				break
+			start = lap = perf_counter()	# Includes waiting for a slot.
+			async with sessionLimit:
+				if not protocol.legacyMode and msgType not in (MSG_UPDATE,
+						MSG_UPDATE_BATCH, MSG_SUBSCRIBE, MSG_STATS):
+					raise ProtocolError("unexpected message type "
+						+ str(msgType))
+				if msgType == MSG_STATS:
+					WriteFrame(writer, MSG_STATS, await StatsReport(),
+						requestID)
+					await writer.drain()
+					continue
+				fields = packetUpdate.decode().partition("\n")[0].split(", ")
+				async with topologyLock:
+					lap = Lap("receive", lap)	# Includes waiting for the lock.
+					before = topologyVersion
+					if msgType == MSG_SUBSCRIBE:
+						srcID = int(fields[0])
+						held = ParseHeldVersion(fields, 1)
+						Log(LOG_VERBOSE, "├─»Switch ", GetAddr(srcID),
+							" subscribed.")
+						subscriptions[writer] = Subscription(srcID, writer,
+							held)
+					elif msgType == MSG_UPDATE_BATCH:
+						srcID = ApplyUpdates(packetUpdate.decode())
+						held = ParseHeldVersion(fields, 4)
+					else:
+						srcID = ApplyUpdate(packetUpdate.decode())
+						held = ParseHeldVersion(fields, 4)
+					version = topologyVersion
+					lap = Lap("mutate", lap)
+					if not coalesce:
+						Log(LOG_VERBOSE, "├─»Creating packet for router.")
+						adjType, packetAdjMatix = CreateRouterPacket(srcID)
+						lap = Lap("build", lap)
+				if topologyLog is not None and version != before:
+					await topologyLog.Sync()	# Durable before it is answered.
+					lap = Lap("wal", lap)
+				try:
+					if coalesce:
+						Log(LOG_VERBOSE, "├─»Waiting for the coalesced "
+							"recompute.")
+						flowType, flowTable, version = await CoalescedTable(
+							srcID, writer)
+					elif adjType == MSG_TOPO_SYNC:
+						Log(LOG_VERBOSE, "├─»Sending Topology Sync Packet to "
+							"router.")
+						version, tables = await SyncRequest(packetAdjMatix,
+							version)
+						flowType, flowTable = MSG_FLOW_BINARY, tables[0][1]
+					else:
+						Log(LOG_VERBOSE, "├─»Sending Adjacency Matrix Packet "
+							"to router.")
+						flowType, flowTable = await RouterRequest(adjType,
+							packetAdjMatix)
+				except (OSError, ProtocolError) as error:
+					Log(LOG_INFO, "├─»Error: Router unavailable (", error,
+						").")
+					break
+				lap = Lap("router", lap)
+				# Send flow table to switch.
+				Log(LOG_VERBOSE, "├─»Sending flow table to switch ",
+					GetAddr(srcID), ".")
+				if not protocol.legacyMode:
+					if not coalesce:		# The recompute recorded it.
+						RecordFlowTable(srcID, flowType, flowTable, version)
+					if writer in subscriptions and held != (0, 0):
+						# The switch applies what it was last sent before
+						# this reply, whatever it held when it sent the
+						# packet (0:0 asks for a full table).
+						sub = subscriptions[writer]
+						held = sub.held if isinstance(sub.held, tuple) \
+							else (0, 0)
+					reply = FlowReply(srcID, flowType, flowTable, version,
+						held)
+				if writer in subscriptions:
+					subscriptions[writer].Send(*reply, requestID)
+				elif protocol.legacyMode:
+					WriteFrame(writer, flowType, flowTable)
+				else:
+					WriteFrame(writer, reply[0], reply[1], requestID)
+				await writer.drain()
+				Record("request", Lap("send", lap) - start)
+				Count("subscribes" if msgType == MSG_SUBSCRIBE else "updates")
+				if protocol.legacyMode:
+					break
+				# Push the change to every other switch it affects (the
+				# coalesced recompute pushes on its own).
+				if version != before and not coalesce:
+					await PushFlowTables()
+	except (OSError, ProtocolError) as error:
+		Log(LOG_INFO, "├─»Error: ", error, ".")
+	subscriptions.pop(writer, None)
+	writer.close()
+	Log(LOG_INFO, "└─»Disconnected from switch.")
+
+###############################################################################
+# Func: ServeSwitches                                                         #
+# Desc: Runs the controller's server until it is killed.                      #
+# Args: port {int} - port to listen for switches on.                          #
+#       backlog {int} - listen backlog.                                       #
+#       maxSessions {int} - most switch requests handled at once; more wait   #
+#                           for a free slot. A connection holds one only      #
+#                           while a request on it is handled, so idle         #
+#                           subscriptions do not use them up.                 #
+# Retn: N/A                                                                   #
+###############################################################################
+async def ServeSwitches(port, backlog, maxSessions):
+	global topologyLock, sessionLimit
+	topologyLock = asyncio.Lock()
+	sessionLimit = asyncio.Semaphore(maxSessions)
+	server = await asyncio.start_server(SwitchHandler, "0.0.0.0", port,
+		backlog=backlog)						# IPv4 only, as the switch is.
+	port = server.sockets[0].getsockname()[1]	# If port 0 picked a free one.
+	print("Controller listening on port " + str(port) +".", flush=True)
+	async with server:
+		await server.serve_forever()
+
+###############################################################################
+addressMapList = []		# ID -> AddrMap (IDs are list indexes).
+idByAddr = {}			# Address -> ID.
+packedAddrs = array("I")	# ID -> address as a uint32.
+portMap = []			# ID -> {port: SrcPortDstMap}.
+neighborMap = []		# ID -> {neighbor ID: port}.
+freePorts = []			# ID -> min-heap of released ports.
+nextPort = []			# ID -> lowest port never handed out by a scan.
+routerHost = 'localhost'
+routerPort = 1234
+routerTimeout = 30			# Seconds to wait for the router to answer.
+controllerPort = 2345
+textPackets = False			# Send the text Adj. Matrix Packet to the router.
+subscriptions = {}			# Switch connection -> Subscription.
+topologyVersion = 0			# Bumped by every ADD and DELETE.
+routerSync = TopologySync()	# Changes the router has not been sent yet.
+flowHistory = {}			# Switch ID -> FlowHistory.
+historySize = 8				# Flow tables kept per switch for deltas.
+flowEpoch = random.randrange(1, 1 << 32)	# New on every start, so neither
+											# a switch nor the router trusts
+											# an old version.
+topologyLog = None			# TopologyLog, if the network is kept on disk.
+debounceWindow = 0			# Seconds requests wait to share a recompute.
+pendingTables = {}			# Switch ID -> Future of its coalesced table.
+pendingWriters = set()		# Connections waiting on those tables.
+pendingFlush = None			# Task of the next coalesced recompute.
+pushedVersion = 0			# Topology version last pushed by a recompute.
+snapHeader = Struct("!4sIQ")	# Magic, format version, seq.
+logHeader = Struct("!4sIQ")		# Magic, format version, seq at log start.
+walRecord = Struct("!BIHIHII")	# Op, srcID, port, dstID, dstPort, cost,
+								# dst address (used if the host is new).
+walCRC = Struct("!I")			# CRC-32 of the record.
+walAdd = 1
+walDelete = 2
+walBegin = 3					# Starts a transaction of dstID records.
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="SDN controller program.")
+	parser.add_argument("--legacy", action="store_true",
+		help="use the old unframed protocol (messages limited to 2048 bytes)")
+	parser.add_argument("-r", "--router-connections", type=int, default=2,
+		help="number of persistent connections to the router")
+	parser.add_argument("-b", "--backlog", type=int, default=128,
+		help="listen backlog for switch connections")
+	parser.add_argument("-m", "--max-sessions", type=int, default=64,
+		help="most switch requests handled at once")
+	parser.add_argument("--text", action="store_true",
+		help="send the router the text edge list instead of the binary "
+			+ "link list")
+	parser.add_argument("-t", "--topology", default="adjMatrix.txt",
+		help="initial topology file (dense matrix or sparse edge list)")
+	parser.add_argument("--port", type=int, default=controllerPort,
+		help="port to listen for switches on (0 picks a free one)")
+	parser.add_argument("--router-port", type=int, default=routerPort,
+		help="port the router listens on")
+	parser.add_argument("--router-timeout", type=float,
+		default=routerTimeout*1000, help="milliseconds to wait for the "
+			+ "router to answer a request")
+	parser.add_argument("-w", "--wal", metavar="NAME",
+		help="keep the network in NAME.snap and NAME.wal across restarts")
+	parser.add_argument("--fsync-interval", type=float, default=5,
+		help="milliseconds updates wait to share one fsync of the log")
+	parser.add_argument("--snapshot-every", type=int, default=1000,
+		help="log records between snapshots (bounds the replay at startup)")
+	parser.add_argument("-d", "--debounce", type=float, default=0,
+		help="milliseconds updates from all switches wait to share one flow "
+			+ "table recompute (0 computes each at once)")
+	parser.add_argument("-l", "--log-level", choices=metrics.logLevels,
+		default="verbose", help="how much to print (verbose prints every "
+			+ "step of every request)")
+	args = parser.parse_args()
+	protocol.legacyMode = args.legacy
+	debounceWindow = args.debounce/1000
+	metrics.logLevel = metrics.logLevels[args.log_level]
+	textPackets = args.text or args.legacy
+	controllerPort = args.port
+	routerPort = args.router_port
+	routerTimeout = args.router_timeout/1000
+
+	if args.wal is None:
+		loadNetTopo(args.topology)				# Load initial network topology.
+	else:
+		topologyLog = TopologyLog(args.wal, args.fsync_interval/1000,
+			args.snapshot_every)
+		topologyLog.Recover(args.topology)
+	routerPool = RouterPool(routerHost, routerPort, args.router_connections)
+	asyncio.run(ServeSwitches(controllerPort, args.backlog, args.max_sessions))
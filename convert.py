@@ -0,0 +1,61 @@
+###############################################################################
+# Name: convert.py                                                            #
+#                                                                             #
+# Converts a topology file between the dense adjacency matrix and the sparse  #
+# edge list (see loadNetTopo in controller.py). The file is loaded with the   #
+# controller's own loader and written with its text Adj. Matrix Packet, so    #
+# both formats stay exactly what the controller and router read. By default   #
+# the output is in the other format from the input.                           #
+#   python3 convert.py adjMatrix.txt adjSparse.txt                            #
+###############################################################################
+
+import argparse
+
+import controller
+
+###############################################################################
+# Func: IsSparse                                                              #
+# Desc: Detects the format of a topology file from its line 0.                #
+# Args: fileName {string} - the topology file.                                #
+# Retn: {int} - the source ID on line 0.                                      #
+#       {bool} - whether the file is a sparse edge list.                      #
+###############################################################################
+def IsSparse(fileName):
+	with open(fileName, 'r') as topoFile:
+		fields = topoFile.readline().replace(" ", "").strip().split(",")
+	return int(fields[0]), len(fields) > 2 and fields[2] == "sparse"
+
+###############################################################################
+# Func: Convert                                                               #
+# Desc: Converts one topology file.                                           #
+# Args: inFile {string} - the topology file to read.                          #
+#       outFile {string} - the topology file to write.                        #
+#       sparse {bool} - whether to write the edge list (None for the other    #
+#                       format from the input).                               #
+# Retn: {bool} - whether the edge list was written.                           #
+###############################################################################
+def Convert(inFile, outFile, sparse=None):
+	srcID, inSparse = IsSparse(inFile)
+	if sparse is None:
+		sparse = not inSparse
+	controller.loadNetTopo(inFile)
+	with open(outFile, 'w') as topoFile:
+		topoFile.writelines(controller.CreateAdjMatrixPacket(srcID, sparse))
+	return sparse
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Converts a topology file "
+		+ "between the dense matrix and the sparse edge list.")
+	parser.add_argument("input", help="topology file to read")
+	parser.add_argument("output", help="topology file to write")
+	group = parser.add_mutually_exclusive_group()
+	group.add_argument("-s", "--sparse", dest="sparse", action="store_true",
+		default=None, help="write the sparse edge list")
+	group.add_argument("-d", "--dense", dest="sparse", action="store_false",
+		help="write the dense adjacency matrix")
+	args = parser.parse_args()
+
+	sparse = Convert(args.input, args.output, args.sparse)
+	print("Wrote %d hosts to %s as a %s." % (len(controller.addressMapList),
+		args.output, "sparse edge list" if sparse else "dense matrix"))
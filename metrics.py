@@ -0,0 +1,158 @@
+###############################################################################
+# Name: metrics.py                                                            #
+#                                                                             #
+# Instrumentation shared by the controller and router programs: a latency     #
+# histogram for every stage of a request, a few counters, and the log level   #
+# that the step-by-step output is printed at.                                 #
+# A stage is timed with Lap, from the end of the stage before it, and costs   #
+# a perf_counter call and a bucket increment. Histograms split every power of #
+# two microseconds into 4 buckets, so they take a fixed amount of memory      #
+# however many requests are timed; percentiles are read from the buckets (to  #
+# within 25%), while the count, mean, min and max are exact. Report() gives   #
+# everything as a dict, which is what a STATS message is answered with (as    #
+# JSON).                                                                      #
+###############################################################################
+
+from time import perf_counter
+import json
+
+# Log levels.
+LOG_QUIET = 0					# Only startup lines and fatal errors.
+LOG_INFO = 1					# Plus connections, recoveries and errors.
+LOG_VERBOSE = 2					# Plus the step-by-step tree (the default).
+
+###############################################################################
+# Class: Histogram                                                            #
+# Description: Latencies of one stage in log-linear microsecond buckets:      #
+#              below 4 us a bucket per microsecond, then 4 buckets for every  #
+#              power of two (4-4.99, 5-5.99, ... 8-9.99, 10-11.99 us, ...).   #
+###############################################################################
+class Histogram:
+	__slots__ = ("counts", "count", "total", "low", "high")
+
+	def __init__(self):
+		self.counts = [0]*160				# Up to 2^40 us (12 days).
+		self.count = 0
+		self.total = 0.0
+		self.low = float("inf")
+		self.high = 0.0
+
+	@staticmethod
+	def Bucket(micros):
+		exp = micros.bit_length()
+		if exp <= 2:
+			return micros
+		return min(4*(exp - 2) + ((micros >> (exp - 3)) & 3), 159)
+
+	@staticmethod
+	def Upper(bucket):
+		if bucket < 4:
+			return bucket + 1
+		return (5 + bucket % 4) << (bucket//4 - 1)
+
+	def Add(self, seconds):
+		bucket = self.Bucket(int(seconds*1e6))
+		self.counts[bucket] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds < self.low:
+			self.low = seconds
+		if seconds > self.high:
+			self.high = seconds
+
+	def Percentile(self, percent):
+		rank = percent*self.count/100
+		seen = 0
+		for bucket, count in enumerate(self.counts):
+			seen += count
+			if count > 0 and seen >= rank:
+				return min(self.Upper(bucket)/1e6, self.high)
+		return self.high
+
+	def Summary(self):
+		if self.count == 0:
+			return {"count": 0}
+		return {"count": self.count, "mean_ms": 1000*self.total/self.count,
+			"min_ms": 1000*self.low, "max_ms": 1000*self.high,
+			"p50_ms": 1000*self.Percentile(50),
+			"p99_ms": 1000*self.Percentile(99)}
+
+###############################################################################
+# Func: Record                                                                #
+# Desc: Adds one latency to the histogram of a stage.                         #
+# Args: name {string} - the stage.                                            #
+#       seconds {float} - the latency.                                        #
+# Retn: N/A                                                                   #
+###############################################################################
+def Record(name, seconds):
+	global stages
+	histogram = stages.get(name)
+	if histogram is None:
+		histogram = stages[name] = Histogram()
+	histogram.Add(seconds)
+
+###############################################################################
+# Func: Lap                                                                   #
+# Desc: Records the time since start as one latency of a stage, for timing    #
+#       consecutive stages with one clock read each.                          #
+# Args: name {string} - the stage.                                            #
+#       start {float} - perf_counter() when the stage began.                  #
+# Retn: {float} - perf_counter() now, the start of the next stage.            #
+###############################################################################
+def Lap(name, start):
+	now = perf_counter()
+	Record(name, now - start)
+	return now
+
+###############################################################################
+# Func: Count                                                                 #
+# Desc: Adds to a counter.                                                    #
+# Args: name {string} - the counter.                                          #
+#       amount {int} - how much to add.                                       #
+# Retn: N/A                                                                   #
+###############################################################################
+def Count(name, amount=1):
+	global counters
+	counters[name] = counters.get(name, 0) + amount
+
+###############################################################################
+# Func: Report                                                                #
+# Desc: Summarizes every stage and counter.                                   #
+# Args: N/A                                                                   #
+# Retn: {dict} - uptime, stage summaries (in ms) and counters.                #
+###############################################################################
+def Report():
+	global stages, counters, startTime
+	return {"uptime_s": perf_counter() - startTime,
+		"stages": {name: histogram.Summary()
+			for name, histogram in stages.items()},
+		"counters": dict(counters)}
+
+###############################################################################
+# Func: EncodeReport                                                          #
+# Desc: Encodes a report as the payload of a STATS message.                   #
+# Args: report {dict} - the report.                                           #
+# Retn: {bytes} - the payload.                                                #
+###############################################################################
+def EncodeReport(report):
+	return json.dumps(report, sort_keys=True).encode()
+
+###############################################################################
+# Func: Log                                                                   #
+# Desc: Prints a message if the log level is at least level. The parts are    #
+#       only converted and joined if the message is printed, so a quiet       #
+#       program pays no more than the call for it.                            #
+# Args: level {int} - LOG_* level of the message.                             #
+#       *parts - the message, in pieces.                                      #
+# Retn: N/A                                                                   #
+###############################################################################
+def Log(level, *parts):
+	if level <= logLevel:
+		print("".join([str(part) for part in parts]))
+
+###############################################################################
+stages = {}						# Stage name -> Histogram.
+counters = {}					# Counter name -> count.
+startTime = perf_counter()
+logLevel = LOG_VERBOSE
+logLevels = {"quiet": LOG_QUIET, "info": LOG_INFO, "verbose": LOG_VERBOSE}
@@ -0,0 +1,523 @@
+###############################################################################
+# Name: protocol.py                                                           #
+#                                                                             #
+# The wire protocol shared by the switch, controller and router programs.     #
+# Every message is framed by a fixed header holding the protocol version, the #
+# message type, a request ID and the payload length, so messages of any size  #
+# arrive intact. A reply carries the ID of its request, which lets several    #
+# requests share one connection and be answered in any order.                 #
+# The payload is read straight into a buffer of the right size with           #
+# recv_into. The original unframed format (a single send and a recv(2048))    #
+# is still available by setting legacyMode.                                   #
+#                                                                             #
+# Adjacency and flow-table packets also have a compact binary encoding. All   #
+# integers are big-endian and each column is a fixed-width array, so either   #
+# end can decode a whole column with a single array.frombytes call:           #
+#   Adj. Matrix:  srcID, numNodes, numLinks (uint32 each), then the columns   #
+#                 addr[numNodes] (uint32), linkSrc, linkDst, linkCost         #
+#                 [numLinks] (uint32) and linkPort[numLinks] (uint16).        #
+#   Flow Table:   numFlows (uint32), then the columns addr[numFlows]          #
+#                 (uint32) and port[numFlows] (uint16).                       #
+#   Topo. Delta:  numHosts, numUpserts, numRemovals (uint32 each), then the   #
+#                 columns addr[numHosts], upSrc, upDst, upCost[numUpserts]    #
+#                 (uint32), upPort[numUpserts] (uint16), rmSrc[numRemovals]   #
+#                 (uint32) and rmPort[numRemovals] (uint16).                  #
+# A destination with several equal-cost ports (ECMP) is listed once per port, #
+# in consecutive rows, in every flow table encoding; a program that keeps     #
+# only one port per destination still forwards on a shortest path.            #
+# A backup port (a loop-free alternate, to fail over to when the primary      #
+# ports go down) is listed the same way, after the primary rows, with         #
+# BACKUP_PORT added to it; ports themselves are therefore below BACKUP_PORT.  #
+###############################################################################
+
+from array import array
+from itertools import compress
+from operator import ne
+from socket import inet_aton, inet_ntoa
+import asyncio
+from struct import Struct
+import sys
+
+PROTOCOL_VERSION = 2
+MAX_PAYLOAD = 1 << 30			# Refuse anything claiming to be over 1 GiB.
+
+# Message types.
+MSG_UPDATE = 1					# Update Packet (switch -> controller).
+MSG_ADJ_MATRIX = 2				# Adj. Matrix Packet (controller -> router).
+MSG_FLOW_TABLE = 3				# Flow Table Packet (router -> controller ->
+								# switch).
+								# 4 was a binary Adj. Matrix Packet (it is
+								# sent in a Topology Sync Packet instead).
+MSG_FLOW_BINARY = 5				# Binary Flow Table Packet.
+MSG_SUBSCRIBE = 6				# Subscribe Packet (switch -> controller).
+MSG_FLOW_DELTA = 7				# Versioned Flow Table Delta Packet
+								# (controller -> switch).
+								# 8 was a Batch Adj. Matrix Packet (replaced by
+								# the Topology Sync Packet).
+MSG_FLOW_BATCH = 9				# Batch Flow Table Packet: a binary table for
+								# every source (router -> controller).
+MSG_STATS = 10					# Stats request (empty) and its answer, the
+								# stage latencies as JSON (to the controller
+								# or the router).
+MSG_UPDATE_BATCH = 11			# Multi-Update Packet: Update Packets of one
+								# switch, a line each, applied as one change
+								# (switch -> controller).
+MSG_TOPO_SYNC = 12				# Topology Sync Packet: the topology changes
+								# since a version the router holds (or the
+								# whole topology) and the sources to compute
+								# (controller -> router).
+MSG_TOPO_STALE = 13				# The router does not hold the base version of
+								# a Topology Sync Packet; carries the version
+								# it holds (router -> controller).
+MSG_ERROR = 14					# The router failed to answer a request;
+								# carries the error (router -> controller).
+
+frameHeader = Struct("!BBII")	# Version, type, request ID, payload length.
+adjHeader = Struct("!III")		# srcID, numNodes, numLinks.
+flowHeader = Struct("!I")		# numFlows.
+deltaHeader = Struct("!IIIII")	# Epoch, base seq, new seq, numUpserts,
+								# numRemovals.
+batchHeader = Struct("!I")		# numTables.
+batchEntry = Struct("!II")		# srcID, table length.
+syncHeader = Struct("!BIIII")	# Full, epoch, base version, version,
+								# numSources.
+syncHeld = Struct("!II")		# Epoch, version (of a MSG_TOPO_STALE).
+topoDeltaHeader = Struct("!III")	# numHosts, numUpserts, numRemovals.
+BACKUP_PORT = 0x8000			# Flags a flow table row's port as a backup.
+MAX_PORT = BACKUP_PORT - 1		# Highest port a link may use.
+swapBytes = sys.byteorder == "little"	# Arrays are big-endian on the wire.
+legacyMode = False				# Use the unframed format instead.
+
+###############################################################################
+# Class: ProtocolError                                                        #
+# Description: Raised for a malformed, unexpected or wrong-version message.   #
+###############################################################################
+class ProtocolError(Exception):
+	pass
+
+###############################################################################
+# Func: RecvInto                                                              #
+# Desc: Fills a buffer from a socket, however many recv calls it takes.       #
+# Args: sock {socket} - the connected socket.                                 #
+#       view {memoryview} - the buffer to fill.                               #
+# Retn: {int} - number of bytes read (less than len(view) only if the peer    #
+#               closed the connection).                                       #
+###############################################################################
+def RecvInto(sock, view):
+	total = 0
+	while total < len(view):
+		count = sock.recv_into(view[total:])
+		if count == 0:					# Connection closed.
+			break
+		total += count
+	return total
+
+###############################################################################
+# Func: SendPacket                                                            #
+# Desc: Sends one packet, framed unless legacyMode is set.                    #
+# Args: sock {socket} - the connected socket.                                 #
+#       msgType {int} - one of the MSG_* types.                               #
+#       payload {bytes|string} - the packet.                                  #
+#       requestID {int} - ID of the request (or of the request answered).     #
+# Retn: N/A                                                                   #
+###############################################################################
+def SendPacket(sock, msgType, payload, requestID=0):
+	if isinstance(payload, str):
+		payload = payload.encode()
+	if legacyMode:
+		sock.send(payload)
+	else:
+		sock.sendall(frameHeader.pack(PROTOCOL_VERSION, msgType, requestID,
+			len(payload)) + payload)
+
+###############################################################################
+# Func: RecvFrame                                                             #
+# Desc: Receives one packet of any type along with its request ID. In         #
+#       legacyMode this is a single recv(2048), as before, and the type and   #
+#       ID are always None.                                                   #
+# Args: sock {socket} - the connected socket.                                 #
+# Retn: {int} - the MSG_* type.                                               #
+#       {int} - the request ID.                                               #
+#       {bytearray} - the payload. All three are None if the peer closed      #
+#                     the connection before sending anything.                 #
+###############################################################################
+def RecvFrame(sock):
+	if legacyMode:
+		payload = sock.recv(2048)
+		return (None, None, payload) if len(payload) > 0 else (None, None, None)
+	head = bytearray(frameHeader.size)
+	count = RecvInto(sock, memoryview(head))
+	if count == 0:
+		return None, None, None
+	if count < frameHeader.size:
+		raise ProtocolError("connection closed inside a message header")
+	version, msgType, requestID, length = frameHeader.unpack(head)
+	if version != PROTOCOL_VERSION:
+		raise ProtocolError("unsupported protocol version " + str(version))
+	if length > MAX_PAYLOAD:
+		raise ProtocolError("message too large (" + str(length) + " bytes)")
+	payload = bytearray(length)			# Preallocated to the full size.
+	if RecvInto(sock, memoryview(payload)) < length:
+		raise ProtocolError("connection closed inside a message")
+	return msgType, requestID, payload
+
+###############################################################################
+# Func: RecvMessage                                                           #
+# Desc: Receives one packet of any type (see RecvFrame).                      #
+# Args: sock {socket} - the connected socket.                                 #
+# Retn: {int} - the MSG_* type.                                               #
+#       {bytearray} - the payload. Both are None if the peer closed the       #
+#                     connection before sending anything.                     #
+###############################################################################
+def RecvMessage(sock):
+	msgType, requestID, payload = RecvFrame(sock)
+	return msgType, payload
+
+###############################################################################
+# Func: ReadFrame                                                             #
+# Desc: Asyncio version of RecvFrame, for a StreamReader.                     #
+# Args: reader {StreamReader} - the connection.                               #
+# Retn: {int} - the MSG_* type.                                               #
+#       {int} - the request ID.                                               #
+#       {bytes} - the payload. All three are None if the peer closed the      #
+#                 connection before sending anything.                         #
+###############################################################################
+async def ReadFrame(reader):
+	if legacyMode:
+		payload = await reader.read(2048)
+		return (None, None, payload) if len(payload) > 0 else (None, None, None)
+	try:
+		head = await reader.readexactly(frameHeader.size)
+	except asyncio.IncompleteReadError as error:
+		if len(error.partial) == 0:
+			return None, None, None
+		raise ProtocolError("connection closed inside a message header")
+	version, msgType, requestID, length = frameHeader.unpack(head)
+	if version != PROTOCOL_VERSION:
+		raise ProtocolError("unsupported protocol version " + str(version))
+	if length > MAX_PAYLOAD:
+		raise ProtocolError("message too large (" + str(length) + " bytes)")
+	try:
+		payload = await reader.readexactly(length)
+	except asyncio.IncompleteReadError:
+		raise ProtocolError("connection closed inside a message")
+	return msgType, requestID, payload
+
+###############################################################################
+# Func: WriteFrame                                                            #
+# Desc: Asyncio version of SendPacket, for a StreamWriter. The caller should  #
+#       await writer.drain().                                                 #
+# Args: writer {StreamWriter} - the connection.                               #
+#       msgType {int} - one of the MSG_* types.                               #
+#       payload {bytes|string} - the packet.                                  #
+#       requestID {int} - ID of the request (or of the request answered).     #
+# Retn: N/A                                                                   #
+###############################################################################
+def WriteFrame(writer, msgType, payload, requestID=0):
+	if isinstance(payload, str):
+		payload = payload.encode()
+	if legacyMode:
+		writer.write(payload)
+	else:
+		writer.write(frameHeader.pack(PROTOCOL_VERSION, msgType, requestID,
+			len(payload)) + payload)
+
+###############################################################################
+# Func: AddrToInt                                                             #
+# Desc: Packs a dotted IPv4 address into an integer.                          #
+# Args: addr {string} - the IPv4 address.                                     #
+# Retn: {int} - the address as a uint32.                                      #
+###############################################################################
+def AddrToInt(addr):
+	return int.from_bytes(inet_aton(addr), "big")
+
+###############################################################################
+# Func: IntToAddr                                                             #
+# Desc: Unpacks an integer into a dotted IPv4 address.                        #
+# Args: value {int} - the address as a uint32.                                #
+# Retn: {string} - the IPv4 address.                                          #
+###############################################################################
+def IntToAddr(value):
+	return inet_ntoa(value.to_bytes(4, "big"))
+
+###############################################################################
+# Func: PackColumns                                                           #
+# Desc: Serializes arrays as consecutive big-endian columns.                  #
+# Args: columns {list: array} - the columns (byte-swapped in place).          #
+# Retn: {bytes} - the packed columns.                                         #
+###############################################################################
+def PackColumns(columns):
+	if swapBytes:
+		for column in columns:
+			column.byteswap()
+	return b"".join(column.tobytes() for column in columns)
+
+###############################################################################
+# Func: UnpackColumn                                                          #
+# Desc: Reads one big-endian column out of a payload.                         #
+# Args: view {memoryview} - the payload.                                      #
+#       offset {int} - byte offset of the column.                             #
+#       typecode {string} - array typecode ("I", "H" or "B").                 #
+#       count {int} - number of items in the column.                          #
+# Retn: {array} - the column.                                                 #
+#       {int} - byte offset of the next column.                               #
+###############################################################################
+def UnpackColumn(view, offset, typecode, count):
+	column = array(typecode)
+	end = offset + count*column.itemsize
+	if end > len(view):
+		raise ProtocolError("packet shorter than its header claims")
+	column.frombytes(view[offset:end])
+	if swapBytes:
+		column.byteswap()
+	return column, end
+
+###############################################################################
+# Func: EncodeAdjacency                                                       #
+# Desc: Creates the binary Adj. Matrix Packet.                                #
+# Args: srcID {int} - ID of source vertex.                                    #
+#       addrs {array: I} - packed address of every node, indexed by ID.       #
+#       linkSrc, linkDst, linkCost {array: I} - one entry per link.           #
+#       linkPort {array: H} - one entry per link.                             #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def EncodeAdjacency(srcID, addrs, linkSrc, linkDst, linkCost, linkPort):
+	head = adjHeader.pack(srcID, len(addrs), len(linkSrc))
+	return head + PackColumns([array("I", addrs), array("I", linkSrc),
+		array("I", linkDst), array("I", linkCost), array("H", linkPort)])
+
+###############################################################################
+# Func: DecodeAdjacency                                                       #
+# Desc: Reads a binary Adj. Matrix Packet back into its columns.              #
+# Args: payload {bytes} - the packet.                                         #
+# Retn: {int} - ID of source vertex.                                          #
+#       {array: I} - addrs, linkSrc, linkDst, linkCost.                       #
+#       {array: H} - linkPort.                                                #
+###############################################################################
+def DecodeAdjacency(payload):
+	view = memoryview(payload)
+	srcID, numNodes, numLinks = adjHeader.unpack_from(view)
+	addrs, offset = UnpackColumn(view, adjHeader.size, "I", numNodes)
+	linkSrc, offset = UnpackColumn(view, offset, "I", numLinks)
+	linkDst, offset = UnpackColumn(view, offset, "I", numLinks)
+	linkCost, offset = UnpackColumn(view, offset, "I", numLinks)
+	linkPort, offset = UnpackColumn(view, offset, "H", numLinks)
+	return srcID, addrs, linkSrc, linkDst, linkCost, linkPort
+
+###############################################################################
+# Func: EncodeFlowTable                                                       #
+# Desc: Creates the binary Flow Table Packet. Each destination is a prefix:   #
+#       a packed network address and its length (32 for a single host).       #
+# Args: addrs {array: I} - packed destination addresses.                      #
+#       ports {array: H} - forwarding port of each destination.               #
+#       lengths {array: B} - prefix length of each destination (all 32 if     #
+#                            None).                                           #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def EncodeFlowTable(addrs, ports, lengths=None):
+	if lengths is None:
+		lengths = array("B", [32])*len(addrs)
+	return flowHeader.pack(len(addrs)) + PackColumns([array("I", addrs),
+		array("H", ports), array("B", lengths)])
+
+###############################################################################
+# Func: DecodeFlowTable                                                       #
+# Desc: Reads a binary Flow Table Packet back into its columns.               #
+# Args: payload {bytes} - the packet.                                         #
+# Retn: {array: I} - packed destination addresses.                            #
+#       {array: H} - forwarding port of each destination.                     #
+#       {array: B} - prefix length of each destination.                       #
+###############################################################################
+def DecodeFlowTable(payload):
+	view = memoryview(payload)
+	numFlows, = flowHeader.unpack_from(view)
+	addrs, offset = UnpackColumn(view, flowHeader.size, "I", numFlows)
+	ports, offset = UnpackColumn(view, offset, "H", numFlows)
+	lengths, offset = UnpackColumn(view, offset, "B", numFlows)
+	return addrs, ports, lengths
+
+###############################################################################
+# Func: GroupPorts                                                            #
+# Desc: Collects the rows of a flow table into one entry per prefix, the      #
+#       ports of a prefix listed in several rows becoming a sorted tuple      #
+#       (backup ports, still flagged, sort after the primary ones).           #
+# Args: addrs {array: I} - packed destination addresses.                      #
+#       lengths {array: B} - prefix length of each destination.               #
+#       ports {array: H} - forwarding port of each row.                       #
+# Retn: {dict} - (address, length) -> port or tuple of ports.                 #
+###############################################################################
+def GroupPorts(addrs, lengths, ports):
+	prefixes = list(zip(addrs, lengths))
+	table = dict(zip(prefixes, ports))
+	if len(table) == len(addrs):		# No port sets.
+		return table
+	bounds = [0] + list(compress(range(1, len(prefixes)), map(ne,
+		prefixes[1:], prefixes))) + [len(prefixes)]
+	if len(bounds) == len(table) + 1:	# The rows of a prefix are consecutive.
+		for start, end in zip(bounds, bounds[1:]):
+			if end - start > 1:
+				portSet = set(ports[start:end])
+				table[prefixes[start]] = (tuple(sorted(portSet))
+					if len(portSet) > 1 else portSet.pop())
+		return table
+	sets = {}
+	for prefix, port in zip(prefixes, ports):
+		sets.setdefault(prefix, set()).add(port)
+	for prefix, portSet in sets.items():
+		table[prefix] = (tuple(sorted(portSet)) if len(portSet) > 1
+			else portSet.pop())
+	return table
+
+###############################################################################
+# Func: EncodeFlowDelta                                                       #
+# Desc: Creates the binary Flow Table Delta Packet. A flow table version is   #
+#       an (epoch, seq) pair; the packet turns the table at version           #
+#       (epoch, baseSeq) into the one at (epoch, newSeq). A baseSeq of 0      #
+#       means the empty table, i.e. the packet is a full table.               #
+# Args: epoch {int} - epoch of both versions.                                 #
+#       baseSeq {int} - version the delta applies to.                         #
+#       newSeq {int} - version after the delta.                               #
+#       upAddrs {array: I} - prefixes added or moved to a new port.           #
+#       upLengths {array: B} - their lengths.                                 #
+#       upPorts {array: H} - their new ports (a prefix listed in several      #
+#                            rows gets all of them as its port set).          #
+#       removed {array: I} - prefixes no longer in the table.                 #
+#       removedLengths {array: B} - their lengths.                            #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def EncodeFlowDelta(epoch, baseSeq, newSeq, upAddrs, upLengths, upPorts,
+		removed, removedLengths):
+	head = deltaHeader.pack(epoch, baseSeq, newSeq, len(upAddrs), len(removed))
+	return head + PackColumns([array("I", upAddrs), array("H", upPorts),
+		array("B", upLengths), array("I", removed),
+		array("B", removedLengths)])
+
+###############################################################################
+# Func: DecodeFlowDelta                                                       #
+# Desc: Reads a binary Flow Table Delta Packet back into its columns.         #
+# Args: payload {bytes} - the packet.                                         #
+# Retn: {int} - epoch, baseSeq, newSeq.                                       #
+#       {array: I} - upAddrs.                                                 #
+#       {array: B} - upLengths.                                               #
+#       {array: H} - upPorts.                                                 #
+#       {array: I} - removed.                                                 #
+#       {array: B} - removedLengths.                                          #
+###############################################################################
+def DecodeFlowDelta(payload):
+	view = memoryview(payload)
+	epoch, baseSeq, newSeq, numUpserts, numRemovals = \
+		deltaHeader.unpack_from(view)
+	upAddrs, offset = UnpackColumn(view, deltaHeader.size, "I", numUpserts)
+	upPorts, offset = UnpackColumn(view, offset, "H", numUpserts)
+	upLengths, offset = UnpackColumn(view, offset, "B", numUpserts)
+	removed, offset = UnpackColumn(view, offset, "I", numRemovals)
+	removedLengths, offset = UnpackColumn(view, offset, "B", numRemovals)
+	return (epoch, baseSeq, newSeq, upAddrs, upLengths, upPorts, removed,
+		removedLengths)
+
+###############################################################################
+# Func: EncodeFlowBatch                                                       #
+# Desc: Creates the Batch Flow Table Packet.                                  #
+# Args: tables {list: tuple} - (srcID, binary Flow Table Packet) pairs.       #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def EncodeFlowBatch(tables):
+	parts = [batchHeader.pack(len(tables))]
+	for srcID, table in tables:
+		parts.append(batchEntry.pack(srcID, len(table)))
+		parts.append(table)
+	return b"".join(parts)
+
+###############################################################################
+# Func: DecodeFlowBatch                                                       #
+# Desc: Reads a Batch Flow Table Packet.                                      #
+# Args: payload {bytes} - the packet.                                         #
+# Retn: {list: tuple} - (srcID, binary Flow Table Packet) pairs.              #
+###############################################################################
+def DecodeFlowBatch(payload):
+	view = memoryview(payload)
+	numTables, = batchHeader.unpack_from(view)
+	offset = batchHeader.size
+	tables = []
+	for _ in range(numTables):
+		srcID, length = batchEntry.unpack_from(view, offset)
+		offset += batchEntry.size
+		if offset + length > len(view):
+			raise ProtocolError("packet shorter than its header claims")
+		tables.append((srcID, bytes(view[offset:offset + length])))
+		offset += length
+	return tables
+
+###############################################################################
+# Func: EncodeTopologySync                                                    #
+# Desc: Creates the Topology Sync Packet: the version it brings the router    #
+#       to, the sources to compute at that version, then either a binary      #
+#       Adj. Matrix Packet (full, whose own source is ignored) or a Topology  #
+#       Delta Packet from the base version. Versions are numbered within an   #
+#       epoch, which the controller picks anew on every start.                #
+# Args: full {bool} - whether body is the whole topology.                     #
+#       epoch {int} - epoch of both versions.                                 #
+#       base {int} - version the delta applies to (ignored if full).          #
+#       version {int} - version after the packet.                             #
+#       sources {list: int} - IDs of the source vertices.                     #
+#       body {bytes} - the Adj. Matrix or Topology Delta Packet.              #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def EncodeTopologySync(full, epoch, base, version, sources, body):
+	return syncHeader.pack(full, epoch, base, version, len(sources)) + \
+		PackColumns([array("I", sources)]) + body
+
+###############################################################################
+# Func: DecodeTopologySync                                                    #
+# Desc: Reads a Topology Sync Packet.                                         #
+# Args: payload {bytes} - the packet.                                         #
+# Retn: {bool} - whether the body is the whole topology.                      #
+#       {int} - epoch, base version, version.                                 #
+#       {array: I} - IDs of the source vertices.                              #
+#       {memoryview} - the Adj. Matrix or Topology Delta Packet.              #
+###############################################################################
+def DecodeTopologySync(payload):
+	view = memoryview(payload)
+	full, epoch, base, version, numSources = syncHeader.unpack_from(view)
+	sources, offset = UnpackColumn(view, syncHeader.size, "I", numSources)
+	return bool(full), epoch, base, version, sources, view[offset:]
+
+###############################################################################
+# Func: EncodeTopologyDelta                                                   #
+# Desc: Creates the Topology Delta Packet: the hosts added (they take the     #
+#       next IDs, in order) and the links added, changed or removed since     #
+#       the base version. A link is one direction of a connection, and is     #
+#       known by its source and its port there.                               #
+# Args: addrs {array: I} - packed address of every new host.                  #
+#       upSrc, upDst, upCost {array: I} - links added or changed.             #
+#       upPort {array: H} - their ports.                                      #
+#       rmSrc {array: I} - source of every link removed.                      #
+#       rmPort {array: H} - its port.                                         #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def EncodeTopologyDelta(addrs, upSrc, upDst, upCost, upPort, rmSrc, rmPort):
+	head = topoDeltaHeader.pack(len(addrs), len(upSrc), len(rmSrc))
+	return head + PackColumns([array("I", addrs), array("I", upSrc),
+		array("I", upDst), array("I", upCost), array("H", upPort),
+		array("I", rmSrc), array("H", rmPort)])
+
+###############################################################################
+# Func: DecodeTopologyDelta                                                   #
+# Desc: Reads a Topology Delta Packet back into its columns.                  #
+# Args: payload {bytes} - the packet.                                         #
+# Retn: {array: I} - addrs, upSrc, upDst, upCost.                             #
+#       {array: H} - upPort.                                                  #
+#       {array: I} - rmSrc.                                                   #
+#       {array: H} - rmPort.                                                  #
+###############################################################################
+def DecodeTopologyDelta(payload):
+	view = memoryview(payload)
+	numHosts, numUpserts, numRemovals = topoDeltaHeader.unpack_from(view)
+	addrs, offset = UnpackColumn(view, topoDeltaHeader.size, "I", numHosts)
+	upSrc, offset = UnpackColumn(view, offset, "I", numUpserts)
+	upDst, offset = UnpackColumn(view, offset, "I", numUpserts)
+	upCost, offset = UnpackColumn(view, offset, "I", numUpserts)
+	upPort, offset = UnpackColumn(view, offset, "H", numUpserts)
+	rmSrc, offset = UnpackColumn(view, offset, "I", numRemovals)
+	rmPort, offset = UnpackColumn(view, offset, "H", numRemovals)
+	return addrs, upSrc, upDst, upCost, upPort, rmSrc, rmPort
@@ -10,158 +10,1334 @@
 ###############################################################################
 
 from socket import *
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heapify, heappush, heappop
+from itertools import accumulate, chain, compress, repeat
+from operator import le, lt, ne, sub
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+import argparse
+import atexit
+import hashlib
+import signal
 import sys
+import threading
 
-###############################################################################
-# Class: AddrMap                                                              #
-# Description: Maps host IDs to IP address.                                   #
-###############################################################################
-class AddrMap:
-	def __init__(self, ID, address):
-		self.ID = ID
-		self.address = address
+try:
+	import numpy
+except ImportError:				# Batches fall back to one Dijkstra per source.
+	numpy = None
+
+from metrics import LOG_INFO, LOG_VERBOSE, Count, EncodeReport, Lap, Log
+from metrics import Record, Report
+from protocol import *
+import metrics
+import protocol
 
 ###############################################################################
-# Class: Flow                                                                 #
-# Description: Port and destination address pairs.                            #
+# Class: SPFTree                                                              #
+# Description: A shortest-path tree kept between requests so that it can be   #
+#              repaired after a topology change instead of recomputed.        #
+#              Holds the distance, prev and port lists, the children of       #
+#              every node in the tree, the incoming links of every node       #
+#              ({prevNode: cost}), the position in linkLog it is up to date   #
+#              with and, for a topology that is reloaded whole on every       #
+#              request, the adjacency list it was built from (else None).     #
 ###############################################################################
-class Flow:
-	def __init__(self, address, port):
-		self.address = address
-		self.port = port
+class SPFTree:
+	__slots__ = ("dist", "prev", "egress", "children", "inAdj", "logged",
+		"adjList")
+
+	def __init__(self, dist, prev, egress, children, inAdj, logged, adjList):
+		self.dist = dist
+		self.prev = prev
+		self.egress = egress
+		self.children = children
+		self.inAdj = inAdj
+		self.logged = logged
+		self.adjList = adjList
 
 ###############################################################################
 # Func: Dijkstra                                                              #
-# Desc: An implementation of Dijkstra's algorithm.                            #
+# Desc: An implementation of Dijkstra's algorithm. Uses a binary heap over    #
+#       the CSR link arrays, so it runs in O(E log V) time. Ties are broken   #
+#       in favour of the highest node ID, as the original list scan did.      #
+#       The egress port of every node is recorded as it is reached: it is     #
+#       the port of the link itself for neighbors of the source, otherwise    #
+#       it is inherited from the (already final) previous node.               #
 # Args: numNodes {int} - the number of the nodes in the network.              #
 # Retn: {list: int} - list of last-hop node (to reach each node in network).  #
 #                     List is of node ID numbers or -1 for nodes that cannot  #
 #                     be reached from the source.                             #
+#       {list: int} - list of forwarding ports (to reach each node) or -1.    #
 ###############################################################################
 def Dijkstra(numNodes):
-	global sourceVertex, adjMatrix
+	global sourceVertex, linkStart, linkDst, linkPort, linkCost, useLinkCost
+	start, dsts, ports, costs = linkStart, linkDst, linkPort, linkCost
 	dist = [sys.maxsize]*numNodes		# Initialize distance list.
 	prev = [-1]*numNodes				# Initialize previous node list.
+	egress = [-1]*numNodes				# Initialize forwarding port list.
+	done = [False]*numNodes				# Nodes whose distance is final.
 	dist[sourceVertex] = 0				# Set distance to source = 0.
-	queue = []							
-	u=0
-	while u < numNodes:					# Insert every node into queue.
-		queue.append(u)
-		u+=1
-	
+	queue = [(0, -sourceVertex)]		# Heap of (dist, -ID) pairs.
+
 	while len(queue) > 0:				# Repeat until the queue is empty:
-		minDist=sys.maxsize				
-		minNode=-1
-		# Find node with min dist.
-		for node in queue:
-			if dist[node] <= minDist:
-				minNode = node
-				minDist = dist[node]
-		u = minNode						# u is node with min dist in queue.
-		queue.pop(queue.index(u))		# Remove u from the queue.
+		minDist, u = heappop(queue)		# u is node with min dist in queue.
+		u = -u
+		if done[u]:						# Skip stale heap entries.
+			continue
+		done[u] = True
 		# Update prev and dist for all nodes reachable by u.
-		for i, val in enumerate(adjMatrix[u]):
-			if val != 0 and dist[u]+1 < dist[i]:
-				dist[i] = dist[u]+1
-				prev[i] = u
-	return prev
+		for link in range(start[u], start[u + 1]):
+			v = dsts[link]
+			alt = minDist + (costs[link] if useLinkCost else 1)
+			if alt < dist[v]:
+				dist[v] = alt
+				prev[v] = u
+				egress[v] = ports[link] if u == sourceVertex else egress[u]
+				heappush(queue, (alt, -v))
+	return prev, egress, dist
+
+###############################################################################
+# Func: EqualCostDijkstra                                                     #
+# Desc: Dijkstra's algorithm keeping every equal-cost first hop (ECMP). A     #
+#       node reached over several shortest paths gets the union of the        #
+#       egress ports of its equal-cost previous nodes. A node with one such   #
+#       previous node shares that node's set instead of copying it, so the    #
+#       sets only cost memory where paths actually split.                     #
+# Args: numNodes {int} - the number of the nodes in the network.              #
+# Retn: {list: int} - list of last-hop node, as from Dijkstra.                #
+#       {list: frozenset} - set of forwarding ports (to reach each node) or   #
+#                           None.                                             #
+#       {list: int} - distance to each node.                                  #
+###############################################################################
+def EqualCostDijkstra(numNodes):
+	global sourceVertex, linkStart, linkDst, linkPort, linkCost, useLinkCost
+	start, dsts, costs = linkStart, linkDst, linkCost
+	dist = [sys.maxsize]*numNodes
+	prev = [-1]*numNodes
+	egress = [None]*numNodes
+	done = [False]*numNodes
+	dist[sourceVertex] = 0
+	queue = [(0, -sourceVertex)]
+
+	while len(queue) > 0:
+		minDist, u = heappop(queue)
+		u = -u
+		if done[u]:
+			continue
+		done[u] = True
+		for link in range(start[u], start[u + 1]):
+			v = dsts[link]
+			alt = minDist + (costs[link] if useLinkCost else 1)
+			ports = (frozenset((linkPort[link],)) if u == sourceVertex
+				else egress[u])
+			if alt < dist[v]:
+				dist[v] = alt
+				prev[v] = u
+				egress[v] = ports
+				heappush(queue, (alt, -v))
+			elif alt == dist[v] and not done[v] and egress[v] is not ports:
+				egress[v] = egress[v] | ports	# Another equal-cost path.
+	return prev, egress, dist
+
+###############################################################################
+# Func: AdjacencyRows                                                         #
+# Desc: Expands the CSR link arrays into a list of (dst, port, cost) rows per #
+#       node, the form the incremental mode diffs a reloaded topology on.     #
+#       Only --incremental without Topology Sync pays for the rows.           #
+# Args: N/A                                                                   #
+# Retn: {list: list} - the links out of every node.                           #
+###############################################################################
+def AdjacencyRows():
+	global linkStart, linkDst, linkPort, linkCost
+	links = list(zip(linkDst, linkPort, linkCost))
+	return [links[a:b] for a, b in zip(linkStart, linkStart[1:])]
+
+###############################################################################
+# Func: OutLinks                                                              #
+# Desc: The links out of one node, read from the CSR link arrays.             #
+# Args: u {int} - ID of the node.                                             #
+# Retn: {iterator: tuple} - (dst, port, cost) of every link.                  #
+###############################################################################
+def OutLinks(u):
+	global linkStart, linkDst, linkPort, linkCost
+	a, b = linkStart[u], linkStart[u + 1]
+	return zip(linkDst[a:b], linkPort[a:b], linkCost[a:b])
+
+###############################################################################
+# Func: LogLinkChanges                                                        #
+# Desc: Appends the links a Topology Delta Packet changed to linkLog, so the  #
+#       trees kept by --incremental can be repaired for them without diffing  #
+#       the whole topology. The oldest entries are dropped once the log is    #
+#       longer than the topology has links (a tree that far behind is         #
+#       rebuilt, which is no slower than replaying them).                     #
+# Args: changes {list: tuple} - (u, v, old (port, cost) or None, new (port,   #
+#                               cost) or None) of every changed link u->v.    #
+# Retn: N/A                                                                   #
+###############################################################################
+def LogLinkChanges(changes):
+	global linkLog, linkLogStart, linkDst
+	linkLog.extend(changes)
+	excess = len(linkLog) - max(len(linkDst), 1024)
+	if excess > 0:
+		del linkLog[:excess]
+		linkLogStart += excess
+
+###############################################################################
+# Func: LoggedChanges                                                         #
+# Desc: Sums up the links changed since a position in linkLog: a link         #
+#       changed several times is listed once, from its first old state to     #
+#       its last new one, and left out if that is no change at all.           #
+# Args: logged {int} - the position (linkLogStart or later).                  #
+# Retn: {list: tuple} - changes in the form LogLinkChanges takes.             #
+###############################################################################
+def LoggedChanges(logged):
+	global linkLog, linkLogStart
+	net = {}							# (u, v) -> [first old, last new].
+	for u, v, old, new in linkLog[logged - linkLogStart:]:
+		if (u, v) in net:
+			net[(u, v)][1] = new
+		else:
+			net[(u, v)] = [old, new]
+	return [(u, v, old, new) for (u, v), (old, new) in net.items()
+		if old != new]
+
+###############################################################################
+# Func: IncrementalDijkstra                                                   #
+# Desc: Dynamic version of Dijkstra. Keeps the shortest-path tree of every    #
+#       source and, when the same source asks again, repairs the tree for     #
+#       the links that changed since: taken from linkLog if the topology      #
+#       came in Topology Delta Packets, else by diffing the adjacency list    #
+#       of a reloaded topology against the tree's. Falls back to a full run   #
+#       for a new source, if nodes were removed, or if the changes are no     #
+#       longer known.                                                         #
+# Args: numNodes {int} - the number of the nodes in the network.              #
+# Retn: {list: int} - prev list (same as Dijkstra).                           #
+#       {list: int} - port list (same as Dijkstra).                           #
+###############################################################################
+def IncrementalDijkstra(numNodes):
+	global sourceVertex, spfTrees, cacheSize, adjList, syncEpoch
+	global linkLog, linkLogStart
+	logged = linkLogStart + len(linkLog)
+	if syncEpoch == 0 and adjList is None:	# Reloaded: diff on the rows.
+		adjList = AdjacencyRows()
+	tree = spfTrees.get(sourceVertex)
+	if tree is None or numNodes < len(tree.dist):
+		tree = BuildSPFTree(numNodes)
+	elif tree.logged >= linkLogStart:
+		RepairSPFTree(tree, numNodes, LoggedChanges(tree.logged))
+	elif tree.adjList is not None and adjList is not None:
+		RepairSPFTree(tree, numNodes, DiffAdjLists(tree.adjList, adjList))
+	else:
+		tree = BuildSPFTree(numNodes)
+	tree.logged = logged
+	tree.adjList = adjList if syncEpoch == 0 else None
+	spfTrees[sourceVertex] = tree
+	spfTrees.move_to_end(sourceVertex)
+	while len(spfTrees) > max(cacheSize, 1):
+		spfTrees.popitem(last=False)
+	return tree.prev, tree.egress
+
+###############################################################################
+# Func: BuildSPFTree                                                          #
+# Desc: Runs Dijkstra's algorithm and keeps everything needed to repair the   #
+#       resulting tree later.                                                 #
+# Args: numNodes {int} - the number of the nodes in the network.              #
+# Retn: {SPFTree} - the shortest-path tree of sourceVertex.                   #
+###############################################################################
+def BuildSPFTree(numNodes):
+	global linkStart, linkDst, linkCost
+	prev, egress, dist = Dijkstra(numNodes)
+	children = [set() for _ in range(numNodes)]
+	inAdj = [{} for _ in range(numNodes)]
+	srcs = chain.from_iterable(map(repeat, range(numNodes),
+		map(sub, linkStart[1:], linkStart)))
+	for u, v, cost in zip(srcs, linkDst, linkCost):
+		inAdj[v][u] = cost
+	for v, u in enumerate(prev):
+		if u != -1:
+			children[u].add(v)
+	return SPFTree(dist, prev, egress, children, inAdj, 0, None)
+
+###############################################################################
+# Func: DiffAdjLists                                                          #
+# Desc: Finds the links that differ between two adjacency lists. Changed      #
+#       rows are found with a single C-level pass (map/compress), and only    #
+#       those rows are compared link by link.                                 #
+# Args: oldAdj {list: list} - adjacency list the tree was built from.         #
+#       newAdj {list: list} - the current adjacency list.                     #
+# Retn: {list: tuple} - (u, v, old (port, cost) or None, new (port, cost)     #
+#                       or None) for every changed link u->v.                 #
+###############################################################################
+def DiffAdjLists(oldAdj, newAdj):
+	changes = []
+	rows = list(compress(range(len(oldAdj)), map(ne, oldAdj, newAdj)))
+	rows.extend(range(len(oldAdj), len(newAdj)))	# Rows of new hosts.
+	for u in rows:
+		oldLinks = oldAdj[u] if u < len(oldAdj) else []
+		old = {v: (port, cost) for v, port, cost in oldLinks}
+		new = {v: (port, cost) for v, port, cost in newAdj[u]}
+		for v in old.keys() | new.keys():
+			if old.get(v) != new.get(v):
+				changes.append((u, v, old.get(v), new.get(v)))
+	return changes
+
+###############################################################################
+# Func: RepairSPFTree                                                         #
+# Desc: Brings a shortest-path tree up to date with the current topology,     #
+#       touching only the part of the tree affected by the change:            #
+#       1. Subtrees hanging off removed or costlier tree links are cut off    #
+#          and reattached by a Dijkstra run restricted to them.               #
+#       2. Added or cheaper links are relaxed from their heads outward,       #
+#          along with the nodes from step 1.                                  #
+#       3. The prev of every node near a change is reselected with the        #
+#          same tie rule Dijkstra uses (the tight neighbor with the lowest    #
+#          (dist, -ID)), so the result matches a full run exactly.            #
+#       4. Ports are pushed down the subtrees of every node that moved.       #
+# Args: tree {SPFTree} - tree of sourceVertex, updated in place.              #
+#       numNodes {int} - the number of the nodes in the network.              #
+#       changes {list: tuple} - (u, v, old (port, cost) or None, new (port,   #
+#                               cost) or None) of every link u->v changed     #
+#                               since the tree was up to date.                #
+# Retn: N/A                                                                   #
+###############################################################################
+def RepairSPFTree(tree, numNodes, changes):
+	global sourceVertex, useLinkCost
+	INF = sys.maxsize
+	dist, prev, egress = tree.dist, tree.prev, tree.egress
+	children, inAdj = tree.children, tree.inAdj
+	for _ in range(len(dist), numNodes):		# Hosts new to the network.
+		dist.append(INF)
+		prev.append(-1)
+		egress.append(-1)
+		children.append(set())
+		inAdj.append({})
+
+	if len(changes) == 0:
+		return
+	Cost = (lambda cost: cost) if useLinkCost else (lambda cost: 1)
+	cut = []							# Heads of removed/costlier tree links.
+	relax = []							# Added/cheaper links.
+	heads = set()						# Heads of every changed link.
+	moved = set()						# Nodes whose port may have changed.
+	for u, v, old, new in changes:
+		if new is None:
+			del inAdj[v][u]
+		else:
+			inAdj[v][u] = new[1]
+		if old is not None and (new is None or Cost(new[1]) > Cost(old[1])):
+			if prev[v] == u:
+				cut.append(v)
+		elif new is not None and (old is None or Cost(new[1]) < Cost(old[1])):
+			relax.append((u, v, Cost(new[1])))
+		heads.add(v)
+		if u == sourceVertex and prev[v] == u:	# First hop port changed.
+			moved.add(v)
+
+	# 1. Cut off the affected subtrees and reattach them.
+	affected = set()
+	stack = cut
+	while len(stack) > 0:
+		x = stack.pop()
+		if x not in affected:
+			affected.add(x)
+			stack.extend(children[x])
+	for x in affected:
+		dist[x] = INF
+	queue = []
+	for x in affected:
+		for y, cost in inAdj[x].items():
+			if y not in affected and dist[y] != INF \
+					and dist[y] + Cost(cost) < dist[x]:
+				dist[x] = dist[y] + Cost(cost)
+		if dist[x] != INF:
+			queue.append((dist[x], x))
+	heapify(queue)
+	while len(queue) > 0:
+		d, x = heappop(queue)
+		if d != dist[x]:
+			continue
+		for y, port, cost in OutLinks(x):
+			if y in affected and d + Cost(cost) < dist[y]:
+				dist[y] = d + Cost(cost)
+				heappush(queue, (dist[y], y))
+
+	# 2. Relax the new links, and the links out of the reattached nodes.
+	queue = [(dist[x], x) for x in affected if dist[x] != INF]
+	for u, v, cost in relax:
+		if dist[u] != INF and dist[u] + cost < dist[v]:
+			dist[v] = dist[u] + cost
+			queue.append((dist[v], v))
+	heapify(queue)
+	while len(queue) > 0:
+		d, x = heappop(queue)
+		if d != dist[x]:
+			continue
+		affected.add(x)
+		for y, port, cost in OutLinks(x):
+			if d + Cost(cost) < dist[y]:
+				dist[y] = d + Cost(cost)
+				heappush(queue, (dist[y], y))
+
+	# 3. Reselect prev around every node whose distance changed.
+	candidates = affected | heads
+	for x in affected:
+		candidates.update(y for y, port, cost in OutLinks(x))
+	candidates.discard(sourceVertex)
+	for v in candidates:
+		best = -1
+		if dist[v] != INF:
+			for y, cost in inAdj[v].items():
+				if dist[y] != INF and dist[y] + Cost(cost) == dist[v] and (best \
+						== -1 or (dist[y], -y) < (dist[best], -best)):
+					best = y
+		if best != prev[v]:
+			if prev[v] != -1:
+				children[prev[v]].discard(v)
+			if best != -1:
+				children[best].add(v)
+			prev[v] = best
+			moved.add(v)
+
+	# 4. Push the ports down from every node that moved, parents first.
+	sourcePorts = {v: port for v, port, cost in OutLinks(sourceVertex)}
+	done = set()
+	for root in sorted(moved, key=lambda x: dist[x]):
+		if root in done:
+			continue
+		stack = [root]
+		while len(stack) > 0:
+			x = stack.pop()
+			done.add(x)
+			if prev[x] == -1:
+				egress[x] = -1
+			elif prev[x] == sourceVertex:
+				egress[x] = sourcePorts[x]
+			else:
+				egress[x] = egress[prev[x]]
+			stack.extend(children[x])
+
+###############################################################################
+# Func: Distances                                                             #
+# Desc: Finds the distance from each of some nodes to every node: in hop      #
+#       count mode (with NumPy) by BFSLevels, 64 nodes a pass, otherwise by   #
+#       Dijkstra's algorithm from each. sourceVertex is left as it was.       #
+# Args: roots {list: int} - IDs of the nodes.                                 #
+#       numNodes {int} - the number of the nodes in the network.              #
+# Retn: {dict} - node ID -> distance list (sys.maxsize where unreachable).    #
+###############################################################################
+def Distances(roots, numNodes):
+	global sourceVertex, useLinkCost
+	dists = {}
+	if numpy is not None and not useLinkCost:
+		edges = EdgeArrays()
+		for start in range(0, len(roots), 64):
+			dist = BFSLevels(roots[start:start + 64], numNodes, edges)[0]
+			dist = numpy.where(dist < 0, sys.maxsize, dist.astype(numpy.int64))
+			dists.update(zip(roots[start:start + 64], dist.tolist()))
+		return dists
+	source = sourceVertex
+	for sourceVertex in roots:
+		dists[sourceVertex] = Dijkstra(numNodes)[2]
+	sourceVertex = source
+	return dists
+
+###############################################################################
+# Func: BackupPorts                                                           #
+# Desc: Finds the loop-free alternates of sourceVertex (RFC 5286): the port   #
+#       to a neighbor N is a backup for destination D if N's own shortest     #
+#       path to D does not lead back through the source, i.e.                 #
+#       dist(N, D) < dist(N, S) + dist(S, D), and it is not a primary port    #
+#       of D. A switch can fail over to one as soon as its primary ports go   #
+#       down. The maxBackups alternates with the shortest paths to D are      #
+#       kept. It costs the distances from every neighbor of the source.       #
+# Args: numNodes {int} - the number of the nodes in the network.              #
+# Retn: {list: tuple} - the backup ports of every node (empty if none).       #
+###############################################################################
+def BackupPorts(numNodes):
+	global sourceVertex, linkStart, linkDst, linkPort, linkCost, portList
+	global useLinkCost, maxBackups
+	source = sourceVertex
+	first, last = linkStart[source], linkStart[source + 1]
+	dists = Distances(list(dict.fromkeys(chain([source],
+		linkDst[first:last]))), numNodes)
+	distSource = dists[source]
+	backups = [()]*numNodes
+	for link in range(first, last):
+		neighbor, port = linkDst[link], linkPort[link]
+		if neighbor == source:
+			continue
+		cost = linkCost[link] if useLinkCost else 1
+		distNeighbor = dists[neighbor]
+		loopFree = map(lt, distNeighbor,
+			map(distNeighbor[source].__add__, distSource))
+		for dest in compress(range(numNodes), loopFree):
+			primary = portList[dest]
+			# Unreachable destinations pass the test (maxsize on both sides).
+			if (dest == source or distSource[dest] == sys.maxsize
+					or primary is None or primary == -1):
+				continue
+			if port != primary and (type(primary) is int
+					or port not in primary):
+				backups[dest] += ((cost + distNeighbor[dest], port),)
+	return [backup if len(backup) == 0 else tuple([port for _, port
+		in sorted(backup)[:maxBackups]]) for backup in backups]
 
 ###############################################################################
 # Func: BuildTable                                                            #
-# Desc: Creates the flow table based on the prev list returned by Dijkstra's  #
-#       algorithm.                                                            #
+# Desc: Creates the flow table based on the prev and port lists returned by   #
+#       Dijkstra's algorithm (or the port sets from EqualCostDijkstra). The   #
+#       table is two parallel columns holding the reachable hosts, picked     #
+#       out of the address and port lists with compress. With --backups the   #
+#       backup ports of a destination follow its primary ones in its tuple,   #
+#       flagged with BACKUP_PORT.                                             #
 # Args: numNodes {int} - the number of the nodes in the network.              #
-# Retn: {list: Flow} - flow table.                                            #
+# Retn: {array: I|list: string} - address of every destination (packed, or    #
+#                                 dotted after a text packet).                #
+#       {array: H|list} - its port (a tuple of ports with ECMP or backups).   #
 ###############################################################################
 def BuildTable(numNodes):
-	global prevList, addressMapList
-	table = []
+	global prevList, portList, addressList, useEcmp, maxBackups
+	reachable = list(map((-1).__ne__, prevList))
+	if type(addressList) is array:
+		addresses = array("I", compress(addressList, reachable))
+	else:
+		addresses = list(compress(addressList, reachable))
+	if not useEcmp:
+		ports = array("H", compress(portList, reachable))
+	else:
+		ports = [min(port) if len(port) == 1 else tuple(sorted(port))
+			for port in compress(portList, reachable)]
+	if maxBackups <= 0:
+		return addresses, ports
+	backups = compress(BackupPorts(numNodes), reachable)
+	return addresses, [port if len(backup) == 0 else
+		(port if type(port) is tuple else (port,))
+		+ tuple(sorted([alternate | BACKUP_PORT for alternate in backup]))
+		for port, backup in zip(ports, backups)]
 
-	for host, prevNode in enumerate(prevList):
-		if prevNode != -1:							# If host is reachable:
-			port = GetPort(host)					# Get the forwarding port.
-			address = addressMapList[host].address	# Get the address of host.
-			table.append(Flow(address, port))		# Add flow to flow table.
-	return table
+###############################################################################
+# Func: AllSourcesSPF                                                         #
+# Desc: Runs the shortest-path computation for many sources over the parsed   #
+#       topology. In hop count mode (with NumPy) the sources are expanded     #
+#       together by MultiSourceBFS; otherwise Dijkstra (EqualCostDijkstra     #
+#       with --ecmp) is run per source.                                       #
+# Args: sources {list: int} - IDs of the source vertices.                     #
+#       numNodes {int} - the number of the nodes in the network.              #
+# Retn: {generator} - (source, prev list, port list) for every source.        #
+###############################################################################
+def AllSourcesSPF(sources, numNodes):
+	global sourceVertex, useLinkCost, useEcmp
+	if numpy is None or useLinkCost or useEcmp:
+		spf = EqualCostDijkstra if useEcmp else Dijkstra
+		for sourceVertex in sources:
+			prev, egress, _ = spf(numNodes)
+			yield sourceVertex, prev, egress
+		return
+	edges = EdgeArrays()
+	# Sources per pass: up to 64 (one bit each), fewer on very large graphs
+	# to bound the (sources x links) working arrays.
+	width = max(1, min(64, (1 << 22)//max(len(edges[0]), 1)))
+	for start in range(0, len(sources), width):
+		yield from MultiSourceBFS(sources[start:start + width], numNodes, edges)
+
+###############################################################################
+# Func: EdgeArrays                                                            #
+# Desc: Turns the CSR link arrays into NumPy link arrays sorted by the        #
+#       destination node, as MultiSourceBFS needs them.                       #
+# Args: N/A                                                                   #
+# Retn: {tuple} - src, dst and port of every link, the index where each       #
+#                 destination's links start, and those destinations.          #
+###############################################################################
+def EdgeArrays():
+	global linkStart, linkDst, linkPort
+	counts = numpy.diff(numpy.frombuffer(linkStart, dtype=numpy.uint32))
+	src = numpy.repeat(numpy.arange(len(counts), dtype=numpy.int32), counts)
+	dst = numpy.frombuffer(linkDst, dtype=numpy.uint32).astype(numpy.int32)
+	port = numpy.frombuffer(linkPort, dtype=numpy.uint16).astype(numpy.int32)
+	order = numpy.argsort(dst, kind="stable")
+	src, dst, port = src[order], dst[order], port[order]
+	heads = numpy.flatnonzero(numpy.diff(dst, prepend=-1))
+	return src, dst, port, heads, dst[heads]
+
+###############################################################################
+# Func: BFSLevels                                                             #
+# Desc: Vectorized breadth-first search from up to 64 sources at once. Each   #
+#       node holds a 64-bit mask of the sources that have reached it, and a   #
+#       level is expanded by OR-ing the frontier masks over all links into    #
+#       their destinations.                                                   #
+# Args: sources {list: int} - IDs of the source vertices (at most 64).        #
+#       numNodes {int} - the number of the nodes in the network.              #
+#       edges {tuple} - from EdgeArrays.                                      #
+# Retn: {ndarray: int32} - hop count from every source (row) to every node    #
+#                          (-1 where unreachable).                            #
+#       {int} - the highest hop count.                                        #
+###############################################################################
+def BFSLevels(sources, numNodes, edges):
+	src, dst, port, heads, targets = edges
+	count = len(sources)
+	rows = numpy.arange(count)
+	sources = numpy.asarray(sources, dtype=numpy.int64)
+	shifts = numpy.arange(count, dtype=numpy.uint64)
+	seen = numpy.zeros(numNodes, dtype=numpy.uint64)
+	numpy.bitwise_or.at(seen, sources, numpy.uint64(1) << shifts)
+	frontier = seen.copy()
+	dist = numpy.full((count, numNodes), -1, dtype=numpy.int32)
+	dist[rows, sources] = 0
+	level = 0
+	while len(src) > 0 and frontier.any():
+		level += 1
+		reached = numpy.zeros(numNodes, dtype=numpy.uint64)
+		reached[targets] = numpy.bitwise_or.reduceat(frontier[src], heads)
+		frontier = reached & ~seen
+		seen |= frontier
+		nodes = numpy.flatnonzero(frontier)
+		hit, col = numpy.nonzero((frontier[nodes] >> shifts[:, None])
+			& numpy.uint64(1))
+		dist[hit, nodes[col]] = level
+	return dist, level
+
+###############################################################################
+# Func: MultiSourceBFS                                                        #
+# Desc: Shortest paths from up to 64 sources at once by BFSLevels. prev is    #
+#       then the highest-ID neighbor one hop closer to the source, the same   #
+#       tie rule Dijkstra uses, and ports are inherited level by level, so    #
+#       the results match Dijkstra exactly.                                   #
+# Args: sources {list: int} - IDs of the source vertices (at most 64).        #
+#       numNodes {int} - the number of the nodes in the network.              #
+#       edges {tuple} - from EdgeArrays.                                      #
+# Retn: {generator} - (source, prev list, port list) for every source.        #
+###############################################################################
+def MultiSourceBFS(sources, numNodes, edges):
+	src, dst, port, heads, targets = edges
+	count = len(sources)
+	dist, level = BFSLevels(sources, numNodes, edges)
+	sources = numpy.asarray(sources, dtype=numpy.int64)
 
+	prev = numpy.full((count, numNodes), -1, dtype=numpy.int32)
+	egress = numpy.full((count, numNodes), -1, dtype=numpy.int32)
+	if len(src) > 0:
+		distSrc = dist[:, src]
+		distDst = dist[:, dst]
+		tight = (distDst > 0) & (distSrc == distDst - 1)
+		prev[:, targets] = numpy.maximum.reduceat(numpy.where(tight, src, -1),
+			heads, axis=1)
+		hit, link = numpy.nonzero(tight & (src == sources[:, None]))
+		egress[hit, dst[link]] = port[link]			# First hops.
+		for d in range(2, level + 1):
+			hit, node = numpy.nonzero(dist == d)
+			egress[hit, node] = egress[hit, prev[hit, node]]
+	for k in range(count):
+		yield int(sources[k]), prev[k].tolist(), egress[k].tolist()
 
 ###############################################################################
-# Func: GetPort                                                               #
-# Desc: Recursive algorithm to find the appropiate port to use to reach a     #
-#       given host. Uses the prev list created by Dijkstra's algorithm.       #
-# Args: host {int} - ID of the host to reach.                                 #
-# Retn: {int} - forwarding port number to reach host.                         #
+# Func: ShareTopology                                                         #
+# Desc: Copies the parsed topology's CSR arrays into a shared memory block    #
+#       (addrs, row offsets, then link dst, cost and port columns) for the    #
+#       worker processes. The block is reused while the topology is the       #
+#       same, and the previous one is freed when it changes (and the last     #
+#       one at exit, by UnshareTopology).                                     #
+# Args: topologyHash {bytes} - hash of the topology, from TopologyKey.        #
+# Retn: {string} - name of the shared memory block.                           #
+#       {int} - the number of links.                                          #
 ###############################################################################
-def GetPort(host):
-	global sourceVertex, adjMatrix, prevList
-	prev = prevList[host] 				# Get the ID of previous node in path.
-	if prev == sourceVertex:			# If the prev. node is the source host,
-		return adjMatrix[prev][host]	# retn port # to reach the current node.
-	else:								# Otherwise,
-		return GetPort(prev)			# recurse to the previos node.
+def ShareTopology(topologyHash):
+	global linkStart, linkDst, linkPort, linkCost, addressList, sharedTopology
+	if sharedTopology is not None and sharedTopology[0] == topologyHash:
+		return sharedTopology[1].name, sharedTopology[2]
+	data = b"".join(column.tobytes() for column in (array("I", addressList),
+		linkStart, linkDst, linkCost, linkPort))
+	block = SharedMemory(create=True, size=max(len(data), 1))
+	block.buf[:len(data)] = data
+	UnshareTopology()
+	sharedTopology = (topologyHash, block, len(linkDst))
+	return block.name, len(linkDst)
 
+###############################################################################
+# Func: UnshareTopology                                                       #
+# Desc: Frees the shared memory block of ShareTopology, if there is one.      #
+#       Shared memory outlives the process unless it is unlinked, so this is  #
+#       also run at exit.                                                     #
+# Args: N/A                                                                   #
+# Retn: N/A                                                                   #
+###############################################################################
+def UnshareTopology():
+	global sharedTopology
+	if sharedTopology is not None:
+		sharedTopology[1].close()
+		sharedTopology[1].unlink()
+		sharedTopology = None
+
+###############################################################################
+# Func: WorkerInit                                                            #
+# Desc: Sets up a worker process of the SPF pool.                             #
+# Args: linkCost {bool} - whether to route on link costs.                     #
+#       ecmp {bool} - whether to keep every equal-cost next hop.              #
+#       backups {int} - the most backup ports per destination.                #
+# Retn: N/A                                                                   #
+###############################################################################
+def WorkerInit(linkCost, ecmp, backups=0):
+	global useLinkCost, useEcmp, maxBackups
+	useLinkCost = linkCost
+	useEcmp = ecmp
+	maxBackups = backups
+
+###############################################################################
+# Func: WorkerSPF                                                             #
+# Desc: Computes flow tables in a worker process. The topology is read from   #
+#       the shared memory block the first time a worker sees it, so a job     #
+#       only carries the block's name and the sources.                        #
+# Args: blockName {string} - name of the shared memory block.                 #
+#       numNodes {int} - the number of the nodes in the network.              #
+#       numLinks {int} - the number of links.                                 #
+#       sources {list: int} - IDs of the source vertices.                     #
+# Retn: {list: tuple} - (source, binary Flow Table Packet) pairs.             #
+###############################################################################
+def WorkerSPF(blockName, numNodes, numLinks, sources):
+	global linkStart, linkDst, linkPort, linkCost, addressList
+	global workerTopology, prevList, portList, sourceVertex
+	if workerTopology != blockName:
+		block = SharedMemory(name=blockName)
+		columns = []
+		offset = 0
+		for typecode, count in (("I", numNodes), ("I", numNodes + 1),
+				("I", numLinks), ("I", numLinks), ("H", numLinks)):
+			column = array(typecode)
+			end = offset + count*column.itemsize
+			column.frombytes(block.buf[offset:end])
+			columns.append(column)
+			offset = end
+		block.close()
+		addressList, linkStart, linkDst, linkCost, linkPort = columns
+		workerTopology = blockName
+	tables = []
+	for sourceVertex, prevList, portList in AllSourcesSPF(sources, numNodes):
+		tables.append((sourceVertex,
+			CreateBinaryFlowTablePacket(BuildTable(numNodes))))
+	return tables
+
+###############################################################################
+# Func: PoolSPF                                                               #
+# Desc: Fans the flow tables of many sources out over the worker pool. The    #
+#       sources are split into jobs (64 per job for the vectorized search,    #
+#       else about four jobs per worker).                                     #
+# Args: sources {list: int} - IDs of the source vertices.                     #
+#       numNodes {int} - the number of the nodes in the network.              #
+#       topologyHash {bytes} - hash of the topology, from TopologyKey.        #
+# Retn: {generator} - (source, binary Flow Table Packet) pairs.               #
+###############################################################################
+def PoolSPF(sources, numNodes, topologyHash):
+	global workerPool, numWorkers, useLinkCost, useEcmp
+	blockName, numLinks = ShareTopology(topologyHash)
+	if numpy is not None and not useLinkCost and not useEcmp:
+		size = 64
+	else:
+		size = max(1, -(-len(sources)//(4*numWorkers)))
+	jobs = [workerPool.submit(WorkerSPF, blockName, numNodes, numLinks,
+		sources[start:start + size]) for start in range(0, len(sources), size)]
+	for job in jobs:
+		yield from job.result()
 
 ###############################################################################
 # Func: ParseAdjMatrixPacket                                                  #
-# Desc: Creates the ID->Addr map list and the Adj. matrix.                    #
+# Desc: Creates the address list and the CSR link arrays (the matrix          #
+#       itself is not kept). A matrix entry is either a port number or        #
+#       "port:cost", where cost is the link metric (defaults to 1). If line   #
+#       0 ends in ", sparse" the packet is an edge list instead, one link     #
+#       "srcID, dstID, port[:cost]" per line, and is parsed in O(links).      #
 # Args: packetAdjMatix {string} - the packet.                                 #
 # Retn: N/A                                                                   #
 ###############################################################################
 def ParseAdjMatrixPacket(packetAdjMatix):
-	global adjMatrix, addressMapList, sourceVertex
-	adjMatrix = []
-	addressMapList = []
+	global addressList, sourceVertex
+	addressList = []
+	linkSrc, linkDst, linkPort, linkCost = (array("I"), array("I"),
+		array("H"), array("I"))
 	numVertex = 0
+	sparse = False
 	k = 0	# k is the index in adj matrix part of packet.
 	for line, val in enumerate(packetAdjMatix.splitlines()):
 		# Line 0.
 		if line == 0:											
-			val = val.replace(" ", "")
-			sourceVertex = int(val.split(",")[0])
-			numVertex = val.split(",")[1]
+			fields = val.replace(" ", "").split(",")
+			sourceVertex = int(fields[0])
+			numVertex = fields[1]
+			sparse = len(fields) > 2 and fields[2] == "sparse"
 		# Lines [1...numVertex]: ID->Addr map.
 		elif line <= int(numVertex):							
 			val = val.replace(" ", "")
 			ID = val.split("=")[0]
 			address = val.split("=")[1]
-			addressMapList.append(AddrMap(ID, address))
-			adjMatrix.append([])
+			addressList.append(address)
+		# Edge list: one link per line (ignore blank lines).
+		elif sparse:
+			val = val.replace(" ", "")
+			if val != "":
+				srcID, dstID, entry = val.split(",")
+				port, _, cost = entry.partition(":")
+				linkSrc.append(int(srcID))
+				linkDst.append(int(dstID))
+				linkPort.append(int(port))
+				linkCost.append(int(cost) if cost else 1)
 		# The actual adjacency matrix (ignore blank line).
 		elif val != "":										
 			val = val.replace(" ", "")
-			for entry in val.split(","):
-				adjMatrix[k].append(int(entry))
+			for i, entry in enumerate(val.split(",")):
+				port, _, cost = entry.partition(":")
+				port = int(port)
+				if port != 0:
+					linkSrc.append(k)
+					linkDst.append(i)
+					linkPort.append(port)
+					linkCost.append(int(cost) if cost else 1)
 			k += 1
+	BuildCSR(len(addressList), linkSrc, linkDst, linkPort, linkCost)
+
+###############################################################################
+# Func: ParseBinaryAdjPacket                                                  #
+# Desc: Creates the address list and the CSR link arrays from a binary Adj.   #
+#       Matrix Packet. Addresses are kept as packed integers (the decoded     #
+#       column itself).                                                       #
+# Args: packet {bytes} - the packet.                                          #
+# Retn: N/A                                                                   #
+###############################################################################
+def ParseBinaryAdjPacket(packet):
+	global addressList, sourceVertex
+	sourceVertex, addressList, linkSrc, linkDst, linkCost, linkPort = \
+		DecodeAdjacency(packet)
+	BuildCSR(len(addressList), linkSrc, linkDst, linkPort, linkCost)
+
+###############################################################################
+# Func: BuildCSR                                                              #
+# Desc: Stores the links as compressed sparse rows: linkStart[u] is where     #
+#       the links out of node u start in the linkDst, linkPort and linkCost   #
+#       columns (and linkStart[u + 1] where they end). The packets list the   #
+#       links grouped by source already, in which case the columns are kept   #
+#       as they are; otherwise they are stably sorted by source first. The    #
+#       topology held is no longer a synced version.                          #
+# Args: numNodes {int} - the number of the nodes in the network.              #
+#       src, dst {array: I} - source and destination of every link.           #
+#       port {array: H} - port of every link (on its source).                 #
+#       cost {array: I} - cost of every link.                                 #
+# Retn: N/A                                                                   #
+###############################################################################
+def BuildCSR(numNodes, src, dst, port, cost):
+	global linkStart, linkDst, linkPort, linkCost, adjList, syncEpoch
+	global linkLog, linkLogStart
+	if not all(map(le, src, src[1:])):
+		order = sorted(range(len(src)), key=src.__getitem__)
+		src, dst, port, cost = [array(column.typecode, map(column.__getitem__,
+			order)) for column in (src, dst, port, cost)]
+	counts = Counter(src)
+	linkStart = array("I", [0])
+	linkStart.extend(accumulate(map(counts.__getitem__, range(numNodes))))
+	linkDst, linkPort, linkCost = dst, port, cost
+	adjList = None
+	syncEpoch = 0						# No longer a version the controller sent.
+	linkLogStart += len(linkLog) + 1	# Changes since no tree are logged.
+	linkLog = []
+
+###############################################################################
+# Func: TopologyDigest                                                        #
+# Desc: Hashes the topology held, as the sum of a hash of every host (ID,     #
+#       address) and link (src, port, dst, cost), so that a delta can update  #
+#       it in O(change) and a topology that returns to an earlier state (a    #
+#       link flap) gets its earlier digest, and flow tables, back.            #
+# Args: N/A                                                                   #
+# Retn: {int} - the 64-bit digest.                                            #
+###############################################################################
+def TopologyDigest():
+	global addressList, linkStart, linkDst, linkPort, linkCost
+	srcs = chain.from_iterable(map(repeat, range(len(addressList)),
+		map(sub, linkStart[1:], linkStart)))
+	digest = sum(map(hash, zip(srcs, linkPort, linkDst, linkCost)))
+	return (digest + sum(map(hash, enumerate(addressList)))) & digestMask
+
+###############################################################################
+# Func: ShiftOffsets                                                          #
+# Desc: Adds the same amount to a run of CSR offsets (with NumPy if it is     #
+#       installed).                                                           #
+# Args: offsets {array: I} - the offsets.                                     #
+#       shift {int} - the amount (may be negative).                           #
+# Retn: {array: I} - the shifted offsets.                                     #
+###############################################################################
+def ShiftOffsets(offsets, shift):
+	if shift == 0 or len(offsets) == 0:
+		return offsets
+	if numpy is None:
+		return array("I", [offset + shift for offset in offsets])
+	shifted = numpy.frombuffer(offsets, dtype=numpy.uint32).astype(
+		numpy.int64) + shift
+	return array("I", shifted.astype(numpy.uint32).tobytes())
+
+###############################################################################
+# Func: ApplyTopologyDelta                                                    #
+# Desc: Applies a Topology Delta Packet to the topology held. New hosts are   #
+#       appended, and the CSR columns are rebuilt with one slice copy per run #
+#       of unchanged rows, so only the rows of changed links are touched in   #
+#       Python. A removed link that is not held is ignored. syncDigest is     #
+#       updated for the hosts and links that changed, and with --incremental  #
+#       the links that changed are logged for the trees.                      #
+# Args: delta {bytes} - the packet.                                           #
+# Retn: N/A                                                                   #
+###############################################################################
+def ApplyTopologyDelta(delta):
+	global addressList, linkStart, linkDst, linkPort, linkCost, adjList
+	global syncDigest, useIncremental
+	addrs, upSrc, upDst, upCost, upPort, rmSrc, rmPort = \
+		DecodeTopologyDelta(delta)
+	numNodes = len(addressList) + len(addrs)
+	if max(upSrc + upDst + rmSrc, default=0) >= numNodes:
+		raise ProtocolError("topology delta link to an unknown host")
+	rows = {}							# srcID -> {port: (dstID, cost)|None}.
+	for u, port in zip(rmSrc, rmPort):
+		rows.setdefault(u, {})[port] = None
+	for u, v, cost, port in zip(upSrc, upDst, upCost, upPort):
+		rows.setdefault(u, {})[port] = (v, cost)
+	digest = syncDigest + sum(map(hash, enumerate(addrs, len(addressList))))
+	addressList.extend(addrs)
+	linkStart.extend([linkStart[-1]]*len(addrs))	# New hosts have no links.
+	start, dsts, ports, costs = array("I", [0]), array("I"), array("H"), \
+		array("I")
+	done = 0							# Rows before done are copied.
+	changes = []
+	for u in sorted(rows) + [numNodes]:
+		a, b = linkStart[done], linkStart[u]
+		start.extend(ShiftOffsets(linkStart[done + 1:u + 1], len(dsts) - a))
+		dsts.extend(linkDst[a:b])
+		ports.extend(linkPort[a:b])
+		costs.extend(linkCost[a:b])
+		if u == numNodes:
+			break
+		a, b = linkStart[u], linkStart[u + 1]
+		row = dict(zip(linkPort[a:b], zip(linkDst[a:b], linkCost[a:b])))
+		before, after = {}, {}			# dstID -> (port, cost) of the links.
+		for port, link in rows[u].items():
+			old = row.pop(port, None)
+			if old is not None:
+				digest -= hash((u, port) + old)
+				before[old[0]] = (port, old[1])
+			if link is not None:
+				row[port] = link
+				digest += hash((u, port) + link)
+				after[link[0]] = (port, link[1])
+		changes.extend((u, v, before.get(v), after.get(v))
+			for v in before.keys() | after.keys()
+			if before.get(v) != after.get(v))
+		ports.extend(row.keys())
+		dsts.extend(link[0] for link in row.values())
+		costs.extend(link[1] for link in row.values())
+		start.append(len(dsts))
+		done = u + 1
+	linkStart, linkDst, linkPort, linkCost = start, dsts, ports, costs
+	adjList = None
+	syncDigest = digest & digestMask
+	if useIncremental:
+		LogLinkChanges(changes)
+
+###############################################################################
+# Func: CreateFlowTablePacket                                                 #
+# Desc: Creates the Flow Table Packet to send to the controller. A            #
+#       destination with several equal-cost ports gets one row per port.      #
+# Args: flowTable {tuple} - the address and port columns from BuildTable.     #
+# Retn: {string} - the packet.                                                #
+###############################################################################
+def CreateFlowTablePacket(flowTable):
+	addresses, ports = flowTable
+	if type(addresses) is array:		# Packed by a binary packet.
+		addresses = map(IntToAddr, addresses)
+	packet = []
+	for address, port in zip(addresses, ports):
+		if type(port) is tuple:
+			for port in port:
+				packet.append(str(address)+", " +str(port)+"\n")
+		else:
+			packet.append(str(address)+", " +str(port)+"\n")
+	if len(packet) == 0: # Must send something or controller will deadlock.
+		packet.append("EMPTY")
+	return "".join(packet)
+
+###############################################################################
+# Func: CreateBinaryFlowTablePacket                                           #
+# Desc: Creates the binary Flow Table Packet to send to the controller.       #
+#       Port sets are sent as consecutive rows, as in the text packet.        #
+# Args: flowTable {tuple} - the address (packed) and port columns from        #
+#                           BuildTable.                                       #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def CreateBinaryFlowTablePacket(flowTable):
+	addresses, ports = flowTable
+	if type(ports) is array:
+		return EncodeFlowTable(addresses, ports)
+	addrs = array("I")
+	column = array("H")
+	for address, port in zip(addresses, ports):
+		if type(port) is tuple:
+			addrs.extend([address]*len(port))
+			column.extend(port)
+		else:
+			addrs.append(address)
+			column.append(port)
+	return EncodeFlowTable(addrs, column)
 
 ###############################################################################
-addressMapList = []
-adjMatrix = []
+# Func: TopologyKey                                                           #
+# Desc: Creates the flow table cache key for an Adj. Matrix Packet. The key   #
+#       is a hash of everything but the source vertex (the ID->Addr map and   #
+#       matrix) paired with the source vertex, so an unchanged topology       #
+#       gives the same key without parsing the matrix.                        #
+# Args: msgType {int} - MSG_ADJ_MATRIX (or None).                             #
+#       packet {bytes} - the packet.                                          #
+# Retn: {tuple} - (packet type, topology hash, source vertex ID).             #
+###############################################################################
+def TopologyKey(msgType, packet):
+	header, _, body = packet.partition(b"\n")
+	source = int(header.replace(b" ", b"").split(b",")[0])
+	return (msgType, hashlib.sha1(body).digest(), source)
+
+###############################################################################
+# Func: CacheLookup                                                           #
+# Desc: Looks up a flow table packet in the LRU cache and counts the hit or   #
+#       miss. A hit is moved to the most recently used end.                   #
+# Args: key {tuple} - key from TopologyKey.                                   #
+# Retn: {string|bytes} - the cached packet or None.                           #
+###############################################################################
+def CacheLookup(key):
+	global flowTableCache, cacheHits, cacheMisses
+	packet = flowTableCache.get(key)
+	if packet is None:
+		cacheMisses += 1
+	else:
+		cacheHits += 1
+		flowTableCache.move_to_end(key)
+	return packet
+
+###############################################################################
+# Func: CacheStore                                                            #
+# Desc: Adds a flow table packet to the LRU cache, evicting the least         #
+#       recently used entries once the cache is over cacheSize.               #
+# Args: key {tuple} - key from TopologyKey.                                   #
+#       packet {string|bytes} - the flow table packet.                        #
+# Retn: N/A                                                                   #
+###############################################################################
+def CacheStore(key, packet):
+	global flowTableCache, cacheSize
+	if cacheSize <= 0:				# Caching disabled.
+		return
+	flowTableCache[key] = packet
+	flowTableCache.move_to_end(key)
+	while len(flowTableCache) > cacheSize:
+		flowTableCache.popitem(last=False)
+
+###############################################################################
+# Func: SourceSPF                                                             #
+# Desc: Runs the shortest-path computation for sourceVertex the way the       #
+#       router was launched: EqualCostDijkstra (--ecmp), IncrementalDijkstra  #
+#       (--incremental) or Dijkstra.                                          #
+# Args: numNodes {int} - the number of the nodes in the network.              #
+# Retn: {list: int} - prev list.                                              #
+#       {list} - port list (port sets with --ecmp).                           #
+###############################################################################
+def SourceSPF(numNodes):
+	global useEcmp, useIncremental
+	if useEcmp:
+		Log(LOG_VERBOSE, "├─»Running Dijkstra's algorithm (ECMP).")
+		return EqualCostDijkstra(numNodes)[:2]
+	if useIncremental:
+		Log(LOG_VERBOSE, "├─»Repairing shortest-path tree.")
+		return IncrementalDijkstra(numNodes)
+	Log(LOG_VERBOSE, "├─»Running Dijkstra's algorithm.")
+	return Dijkstra(numNodes)[:2]
+
+###############################################################################
+# Func: ComputeFlowTable                                                      #
+# Desc: Answers one text Adj. Matrix Packet with a text Flow Table Packet,     #
+#       from the cache if the topology is unchanged. The time of each stage   #
+#       (parse, spf, build, serialize) is recorded. Binary tables are only    #
+#       sent for Topology Sync Packets (ComputeTopologySync).                 #
+# Args: msgType {int} - MSG_ADJ_MATRIX (or None).                             #
+#       packetAdjMatix {bytes} - the packet.                                  #
+# Retn: {int} - type of the reply (MSG_FLOW_TABLE).                           #
+#       {string} - the Flow Table Packet.                                     #
+###############################################################################
+def ComputeFlowTable(msgType, packetAdjMatix):
+	global prevList, portList
+	key = TopologyKey(msgType, packetAdjMatix)
+	packetFlowTbl = CacheLookup(key)
+	if packetFlowTbl is None:
+		lap = perf_counter()
+		ParseAdjMatrixPacket(packetAdjMatix.decode())
+		lap = Lap("parse", lap)
+		prevList, portList = SourceSPF(len(addressList))
+		lap = Lap("spf", lap)
+		Log(LOG_VERBOSE, "├─»Constructing flow table.")
+		flowTable = BuildTable(len(addressList))
+		lap = Lap("build", lap)
+		Log(LOG_VERBOSE, "├─»Creating Flow Table Packet.")
+		packetFlowTbl = CreateFlowTablePacket(flowTable)
+		Lap("serialize", lap)
+		CacheStore(key, packetFlowTbl)
+	else:
+		Log(LOG_VERBOSE, "├─»Topology unchanged, using cached flow table.")
+	Log(LOG_VERBOSE, "├─»Cache hits: ", cacheHits, ", misses: ", cacheMisses,
+		".")
+	return MSG_FLOW_TABLE, packetFlowTbl
+
+###############################################################################
+# Func: ComputeTables                                                         #
+# Desc: Gets the binary flow table of every source, from the cache or by      #
+#       computing the missing ones: on the worker pool (--workers), by        #
+#       SourceSPF for a single source, or else in one AllSourcesSPF run.      #
+# Args: sources {list: int} - IDs of the source vertices.                     #
+#       numNodes {int} - the number of the nodes in the network.              #
+#       packetType {int} - MSG_* type the topology came in (for the keys).    #
+#       topologyHash - identifies the topology (for the keys).                #
+#       Load {function} - loads the topology if a table must be computed      #
+#                         (None if it is loaded already).                     #
+# Retn: {dict} - source -> binary Flow Table Packet.                          #
+###############################################################################
+def ComputeTables(sources, numNodes, packetType, topologyHash, Load=None):
+	global prevList, portList, sourceVertex
+	tables = {}
+	for source in sources:
+		tables[source] = CacheLookup((packetType, topologyHash, source))
+	missing = [source for source in dict.fromkeys(sources)
+		if tables[source] is None]
+	lap = perf_counter()
+	if len(missing) > 0 and Load is not None:
+		Load()
+		lap = Lap("parse", lap)
+	if len(missing) > 1 and workerPool is not None:
+		Log(LOG_VERBOSE, "├─»Computing ", len(missing), " flow table(s) on ",
+			numWorkers, " workers.")
+		for source, table in PoolSPF(missing, numNodes, topologyHash):
+			tables[source] = table
+			CacheStore((packetType, topologyHash, source), table)
+		Lap("batch_tables", lap)
+	elif len(missing) == 1:
+		sourceVertex = missing[0]
+		prevList, portList = SourceSPF(numNodes)
+		tables[sourceVertex] = CreateBinaryFlowTablePacket(BuildTable(numNodes))
+		CacheStore((packetType, topologyHash, sourceVertex),
+			tables[sourceVertex])
+		Lap("batch_tables", lap)
+	elif len(missing) > 0:
+		Log(LOG_VERBOSE, "├─»Computing ", len(missing), " flow table(s).")
+		for sourceVertex, prevList, portList in AllSourcesSPF(missing,
+				numNodes):
+			tables[sourceVertex] = CreateBinaryFlowTablePacket(
+				BuildTable(numNodes))
+			CacheStore((packetType, topologyHash, sourceVertex),
+				tables[sourceVertex])
+		Lap("batch_tables", lap)
+	Log(LOG_VERBOSE, "├─»", len(sources) - len(missing),
+		" flow table(s) from the cache. Cache hits: ", cacheHits,
+		", misses: ", cacheMisses, ".")
+	return tables
+
+###############################################################################
+# Func: ComputeTopologySync                                                   #
+# Desc: Answers a Topology Sync Packet. The router keeps the topology (and    #
+#       the epoch and version the controller gave it) between requests: a     #
+#       delta from the version held is applied, a whole topology replaces     #
+#       it, and a packet for a version already held (or older, having come    #
+#       in after a newer one) changes nothing. The flow tables are then       #
+#       computed at the version held, keyed in the cache by its digest. A     #
+#       delta from any other version is answered with MSG_TOPO_STALE, and     #
+#       the controller sends the whole topology instead.                      #
+# Args: packet {bytes} - the Topology Sync Packet.                            #
+# Retn: {int} - type of the reply (MSG_FLOW_BATCH or MSG_TOPO_STALE).         #
+#       {bytes} - the Batch Flow Table Packet, or the version held.           #
+###############################################################################
+def ComputeTopologySync(packet):
+	global syncEpoch, syncVersion, syncDigest, addressList
+	full, epoch, base, version, sources, body = DecodeTopologySync(packet)
+	lap = perf_counter()
+	if epoch == syncEpoch and version <= syncVersion:
+		Log(LOG_VERBOSE, "├─»Topology version ", syncVersion, " held.")
+	elif full:
+		Log(LOG_VERBOSE, "├─»Loading whole topology (version ", version, ").")
+		ParseBinaryAdjPacket(body)
+		syncEpoch, syncVersion = epoch, version
+		syncDigest = TopologyDigest()
+		Count("sync_full")
+	elif epoch == syncEpoch and base == syncVersion:
+		Log(LOG_VERBOSE, "├─»Applying topology delta (version ", base, " to ",
+			version, ").")
+		ApplyTopologyDelta(body)
+		syncVersion = version
+		Count("sync_delta")
+	else:
+		Log(LOG_VERBOSE, "├─»Topology version ", base, " not held, asking for "
+			"the whole topology.")
+		Count("sync_stale")
+		return MSG_TOPO_STALE, syncHeld.pack(syncEpoch, syncVersion)
+	Lap("sync", lap)
+	numNodes = len(addressList)
+	if any(source >= numNodes for source in sources):
+		raise ProtocolError("sync source out of range")
+	tables = ComputeTables(list(sources), numNodes, MSG_TOPO_SYNC, syncDigest)
+	return MSG_FLOW_BATCH, EncodeFlowBatch([(source, tables[source])
+		for source in sources])
+
+###############################################################################
+# Func: StatsReport                                                           #
+# Desc: Creates the answer to a STATS message: the stage latencies and the    #
+#       cache counters.                                                       #
+# Args: N/A                                                                   #
+# Retn: {dict} - the report.                                                  #
+###############################################################################
+def StatsReport():
+	global flowTableCache, cacheHits, cacheMisses
+	report = Report()
+	report["counters"].update({"cache_hits": cacheHits,
+		"cache_misses": cacheMisses, "cache_entries": len(flowTableCache)})
+	return report
+
+###############################################################################
+# Func: ControllerHandler                                                     #
+# Desc: Serves one controller connection. The connection stays open and       #
+#       every request on it is answered, tagged with its request ID, until    #
+#       the controller disconnects (legacy connections carry one request).    #
+#       Computations are serialized by routerLock since the routing state     #
+#       is global (including the topology kept between Topology Sync          #
+#       Packets). A STATS message is answered with the stage latencies. A     #
+#       request that fails is answered with MSG_ERROR and the topology held   #
+#       is dropped, as the failure may have left it half changed.             #
+# Args: controller {socket} - the connected socket.                           #
+# Retn: N/A                                                                   #
+###############################################################################
+def ControllerHandler(controller):
+	global routerLock, syncEpoch
+	Log(LOG_INFO, "Connected to controller.")
+	try:
+		while True:
+			msgType, requestID, packetAdjMatix = RecvFrame(controller)
+			if packetAdjMatix is None:
+				break
+			if msgType == MSG_STATS:
+				SendPacket(controller, MSG_STATS, EncodeReport(StatsReport()),
+					requestID)
+				continue
+			start = perf_counter()
+			with routerLock:
+				lap = Lap("lock", start)
+				try:
+					if msgType == MSG_TOPO_SYNC:
+						Log(LOG_VERBOSE, "├─»Topology Sync Packet received.")
+						replyType, packetFlowTbl = ComputeTopologySync(
+							packetAdjMatix)
+					else:
+						Log(LOG_VERBOSE, "├─»Adjacency Matrix Packet "
+							"received.")
+						replyType, packetFlowTbl = ComputeFlowTable(msgType,
+							packetAdjMatix)
+				except Exception as error:
+					Log(LOG_INFO, "├─»Error: Request failed (",
+						type(error).__name__, ": ", error, ").")
+					if protocol.legacyMode:		# No way to tell the controller.
+						break
+					syncEpoch = 0				# Resent whole on the next sync.
+					replyType = MSG_ERROR
+					packetFlowTbl = (type(error).__name__ + ": "
+						+ str(error)).encode()
+				Log(LOG_VERBOSE, "├─»Sending packet.")
+				lap = perf_counter()
+				SendPacket(controller, replyType, packetFlowTbl, requestID)
+				Record("request", Lap("send", lap) - start)
+			if protocol.legacyMode:
+				break
+	except (OSError, ProtocolError) as error:
+		Log(LOG_INFO, "Controller connection error: ", error)
+	finally:
+		controller.close()
+	Log(LOG_INFO, "└─»Disconected from controller.")
+
+###############################################################################
+addressList = []				# ID -> address (packed, or dotted from text).
+linkStart = array("I", [0])		# Links as CSR: node -> first link index,
+linkDst = array("I")			# then the link columns.
+linkPort = array("H")
+linkCost = array("I")
+adjList = None					# Links as rows (built by --incremental).
+linkLog = []					# Links changed by deltas (--incremental).
+linkLogStart = 0				# Position in the log of linkLog[0].
+syncEpoch = 0					# Epoch and version of the topology held, as
+syncVersion = 0					# the controller numbered it (0: not synced).
+syncDigest = 0					# TopologyDigest of it.
+digestMask = (1 << 64) - 1
 sourceVertex = 0
+useLinkCost = False				# Hop count is the default metric.
+useIncremental = False			# Repair trees instead of full Dijkstra.
+useEcmp = False					# Keep every equal-cost next hop.
+maxBackups = 0					# Loop-free alternate (backup) ports to add
+								# per destination.
+
+flowTableCache = OrderedDict()	# (topology hash, source) -> packet.
+spfTrees = OrderedDict()		# source -> SPFTree (incremental mode).
+cacheSize = 128
+cacheHits = 0
+cacheMisses = 0
+routerLock = threading.Lock()	# Held while computing a flow table.
+workerPool = None				# SPF worker processes (--workers).
+numWorkers = 0
+sharedTopology = None			# (topology hash, SharedMemory, numLinks).
+workerTopology = None			# Block a worker last loaded (in workers).
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="SDN routing program.")
+	parser.add_argument("-w", "--weighted", action="store_true",
+		help="route on the per-link costs instead of hop count")
+	parser.add_argument("-c", "--cache-size", type=int, default=cacheSize,
+		help="number of flow tables to cache (0 disables the cache)")
+	parser.add_argument("-i", "--incremental", action="store_true",
+		help="repair the last shortest-path tree of a switch after a change "
+			+ "instead of rerunning Dijkstra")
+	parser.add_argument("-e", "--ecmp", action="store_true",
+		help="send every equal-cost next hop of a destination (runs full "
+			+ "Dijkstra, so --incremental is ignored)")
+	parser.add_argument("-b", "--backups", type=int, default=0, metavar="N",
+		help="also send up to N loop-free alternate ports per destination, "
+			+ "which a switch fails over to when its primary ports go down")
+	parser.add_argument("-p", "--workers", type=int, default=0,
+		help="worker processes for batch requests (0 computes inline)")
+	parser.add_argument("--legacy", action="store_true",
+		help="use the old unframed protocol (messages limited to 2048 bytes)")
+	parser.add_argument("--port", type=int, default=1234,
+		help="port to listen for the controller on (0 picks a free one)")
+	parser.add_argument("-l", "--log-level", choices=metrics.logLevels,
+		default="verbose", help="how much to print (verbose prints every "
+			+ "step of every request)")
+	args = parser.parse_args()
+	protocol.legacyMode = args.legacy
+	metrics.logLevel = metrics.logLevels[args.log_level]
+	useLinkCost = args.weighted
+	useIncremental = args.incremental
+	useEcmp = args.ecmp
+	maxBackups = args.backups
+	cacheSize = args.cache_size
+	numWorkers = args.workers
+	if numWorkers > 0:
+		workerPool = ProcessPoolExecutor(numWorkers, get_context("spawn"),
+			initializer=WorkerInit, initargs=(useLinkCost, useEcmp,
+			maxBackups))
+		atexit.register(UnshareTopology)
+		# Exit normally when terminated, so the block is freed.
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-routerPort = 1234
-routerSocket = socket(AF_INET, SOCK_STREAM)
-routerSocket.bind(('', routerPort))
-routerSocket.listen(1)
-while True:											# Run forever.
-	print("Router listening on port "+ str(routerPort)+".")
-	controller, addr = routerSocket.accept() 		
-	print("Connected to controller.")
-
-	packetAdjMatix = controller.recv(2048).decode()
-	print("├─»Adjacency Matrix Packet received.")
-	ParseAdjMatrixPacket(packetAdjMatix)
-	print("├─»Running Dijkstra's algorithm.")
-	prevList = Dijkstra(len(addressMapList))
-	print("├─»Constructing flow table.")
-	flowTable = BuildTable(len(addressMapList))
-	print("├─»Creating Flow Table Packet.")
-	packetFlowTbl = []
-	for flow in flowTable:
-		packetFlowTbl.append(str(flow.address)+", " +str(flow.port)+"\n")
-	if len(packetFlowTbl) == 0: # Must send something or controller will deadlock.
-		packetFlowTbl.append("EMPTY") 
-	print("├─»Sending packet.")
-	controller.send(("".join(packetFlowTbl)).encode())
-	print("└─»Disconected from controller.")
-
-	
+	routerPort = args.port
+	routerSocket = socket(AF_INET, SOCK_STREAM)
+	routerSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+	routerSocket.bind(('', routerPort))
+	routerSocket.listen(16)
+	routerPort = routerSocket.getsockname()[1]
+	print("Router listening on port "+ str(routerPort)+".", flush=True)
+	while True:											# Run forever.
+		controller, addr = routerSocket.accept()
+		controller.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+		threading.Thread(target=ControllerHandler, args=(controller,),
+			daemon=True).start()
@@ -0,0 +1,73 @@
+###############################################################################
+# Name: stats.py                                                              #
+#                                                                             #
+# Asks the controller (or the router) for its stage latencies with a STATS    #
+# message and prints them. The controller's answer includes the router's.     #
+#   python3 stats.py                  (controller on port 2345)               #
+#   python3 stats.py --port 1234      (the router only)                       #
+#   python3 stats.py --json           (the raw answer)                        #
+###############################################################################
+
+from socket import create_connection
+import argparse
+import json
+
+from protocol import *
+
+###############################################################################
+# Func: GetStats                                                              #
+# Desc: Sends a STATS message and waits for the answer.                       #
+# Args: host {string} - host of the controller or router.                     #
+#       port {int} - its port.                                                #
+# Retn: {dict} - the answer.                                                  #
+###############################################################################
+def GetStats(host, port):
+	sock = create_connection((host, port))
+	try:
+		SendPacket(sock, MSG_STATS, b"", 1)
+		msgType, _, payload = RecvFrame(sock)
+	finally:
+		sock.close()
+	if msgType != MSG_STATS:
+		raise ProtocolError("no STATS answer")
+	return json.loads(payload)
+
+###############################################################################
+# Func: PrintReport                                                           #
+# Desc: Prints the stages and counters of one program.                        #
+# Args: name {string} - the program.                                          #
+#       report {dict} - its part of the answer.                               #
+# Retn: N/A                                                                   #
+###############################################################################
+def PrintReport(name, report):
+	print("%s (up %.0f s)" % (name, report["uptime_s"]))
+	print("  stage            count      mean (ms)  p50 (ms)   p99 (ms)   "
+		+ "max (ms)")
+	for stage, summary in sorted(report["stages"].items()):
+		if summary["count"] > 0:
+			print("  %-16s %-10d %-10.3f %-10.3f %-10.3f %.3f" % (stage,
+				summary["count"], summary["mean_ms"], summary["p50_ms"],
+				summary["p99_ms"], summary["max_ms"]))
+	for counter, value in sorted(report["counters"].items()):
+		print("  %s: %d" % (counter, value))
+
+###############################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Prints the stage latencies "
+		+ "of the controller and router.")
+	parser.add_argument("--host", default="localhost")
+	parser.add_argument("--port", type=int, default=2345,
+		help="controller port (or the router's, to ask it alone)")
+	parser.add_argument("--json", action="store_true",
+		help="print the raw answer")
+	args = parser.parse_args()
+
+	stats = GetStats(args.host, args.port)
+	if args.json:
+		print(json.dumps(stats, indent=1, sort_keys=True))
+	elif "controller" in stats:
+		PrintReport("Controller", stats["controller"])
+		if stats["router"] is not None:
+			PrintReport("Router", stats["router"])
+	else:
+		PrintReport("Router", stats)
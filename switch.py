@@ -11,46 +11,612 @@
 ###############################################################################
 
 from socket import *
+from array import array
+from bisect import bisect_right
+from collections import Counter
+import argparse
+import itertools
+import queue
 import re
+import sys
+import threading
+import time
+
+try:
+	import numpy
+except ImportError:				# Bulk lookups fall back to one at a time.
+	numpy = None
+
+from protocol import *
+import protocol
 
 ###############################################################################
 # Class: Flow                                                                 #
-# Description: Port and destination address pairs.                            #
+# Description: Port and destination address pairs (the port is a tuple for a  #
+#              set of equal-cost ports).                                      #
 ###############################################################################
 class Flow:
+	__slots__ = ("address", "port")
+
 	def __init__(self, address, port):
 		self.address = address
 		self.port = port
 
+###############################################################################
+# Class: ForwardingTable                                                      #
+# Description: The flow table, compiled for longest-prefix-match lookups on   #
+#              packed addresses. Host routes (/32) are kept in a dict and     #
+#              patched in place, as a /32 is always the longest match.        #
+#              Shorter prefixes are compiled into a sorted array of disjoint  #
+#              address intervals, each holding the port of the longest        #
+#              prefix that covers it, which is searched with bisect (at most  #
+#              32 steps). It is rebuilt only when those prefixes change.      #
+#              LookupMany resolves a whole batch of addresses at once with    #
+#              NumPy, if it is installed.                                     #
+#              A destination with several equal-cost ports holds them as a    #
+#              tuple; the compiled arrays hold it as a code (-2 - index into  #
+#              portSets) and a lookup picks one port by hashing the flow, so  #
+#              the packets of a flow always leave by the same port.           #
+#              The ports a destination was sent with (backup ports flagged    #
+#              with BACKUP_PORT) are kept if there are several, and it is     #
+#              routed on the ones that are up: its primary ports, or its      #
+#              backup ports once every primary port is down (or its primary   #
+#              ports regardless, if every port is down). Reroute applies a    #
+#              change to the set of ports that are down.                      #
+###############################################################################
+class ForwardingTable:
+	def __init__(self, down=None):
+		self.hosts = {}						# Address -> port (or tuple).
+		self.prefixes = {}					# (network, length) -> port.
+		self.intervals = (array("I", [0]), array("i", [-1]))	# Starts, ports.
+		self.dirty = False
+		self.hostArrays = None				# Sorted hosts, for LookupMany.
+		self.portSets = []					# Port tuples, by code.
+		self.setCodes = {}					# Port tuple -> code.
+		self.setArrays = None				# Flattened portSets (NumPy).
+		self.alternates = {}				# (network, length) -> ports as sent,
+											# if there are several.
+		self.down = set() if down is None else down	# Ports that are down.
+
+	def __len__(self):
+		return len(self.hosts) + len(self.prefixes)
+
+	def Set(self, network, length, port):
+		network &= Netmask(length)
+		if type(port) is tuple:
+			self.alternates[(network, length)] = port
+			port = self.Live(port)
+		else:
+			self.alternates.pop((network, length), None)
+		self.Route(network, length, port)
+
+	def Route(self, network, length, port):
+		if length >= 32:
+			self.hosts[network] = port
+			self.hostArrays = None
+		else:
+			self.prefixes[(network, length)] = port
+			self.dirty = True
+
+	def Remove(self, network, length):
+		network &= Netmask(length)
+		self.alternates.pop((network, length), None)
+		if length >= 32:
+			self.hosts.pop(network, None)
+			self.hostArrays = None
+		elif self.prefixes.pop((network, length), None) is not None:
+			self.dirty = True
+
+	def Live(self, ports):
+		down = self.down
+		live = [port for port in ports if port < BACKUP_PORT
+			and port not in down]
+		if len(live) == 0:
+			live = [port & ~BACKUP_PORT for port in ports
+				if port >= BACKUP_PORT and port & ~BACKUP_PORT not in down]
+		if len(live) == 0:
+			live = [port for port in ports if port < BACKUP_PORT]
+		return live[0] if len(live) == 1 else tuple(live)
+
+	def Reroute(self):
+		moved = 0
+		for (network, length), ports in self.alternates.items():
+			port = self.Live(ports)
+			held = (self.hosts.get(network) if length >= 32
+				else self.prefixes.get((network, length)))
+			if port != held:
+				self.Route(network, length, port)
+				moved += 1
+		self.Compile()
+		return moved
+
+	def Code(self, port):
+		if type(port) is not tuple:
+			return port
+		code = self.setCodes.get(port)
+		if code is None:
+			code = self.setCodes[port] = -2 - len(self.portSets)
+			self.portSets.append(port)
+		return code
+
+	def Compile(self):
+		if not self.dirty:
+			return
+		starts = array("I")
+		ports = array("i")			# -1 where no prefix matches.
+		def Mark(start, port):
+			if len(starts) > 0 and starts[-1] == start:
+				starts.pop()
+				ports.pop()
+			if len(ports) == 0 or ports[-1] != port:
+				starts.append(start)
+				ports.append(port)
+		Mark(0, -1)
+		stack = []					# (last address, port) of open prefixes.
+		# Sorting on (network, length) puts a prefix before those inside it.
+		for (network, length), port in sorted(self.prefixes.items()):
+			while len(stack) > 0 and stack[-1][0] < network:
+				last = stack.pop()[0]
+				Mark(last + 1, stack[-1][1] if len(stack) > 0 else -1)
+			port = self.Code(port)
+			Mark(network, port)
+			stack.append((network | ~Netmask(length) & 0xFFFFFFFF, port))
+		while len(stack) > 0:
+			last = stack.pop()[0]
+			if last < 0xFFFFFFFF:
+				Mark(last + 1, stack[-1][1] if len(stack) > 0 else -1)
+		self.intervals = (starts, ports)
+		self.dirty = False
+
+	def Match(self, address):
+		port = self.hosts.get(address)
+		if port is None:
+			starts, ports = self.intervals
+			port = ports[bisect_right(starts, address) - 1]
+			if port < -1:
+				return self.portSets[-2 - port]
+		return port if port != -1 else None
+
+	def Lookup(self, address, source=0):
+		port = self.Match(address)
+		if type(port) is tuple:
+			return port[FlowHash(address, source) % len(port)]
+		return port
+
+	def LookupMany(self, addrs, sources=None):
+		if numpy is None:
+			if sources is None:
+				sources = itertools.repeat(0)
+			return array("i", [-1 if port is None else port
+				for port in map(self.Lookup, addrs, sources)])
+		addrs = numpy.asarray(addrs, dtype=numpy.uint32)
+		starts, ports = self.intervals
+		result = numpy.frombuffer(ports, dtype=numpy.int32)[numpy.searchsorted(
+			numpy.frombuffer(starts, dtype=numpy.uint32), addrs, "right") - 1]
+		hostAddrs, hostPorts = self.HostArrays()
+		if len(hostAddrs) > 0:
+			index = numpy.searchsorted(hostAddrs, addrs)
+			index[index == len(hostAddrs)] = 0
+			result = numpy.where(hostAddrs[index] == addrs, hostPorts[index],
+				result)
+		multipath = result < -1
+		if multipath.any():
+			setStarts, setSizes, setPorts = self.SetArrays()
+			codes = -2 - result[multipath]
+			flowSources = 0 if sources is None else numpy.asarray(sources,
+				dtype=numpy.uint32)[multipath]
+			hashes = FlowHashMany(addrs[multipath], flowSources)
+			result[multipath] = setPorts[setStarts[codes]
+				+ hashes % setSizes[codes]]
+		return result
+
+	def HostArrays(self):
+		hostArrays = self.hostArrays
+		if hostArrays is None:
+			hosts = sorted(self.hosts.items())
+			hostArrays = (numpy.array([address for address, _ in hosts],
+				dtype=numpy.uint32), numpy.array([self.Code(port)
+				for _, port in hosts], dtype=numpy.int32))
+			self.hostArrays = hostArrays
+		return hostArrays
+
+	def SetArrays(self):
+		setArrays = self.setArrays
+		if setArrays is None or len(setArrays[0]) != len(self.portSets):
+			sizes = numpy.array([len(ports) for ports in self.portSets],
+				dtype=numpy.uint64)
+			setArrays = (numpy.cumsum(sizes) - sizes, sizes,
+				numpy.array([port for ports in self.portSets for port in ports],
+				dtype=numpy.int32))
+			self.setArrays = setArrays
+		return setArrays
+
+	def Flows(self):
+		flows = [Flow(IntToAddr(address), port)
+			for address, port in self.hosts.items()]
+		for (network, length), port in self.prefixes.items():
+			flows.append(Flow(IntToAddr(network) + "/" + str(length), port))
+		return flows
+
+###############################################################################
+# Func: Netmask                                                               #
+# Desc: Creates the netmask of a prefix length.                               #
+# Args: length {int} - the prefix length (0-32).                              #
+# Retn: {int} - the netmask as a uint32.                                      #
+###############################################################################
+def Netmask(length):
+	return (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+
+###############################################################################
+# Func: FlowHash                                                              #
+# Desc: Hashes a flow to pick one of a set of equal-cost ports. The hash is   #
+#       salted with the switch ID so switches along a path do not all make    #
+#       the same choice (which would leave some of the paths unused).         #
+# Args: destination {int} - packed destination address.                       #
+#       source {int} - packed source address (0 if unknown).                  #
+# Retn: {int} - the hash (32 bits).                                           #
+###############################################################################
+def FlowHash(destination, source):
+	global hashSalt
+	value = ((destination*0x9E3779B1 & 0xFFFFFFFF) ^ source ^ hashSalt)
+	value = value*0x85EBCA6B & 0xFFFFFFFF
+	return value ^ (value >> 16)
+
+###############################################################################
+# Func: FlowHashMany                                                          #
+# Desc: FlowHash of a batch of flows with NumPy.                              #
+# Args: destinations {ndarray: uint32} - packed destination addresses.        #
+#       sources {ndarray: uint32|int} - packed source addresses (or 0).       #
+# Retn: {ndarray: uint64} - the hashes.                                       #
+###############################################################################
+def FlowHashMany(destinations, sources):
+	global hashSalt
+	value = destinations.astype(numpy.uint64)*0x9E3779B1 & 0xFFFFFFFF
+	value ^= numpy.asarray(sources, dtype=numpy.uint64) ^ hashSalt
+	value = value*0x85EBCA6B & 0xFFFFFFFF
+	return value ^ (value >> 16)
+
+###############################################################################
+# Func: PortDown                                                              #
+# Desc: Fails over locally as soon as a port goes down, before the controller #
+#       has been told: every destination routed on the port moves to its      #
+#       other equal-cost ports, or to its backup ports. Holds tableLock, as   #
+#       a table from the controller may be installed at the same time.        #
+# Args: port {int} - the port.                                                #
+# Retn: {int} - the number of destinations rerouted.                          #
+###############################################################################
+def PortDown(port):
+	global flowTable, downPorts, tableLock
+	with tableLock:
+		downPorts.add(port)
+		return flowTable.Reroute() if flowTable is not None else 0
+
+###############################################################################
+# Func: PortUp                                                                #
+# Desc: Puts a port back in use, undoing PortDown.                            #
+# Args: port {int} - the port.                                                #
+# Retn: {int} - the number of destinations rerouted.                          #
+###############################################################################
+def PortUp(port):
+	global flowTable, downPorts, tableLock
+	with tableLock:
+		if port not in downPorts:
+			return 0
+		downPorts.discard(port)
+		return flowTable.Reroute() if flowTable is not None else 0
+
 ###############################################################################
 # Func: CreateUpdatePacket                                                    #
 # Desc: Creates the update packet to send to the controller.                  #
 # Args: command {string} - either add or delete.                              #
 #       portNum {int} - the port number for the connection to add/delete.     #
 #       IPaddr {string} - destination of connection.                          #
+#       held {string} - version to report instead of the one held.            #
 # Retn: {string} - the packet.                                                #
 ###############################################################################
-def CreateUpdatePacket(command, portNum, IPaddr):
+def CreateUpdatePacket(command, portNum, IPaddr, held=None):
 	global switchID
 	packet = str(switchID) + ", " + command + ", " + str(portNum) + ", " + IPaddr
+	if not protocol.legacyMode:
+		packet += ", " + (held or HeldVersion())
 	return packet
 
+###############################################################################
+# Func: CreateMultiUpdatePacket                                               #
+# Desc: Creates a Multi-Update Packet: several Update Packets, a line each,   #
+#       which the controller applies as one change (all or nothing) and       #
+#       answers with one flow table.                                          #
+# Args: operations {list: tuple} - (command, portNum, IPaddr) of each.        #
+# Retn: {string} - the packet.                                                #
+###############################################################################
+def CreateMultiUpdatePacket(operations):
+	return "\n".join(CreateUpdatePacket(command, portNum, IPaddr)
+		for command, portNum, IPaddr in operations)
+
+###############################################################################
+# Func: HeldVersion                                                           #
+# Desc: Formats the version of the flow table this switch holds.              #
+# Args: N/A                                                                   #
+# Retn: {string} - "epoch:seq"; "0:0" for an unversioned or missing table.    #
+###############################################################################
+def HeldVersion():
+	global flowEpoch, flowSeq
+	return str(flowEpoch) + ":" + str(flowSeq)
+
 ###############################################################################
 # Func: ParseFlowTablePacket                                                  #
-# Desc: Contructs the flow table (data structure) from the packet.            #
+# Desc: Contructs the flow table (data structure) from the packet. A          #
+#       destination is an address or a CIDR prefix ("10.1.0.0/16"); one       #
+#       listed in several rows has all of their ports (ECMP).                 #
 # Args: flowTablePacket {string} - the packet recieved from the controller.   #
 # Retn: N/A                                                                   #
 ###############################################################################
 def ParseFlowTablePacket(flowTablePacket):
+	global flowTable, flowEpoch, flowSeq, downPorts
+	table = ForwardingTable(downPorts)	# Built aside, as a pushed table may
+										# arrive mid-lookup.
+	addrs, lengths, ports = array("I"), array("B"), array("H")
+	if flowTablePacket != "EMPTY":		# Switch has no active ports
+		for row in flowTablePacket.splitlines():
+			match = re.search("^(?P<address>" + IPv4 + ")(/(?P<length>\d+))?, ",
+				str(row))
+			port = re.search(" (-?\d+)$", str(row)).group(1)
+			if int(port) != -1:
+				addrs.append(AddrToInt(match.group("address")))
+				lengths.append(int(match.group("length") or 32))
+				ports.append(int(port))
+	for (address, length), port in GroupPorts(addrs, lengths, ports).items():
+		table.Set(address, length, port)
+	table.Compile()
+	flowTable = table
+	flowEpoch, flowSeq = 0, 0			# Full tables are unversioned.
+
+###############################################################################
+# Func: ParseBinaryFlowTablePacket                                            #
+# Desc: Contructs the flow table (data structure) from a binary packet.       #
+# Args: flowTablePacket {bytes} - the packet recieved from the controller.    #
+# Retn: N/A                                                                   #
+###############################################################################
+def ParseBinaryFlowTablePacket(flowTablePacket):
+	global flowTable, flowEpoch, flowSeq, downPorts
+	table = ForwardingTable(downPorts)
+	addrs, ports, lengths = DecodeFlowTable(flowTablePacket)
+	for (address, length), port in GroupPorts(addrs, lengths, ports).items():
+		table.Set(address, length, port)
+	table.Compile()
+	flowTable = table
+	flowEpoch, flowSeq = 0, 0
+
+###############################################################################
+# Func: ApplyFlowDelta                                                        #
+# Desc: Updates the flow table from a Flow Table Delta Packet. A full table   #
+#       (base version 0) replaces it; any other delta only patches the rows   #
+#       it names, and only if it applies to the version held. The rows of a   #
+#       prefix replace its whole port set.                                    #
+# Args: flowDeltaPacket {bytes} - the packet recieved from the controller.    #
+# Retn: {bool} - False if the delta is for another version (the table is      #
+#                left as is and a full table should be requested).            #
+###############################################################################
+def ApplyFlowDelta(flowDeltaPacket):
+	global flowTable, flowEpoch, flowSeq, downPorts
+	(epoch, baseSeq, newSeq, upAddrs, upLengths, upPorts, removed,
+		removedLengths) = DecodeFlowDelta(flowDeltaPacket)
+	if baseSeq == 0:
+		table = ForwardingTable(downPorts)
+	elif (epoch, baseSeq) == (flowEpoch, flowSeq):
+		table = flowTable
+	else:
+		return False
+	for address, length in zip(removed, removedLengths):
+		table.Remove(address, length)
+	for (address, length), port in GroupPorts(upAddrs, upLengths,
+			upPorts).items():
+		table.Set(address, length, port)
+	table.Compile()
+	flowTable = table
+	flowEpoch, flowSeq = epoch, newSeq
+	return True
+
+###############################################################################
+# Func: InstallFlowTable                                                      #
+# Desc: Parses a Flow Table (or Delta) Packet into the flow table. Holds      #
+#       tableLock, so a delta is not patched in while PortDown or PortUp      #
+#       reroutes the table, and a new table sees every port they changed.     #
+# Args: msgType {int} - the MSG_* type of the packet.                         #
+#       flowTablePacket {bytes} - the packet recieved from the controller.    #
+# Retn: {bool} - False if a delta did not apply to the table held.            #
+###############################################################################
+def InstallFlowTable(msgType, flowTablePacket):
+	global tableLock
+	with tableLock:
+		if msgType == MSG_FLOW_DELTA:
+			return ApplyFlowDelta(flowTablePacket)
+		if msgType == MSG_FLOW_BINARY:
+			ParseBinaryFlowTablePacket(flowTablePacket)
+		else:
+			ParseFlowTablePacket(flowTablePacket.decode())
+		return True
+
+###############################################################################
+# Class: Subscription                                                         #
+# Description: A persistent connection to the controller. Update Packets are  #
+#              sent on it, and a reader thread installs every flow table      #
+#              that arrives: replies to this switch's packets as well as the  #
+#              tables the controller pushes when another switch changes the   #
+#              network. Packets are sent from several threads (the reader     #
+#              asks for a full table itself), so sending is serialized by     #
+#              sendLock.                                                      #
+###############################################################################
+class Subscription:
+	def __init__(self, host, port, switchID):
+		self.sock = create_connection((host, port))
+		self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+		self.sendLock = threading.Lock()
+		self.alive = True
+		self.replies = {}				# Request ID -> Event.
+		self.nextID = itertools.count(1)
+		threading.Thread(target=self.Reader, daemon=True).start()
+		self.Request(MSG_SUBSCRIBE, str(switchID) + ", " + HeldVersion())
+
+	def Request(self, msgType, payload, timeout=10):
+		requestID = next(self.nextID)
+		event = threading.Event()
+		self.replies[requestID] = event
+		self.Send(msgType, payload, requestID)
+		event.wait(timeout)
+		self.replies.pop(requestID, None)
+		return self.alive and event.is_set()
+
+	def Send(self, msgType, payload, requestID=0):
+		try:
+			with self.sendLock:
+				SendPacket(self.sock, msgType, payload, requestID)
+		except OSError:
+			self.Close()
+
+	def Reader(self):
+		try:
+			while True:
+				msgType, requestID, payload = RecvFrame(self.sock)
+				if payload is None:
+					break
+				if not InstallFlowTable(msgType, payload):
+					# Out of step with the controller: ask for a full table
+					# (as a request, which the controller always answers).
+					# A request this answered is done once that arrives.
+					resyncID = next(self.nextID)
+					event = self.replies.pop(requestID, None)
+					if event is not None:
+						self.replies[resyncID] = event
+					self.Send(MSG_UPDATE, CreateUpdatePacket("ADD", 0,
+						"0.0.0.0", "0:0"), resyncID)
+					continue
+				event = self.replies.pop(requestID, None)
+				if event is not None:
+					event.set()
+				else:
+					print("Flow table pushed by controller.")
+		except (OSError, ProtocolError):
+			pass
+		if self.alive:
+			print("Lost connection to controller.")
+		self.Close()
+
+	def Close(self):
+		self.alive = False
+		try:
+			self.sock.close()
+		except OSError:
+			pass
+		for event in list(self.replies.values()):
+			event.set()
+
+###############################################################################
+# Func: Subscribe                                                             #
+# Desc: Opens the subscription to the controller if it is not open, which     #
+#       also fetches the current flow table. Threads that call it at once     #
+#       share one subscription (subscribeLock).                               #
+# Args: N/A                                                                   #
+# Retn: {bool} - whether the switch is subscribed.                            #
+###############################################################################
+def Subscribe():
+	global controllerHost, controllerPort, subscription, switchID
+	global subscribeLock
+	if protocol.legacyMode:
+		return False
+	with subscribeLock:
+		if subscription is not None and subscription.alive:
+			return True
+		try:
+			subscription = Subscription(controllerHost, controllerPort,
+				switchID)
+		except OSError:
+			subscription = None
+			return False
+		if subscription.alive:
+			print("Subscribed to controller; flow table received.")
+		return subscription.alive
+
+###############################################################################
+# Func: ReadAddresses                                                         #
+# Desc: Reads destination addresses in chunks, either one dotted address      #
+#       per line or packed big-endian uint32s. With flows, every address is   #
+#       followed by the source address of the packet ("dst src" per line,     #
+#       or a second uint32), which is hashed to pick among equal-cost ports.  #
+# Args: stream {file} - binary stream to read from.                           #
+#       binary {bool} - whether the addresses are packed.                     #
+#       chunkSize {int} - most addresses per chunk.                           #
+#       flows {bool} - whether source addresses follow.                       #
+# Retn: {generator} - arrays of packed destination addresses and of source    #
+#                     addresses (None without flows).                         #
+###############################################################################
+def ReadAddresses(stream, binary, chunkSize, flows=False):
+	width = 8 if flows else 4
+	while True:
+		if binary:
+			data = stream.read(width*chunkSize)
+			data = data[:len(data) - len(data) % width]
+		else:
+			lines = [line for line in itertools.islice(stream, chunkSize)
+				if not line.isspace()]
+			data = b"".join(inet_aton(field.decode()) for line in lines
+				for field in line.split()[:width//4])
+		if len(data) == 0:
+			return
+		if numpy is not None:
+			addrs = numpy.frombuffer(data, dtype=">u4")
+		else:
+			addrs = array("I", data)
+			if sys.byteorder == "little":
+				addrs.byteswap()
+		yield (addrs[::2], addrs[1::2]) if flows else (addrs, None)
+
+###############################################################################
+# Func: WritePorts                                                            #
+# Desc: Writes the egress port of each address (-1 where no rule matches),    #
+#       one per line or as packed big-endian int32s.                          #
+# Args: stream {file} - binary stream to write to.                            #
+#       ports {array} - the ports.                                            #
+#       binary {bool} - whether to pack the ports.                            #
+# Retn: N/A                                                                   #
+###############################################################################
+def WritePorts(stream, ports, binary):
+	if not binary:
+		stream.write(("\n".join(map(str, ports.tolist())) + "\n").encode())
+	elif numpy is not None:
+		stream.write(ports.astype(">i4").tobytes())
+	else:
+		ports = array("i", ports)
+		if sys.byteorder == "little":
+			ports.byteswap()
+		stream.write(ports.tobytes())
+
+###############################################################################
+# Func: ForwardStream                                                         #
+# Desc: Bulk forwarding mode: resolves a stream of destination addresses      #
+#       against the flow table in batches and writes out the egress ports.    #
+#       A table pushed by the controller mid-stream is used from the next     #
+#       batch on.                                                             #
+# Args: source {file} - binary stream of addresses.                           #
+#       sink {file} - binary stream for the ports.                            #
+#       binary {bool} - packed instead of text input and output.              #
+#       chunkSize {int} - addresses per batch.                                #
+#       flows {bool} - whether each address comes with a source address.      #
+# Retn: {int} - the number of addresses forwarded.                            #
+#       {float} - seconds spent in lookups.                                   #
+###############################################################################
+def ForwardStream(source, sink, binary, chunkSize, flows=False):
 	global flowTable
-	flowTable = []
-	if flowTablePacket == "EMPTY":		# Switch has no active ports
-		return
-	for row in flowTablePacket.splitlines():
-		address = re.search("^(" + IPv4 + "), ", str(row)).group(1)
-		port = re.search(" (\d+)$", str(row)).group(1)
-		if int(port) != -1:
-			flowTable.append(Flow(address, port))
+	count = 0
+	lookupTime = 0.0
+	for addrs, sources in ReadAddresses(source, binary, chunkSize, flows):
+		start = time.perf_counter()
+		ports = flowTable.LookupMany(addrs, sources)
+		lookupTime += time.perf_counter() - start
+		WritePorts(sink, ports, binary)
+		count += len(addrs)
+	sink.flush()
+	return count, lookupTime
 
 ###############################################################################
 # Func: CommHelp                                                              #
@@ -66,91 +632,310 @@ def CommHelp():
 	print("         A 0")
 	print("    DELETE [port#]")
 	print("         D [port#]")
-	print("   FORWARD [IPv4 address]")
-	print("         F [IPv4 address]")
+	print("    [command]; [command]; ...   (ADDs and DELETEs as one update)")
+	print("   FORWARD [IPv4 address] [source IPv4 address]")
+	print("         F [IPv4 address] [source IPv4 address]")
 	print("      exit")
 
+###############################################################################
+# Func: ParseOperation                                                        #
+# Desc: Reads one ADD or DELETE command.                                      #
+# Args: command {string} - the command, e.g. "A 4 10.4.0.1" or "D 2".         #
+# Retn: {tuple} - (command, portNum, IPaddr), or None if it is not an ADD     #
+#                 or DELETE.                                                  #
+###############################################################################
+def ParseOperation(command):
+	if reADD.search(command) or reShortADD.search(command):
+		port = int(command.split(" ")[1])
+		# ADD 0 for table request.
+		addr = "0.0.0.0" if port == 0 else command.split(" ")[2]
+		return ("ADD", port, addr)
+	if reDELETE.search(command) or reShortDELETE.search(command):
+		return ("DELETE", int(command.split(" ")[1]), "0.0.0.0")
+	return None
+
 ###############################################################################
 # Func: ControllerHandler                                                     #
-# Desc: Sends update packet to the controller and receives the flow table.    #
+# Desc: Sends update packet to the controller and receives the flow table,    #
+#       over the subscription if there is one or else on a new connection.    #
 # Args: packet {string} - the update packet.                                  #
-# Retn: N/A                                                                   #
+#       msgType {int} - MSG_UPDATE or MSG_UPDATE_BATCH.                       #
+# Retn: {bool} - whether the controller answered (with the flow table).       #
 ###############################################################################
-def ControllerHandler(packet):
-	global controllerHost, controllerPort
+def ControllerHandler(packet, msgType=MSG_UPDATE):
+	global controllerHost, controllerPort, subscription
+	if Subscribe():
+		print("Sending packet to controller.")
+		if subscription.Request(msgType, packet):
+			print("└─»New flow table received.")
+			return True
+		print("└─»Error: No flow table received.")
+		return False
 	controller = socket(AF_INET, SOCK_STREAM)
 	controller.connect((controllerHost, controllerPort))
 	print("Connected to controller.")
 	print("├─»Sending packet.")
-	controller.send(packet.encode())
-	flowTablePacket = controller.recv(2048).decode()
+	SendPacket(controller, msgType, packet)
+	msgType, flowTablePacket = RecvMessage(controller)
+	if flowTablePacket is None:
+		print("└─»Error: No flow table received.")
+		controller.close()
+		return False
 	print("├─»New flow table received.")
 	print("└─»Disconnecting from controller.")
 	controller.close()
-	ParseFlowTablePacket(flowTablePacket)
+	if not InstallFlowTable(msgType, flowTablePacket):
+		print("Error: Flow table update is for another version.")
+	return True
+
+###############################################################################
+# Func: NotifyController                                                      #
+# Desc: Queues updates for the sender thread, which sends the queued          #
+#       updates to the controller one at a time, in order, so a DELETE sent   #
+#       without waiting (the switch goes on forwarding on the table it        #
+#       rerouted locally) is never overtaken by a later update. The packet    #
+#       is made when it is sent, so it reports the flow table held then.      #
+#       Called from the main thread only.                                     #
+# Args: operations {list: tuple} - (command, portNum, IPaddr) of each; more   #
+#                                  than one are sent as a Multi-Update        #
+#                                  Packet.                                    #
+#       wait {bool} - whether to wait until the packet has been answered.     #
+# Retn: N/A                                                                   #
+###############################################################################
+def NotifyController(operations, wait=False):
+	global updateQueue, updateSender, unacknowledged, tableLock
+	if updateSender is None:
+		updateSender = threading.Thread(target=UpdateSender, daemon=True)
+		updateSender.start()
+	with tableLock:
+		unacknowledged.update(portNum for command, portNum, _ in operations
+			if command == "DELETE")
+	done = threading.Event()
+	updateQueue.put((operations, done))
+	if wait:
+		done.wait()
+
+###############################################################################
+# Func: UpdateSender                                                          #
+# Desc: The sender thread: sends every queued update to the controller, in    #
+#       order, and marks it done once it is answered (or has failed; no       #
+#       error stops the thread).                                              #
+# Args: N/A                                                                   #
+# Retn: N/A                                                                   #
+###############################################################################
+def UpdateSender():
+	global updateQueue
+	while True:
+		operations, done = updateQueue.get()
+		answered = False
+		try:
+			if len(operations) == 1:
+				answered = ControllerHandler(CreateUpdatePacket(
+					*operations[0]))
+			else:
+				answered = ControllerHandler(CreateMultiUpdatePacket(
+					operations), MSG_UPDATE_BATCH)
+		except (OSError, ProtocolError) as error:
+			print("└─»Error: Controller unavailable (" + str(error) + ").")
+		except Exception as error:
+			print("└─»Error: Update failed (" + type(error).__name__ + ": "
+				+ str(error) + ").")
+		finally:
+			ReleasePorts(operations, answered)
+			done.set()
+
+###############################################################################
+# Func: ReleasePorts                                                          #
+# Desc: Called once the controller has been sent a DELETE. If it answered,    #
+#       the flow table installed is its own view of the port: without it if   #
+#       the DELETE was applied, or still with it if the DELETE was rejected.  #
+#       Either way the local mark of PortDown is no longer needed, so the     #
+#       port leaves downPorts once every DELETE of it has been answered (a    #
+#       port whose DELETE never reached the controller stays down).           #
+# Args: operations {list: tuple} - (command, portNum, IPaddr) of each.        #
+#       answered {bool} - whether the controller answered them.               #
+# Retn: N/A                                                                   #
+###############################################################################
+def ReleasePorts(operations, answered):
+	global flowTable, downPorts, unacknowledged, tableLock
+	with tableLock:
+		released = False
+		for command, portNum, _ in operations:
+			if command != "DELETE":
+				continue
+			unacknowledged[portNum] -= 1
+			if unacknowledged[portNum] <= 0:
+				del unacknowledged[portNum]
+				if answered and portNum in downPorts:
+					downPorts.discard(portNum)
+					released = True
+		if released and flowTable is not None:
+			flowTable.Reroute()
+
+###############################################################################
+# Func: LocalReroute                                                          #
+# Desc: Applies the ports an update brings down (DELETE) or back up (ADD) to  #
+#       the flow table right away, and says how many destinations moved.      #
+# Args: operations {list: tuple} - (command, portNum, IPaddr) of each.        #
+# Retn: {bool} - whether any port went down.                                  #
+###############################################################################
+def LocalReroute(operations):
+	moved = 0
+	down = False
+	for command, portNum, _ in operations:
+		if command == "DELETE":
+			moved += PortDown(portNum)
+			down = True
+		elif portNum != 0:
+			moved += PortUp(portNum)
+	if moved > 0:
+		print("Rerouted " + str(moved) + " destination(s) locally.")
+	return down
 
 ###############################################################################
 switchID = 0					# Initialize to 0.
 flowtable = []					# Global.
 controllerHost = 'localhost'	# Global.
 controllerPort = 2345			# Global.
+subscription = None				# Persistent connection to the controller.
+subscribeLock = threading.Lock()	# Held while the subscription is opened.
+updateQueue = queue.Queue()		# (operations, done) for UpdateSender.
+updateSender = None				# The thread sending updateQueue.
+tableLock = threading.Lock()	# Held while flowTable or downPorts change.
+flowTable = None				# ForwardingTable, replaced by full tables.
+downPorts = set()				# Ports DELETEd, shared by every table.
+unacknowledged = Counter()		# Port -> DELETEs the controller has not
+								# answered yet.
+hashSalt = 0					# Salts FlowHash (set to the switch ID).
+flowEpoch = 0					# Version of the flow table held.
+flowSeq = 0
 # Define regex for an IPv4 address.
 IPv4 = ("((25[0-5]|2[0-4][0-9]|1[0-9]{2}|[1-9][0-9]|[0-9])\.){3}"
 	"(25[0-5]|2[0-4][0-9]|1[0-9]{2}|[1-9][0-9]|[0-9])")
+# Define regex for a port (1 to MAX_PORT = 32767).
+Port = ("(3276[0-7]|327[0-5][0-9]|32[0-6][0-9]{2}|3[01][0-9]{3}|[12][0-9]{4}|"
+	"[1-9][0-9]{0,3})")
 # Define syntax for ADD.
-reADD = re.compile("^ADD ((0)|(\d+ "+IPv4+"))$")
-reShortADD = re.compile("^A ((0)|(\d+ "+IPv4+"))$")
+reADD = re.compile("^ADD ((0)|("+Port+" "+IPv4+"))$")
+reShortADD = re.compile("^A ((0)|("+Port+" "+IPv4+"))$")
 # Define syntax for FORWARD.
-reFORWARD = re.compile("^FORWARD "+IPv4+"$")
-reShortFORWARD = re.compile("^F "+IPv4+"$")
+reFORWARD = re.compile("^FORWARD "+IPv4+"( "+IPv4+")?$")
+reShortFORWARD = re.compile("^F "+IPv4+"( "+IPv4+")?$")
 # Define syntax for DELETE.
-reDELETE = re.compile("^DELETE \d+$")
-reShortDELETE = re.compile("^D \d+$")
-
-print("Welcome to the interactive switch simulator!")
-# Select a switch to simulate.
-while int(switchID) < 1 or int(switchID) > 3:
-	switchID = input("Please choose a switch:\n"
-		 +" (1) - switch 1 (10.0.0.1)\n"
-		 +" (2) - switch 2 (10.0.0.2)\n"
-		 +" (3) - switch 3 (10.0.0.3)\n> ")
-	switchID = int("0"+re.sub("\D", "", switchID))
-switchID += 5 		# SW1 = ID 6; SW2 = ID 7; etc.
-
-print("Simulation is live! Please ensure that the router\n"
-	 +"and controller programs are running.")
-
-while True:									# Run forever.
-	command = input('> ')					# Prompt user for command
-	if reADD.search(command) or reShortADD.search(command):				## ADD
-		port = int(command.split(" ")[1])
-		# ADD 0 for table request.
-		addr = "0.0.0.0" if port == 0 else command.split(" ")[2]
-		packet = CreateUpdatePacket("ADD", port, addr)
-		ControllerHandler(packet)
+reDELETE = re.compile("^DELETE "+Port+"$")
+reShortDELETE = re.compile("^D "+Port+"$")
 
-	elif reDELETE.search(command) or reShortDELETE.search(command): 	## DELETE
-		port = int(command.split(" ")[1])
-		addr = "0.0.0.0"
-		packet = CreateUpdatePacket("DELETE", port, addr)
-		ControllerHandler(packet)
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Interactive switch simulator.")
+	parser.add_argument("--legacy", action="store_true",
+		help="use the old unframed protocol (messages limited to 2048 bytes)")
+	parser.add_argument("-s", "--switch", type=int, choices=[1, 2, 3],
+		help="switch to simulate (asked for if not given)")
+	parser.add_argument("-f", "--forward", metavar="FILE",
+		help="bulk mode: forward every address in FILE ('-' for stdin) and "
+			+ "write out the egress ports")
+	parser.add_argument("-o", "--output", metavar="FILE", default="-",
+		help="where bulk mode writes the ports (default stdout)")
+	parser.add_argument("-b", "--binary", action="store_true",
+		help="bulk mode reads packed uint32 addresses and writes packed int32 "
+			+ "ports")
+	parser.add_argument("-t", "--table", metavar="FILE",
+		help="bulk mode uses this text flow table instead of the controller's")
+	parser.add_argument("-c", "--chunk", type=int, default=65536,
+		help="addresses per bulk lookup batch")
+	parser.add_argument("--flows", action="store_true",
+		help="bulk mode reads a source address after every destination and "
+			+ "hashes the pair to choose among equal-cost ports")
+	args = parser.parse_args()
+	protocol.legacyMode = args.legacy
 
-	elif reFORWARD.search(command) or reShortFORWARD.search(command):	## FORWARD
-		try:
-			forwardAddr = re.search("("+IPv4+")", command).group(1)
-			match = False
-			for entry in flowTable:		# Search flow table for match.
-				if entry.address == forwardAddr:
-					match = True
-					print("Forwarding packet out port "
-						+ str(entry.port) + ".")
-			if match == False: print("No rule to match for packet.")
-		except:
-			print("Error: No flow table.")
+	if args.forward is not None:							## BULK MODE
+		out = sys.stdout.buffer if args.output == "-" else open(args.output,
+			"wb")
+		sys.stdout = sys.stderr		# Keep messages out of the port stream.
+		switchID = (args.switch or 1) + 5
+		hashSalt = switchID
+		if args.table is not None:
+			with open(args.table) as tableFile:
+				ParseFlowTablePacket(tableFile.read())
+		else:
+			ControllerHandler(CreateUpdatePacket("ADD", 0, "0.0.0.0"))
+		source = sys.stdin.buffer if args.forward == "-" else open(args.forward,
+			"rb")
+		start = time.perf_counter()
+		count, lookupTime = ForwardStream(source, out, args.binary, args.chunk,
+			args.flows)
+		total = time.perf_counter() - start
+		print("Forwarded " + str(count) + " packets in %.3f s: %.0f packets/sec"
+			% (total, count/max(total, 1e-9)) + " (lookups alone %.0f/sec)."
+			% (count/max(lookupTime, 1e-9)))
+		sys.exit(0)
+
+	print("Welcome to the interactive switch simulator!")
+	# Select a switch to simulate.
+	if args.switch is not None:
+		switchID = args.switch
+	while int(switchID) < 1 or int(switchID) > 3:
+		switchID = input("Please choose a switch:\n"
+			 +" (1) - switch 1 (10.0.0.1)\n"
+			 +" (2) - switch 2 (10.0.0.2)\n"
+			 +" (3) - switch 3 (10.0.0.3)\n> ")
+		switchID = int("0"+re.sub("\D", "", switchID))
+	switchID += 5 		# SW1 = ID 6; SW2 = ID 7; etc.
+	hashSalt = switchID
+
+	print("Simulation is live! Please ensure that the router\n"
+		 +"and controller programs are running.")
+	Subscribe()
+
+	while True:									# Run forever.
+		command = input('> ')					# Prompt user for command
+		operations = [ParseOperation(part.strip())
+			for part in command.split(";")]
+		if None not in operations and len(operations) > 1:			## MULTI
+			down = LocalReroute(operations)
+			if protocol.legacyMode:		# No Multi-Update Packet: one by one.
+				for operation in operations:
+					NotifyController([operation], wait=True)
+			else:
+				NotifyController(operations, wait=not down)
+
+		elif reADD.search(command) or reShortADD.search(command):			## ADD
+			port = int(command.split(" ")[1])
+			# ADD 0 for table request.
+			addr = "0.0.0.0" if port == 0 else command.split(" ")[2]
+			LocalReroute([("ADD", port, addr)])
+			# Sent after any DELETE queued.
+			NotifyController([("ADD", port, addr)], wait=True)
+
+		elif reDELETE.search(command) or reShortDELETE.search(command): 	## DELETE
+			port = int(command.split(" ")[1])
+			addr = "0.0.0.0"
+			LocalReroute([("DELETE", port, addr)])
+			# Already failed over locally: no need to wait.
+			NotifyController([("DELETE", port, addr)])
+
+		elif reFORWARD.search(command) or reShortFORWARD.search(command):	## FORWARD
+			try:
+				addrs = [AddrToInt(match.group(0))
+					for match in re.finditer(IPv4, command)]
+				forwardAddr = addrs[0]
+				sourceAddr = addrs[1] if len(addrs) > 1 else 0
+				# Longest prefix match in the flow table.
+				ports = flowTable.Match(forwardAddr)
+				port = flowTable.Lookup(forwardAddr, sourceAddr)
+				if port is not None:
+					print("Forwarding packet out port " + str(port) + ".")
+					if type(ports) is tuple:
+						print("(Flow hashed over equal-cost ports "
+							+ ", ".join(map(str, ports)) + ".)")
+				else: print("No rule to match for packet.")
+			except:
+				print("Error: No flow table.")
 		
-	elif command == 'exit':												## EXIT
-		break;
+		elif command == 'exit':												## EXIT
+			break;
 
-	else:																## BAD COMMAND
-		CommHelp()
+		else:																## BAD COMMAND
+			CommHelp()
 
@@ -0,0 +1,276 @@
+###############################################################################
+# Name: test_controller.py                                                    #
+#                                                                             #
+# Regression tests for the controller's topology store, run with              #
+# "python -m pytest tests" from the repository root. The network is built     #
+# straight into the controller's indexes; no router or switch is started.     #
+###############################################################################
+
+from array import array
+import asyncio
+
+import pytest
+
+import controller
+from controller import TopologySync
+from protocol import *
+
+###############################################################################
+# Func: NewNetwork                                                            #
+# Desc: Empties the controller's indexes and adds a line of hosts, host i     #
+#       reaching host i + 1 on port 1 and host i - 1 on port 2. The router    #
+#       is taken to be synced, so later changes are kept as a delta.          #
+# Args: numHosts {int} - the number of hosts.                                 #
+# Retn: N/A                                                                   #
+###############################################################################
+def NewNetwork(numHosts):
+	controller.addressMapList = []
+	controller.idByAddr = {}
+	controller.packedAddrs = array("I")
+	controller.portMap = []
+	controller.neighborMap = []
+	controller.freePorts = []
+	controller.nextPort = []
+	controller.routerSync = TopologySync()
+	controller.topologyVersion = 0
+	controller.topologyLog = None
+	for ID in range(numHosts):
+		controller.AddHost(HostAddress(ID))
+	for ID in range(numHosts - 1):
+		controller.Link(ID, 1, ID + 1)
+		controller.Link(ID + 1, 2, ID)
+	controller.routerSync.version = 0
+
+###############################################################################
+# Func: HostAddress                                                           #
+# Desc: The address of a host of the network.                                 #
+# Args: ID {int} - ID of the host.                                            #
+# Retn: {string} - IPv4 address.                                              #
+###############################################################################
+def HostAddress(ID):
+	return "10.0.%d.%d" % (ID >> 8, (ID & 0xff) + 1)
+
+###############################################################################
+# Func: Links                                                                 #
+# Desc: Every directed link of the network.                                   #
+# Args: N/A                                                                   #
+# Retn: {set: tuple} - (srcID, port, dstID) of each.                          #
+###############################################################################
+def Links():
+	return {(srcID, port, link.dstID)
+		for srcID, ports in enumerate(controller.portMap)
+		for port, link in ports.items()}
+
+def test_add_port_out_of_range():
+	NewNetwork(3)
+	before = Links()
+	for port in [-1, MAX_PORT + 1, 70000]:
+		controller.AddConnection(0, port, -1, "10.9.0.1")
+		controller.AddConnection(0, port, 2, HostAddress(2))
+	assert Links() == before
+	assert len(controller.addressMapList) == 3
+	# The router can still be sent the (empty) delta.
+	full, epoch, base, version, sources, body = DecodeTopologySync(
+		controller.routerSync.Packet([0]))
+	assert not full
+	assert all(len(column) == 0 for column in DecodeTopologyDelta(body))
+
+def test_add_highest_port():
+	NewNetwork(3)
+	controller.AddConnection(0, MAX_PORT, 2, HostAddress(2))
+	assert (0, MAX_PORT, 2) in Links()
+	body = DecodeTopologySync(controller.routerSync.Packet([0]))[5]
+	addrs, upSrc, upDst, upCost, upPort, rmSrc, rmPort = \
+		DecodeTopologyDelta(body)
+	assert sorted(zip(upSrc, upPort, upDst)) == [(0, MAX_PORT, 2), (2, 1, 0)]
+
+def test_batch_port_out_of_range():
+	NewNetwork(3)
+	before = Links()
+	controller.ApplyUpdates("0, DELETE, 1, 0.0.0.0\n"
+		"0, ADD, " + str(MAX_PORT + 1) + ", " + HostAddress(2))
+	assert Links() == before
+	assert controller.topologyVersion == 0
+	assert controller.ValidateUpdates(0, [("ADD", 0, HostAddress(2))]) \
+		is not None
+
+def test_failed_update_keeps_version():
+	NewNetwork(3)
+	controller.ApplyUpdate("0, ADD, 1, " + HostAddress(2))	# Port in use.
+	controller.ApplyUpdate("0, DELETE, 9, 0.0.0.0")		# No such link.
+	controller.ApplyUpdate("0, ADD, 2, " + HostAddress(0))	# To itself.
+	assert controller.topologyVersion == 0
+	controller.ApplyUpdate("0, ADD, 2, " + HostAddress(2))
+	assert controller.topologyVersion == 1
+	controller.ApplyUpdate("0, DELETE, 2, 0.0.0.0")
+	assert controller.topologyVersion == 2
+	assert Links() == {(0, 1, 1), (1, 2, 0), (1, 1, 2), (2, 2, 1)}
+
+###############################################################################
+# Func: TableBytes                                                            #
+# Desc: Creates the binary Flow Table Packet of a table.                      #
+# Args: table {dict} - (address, length) -> port or tuple of ports.           #
+# Retn: {bytes} - the packet.                                                 #
+###############################################################################
+def TableBytes(table):
+	rows = [(prefix, port) for prefix, ports in sorted(table.items())
+		for port in (ports if type(ports) is tuple else [ports])]
+	return EncodeFlowTable(array("I", [prefix[0] for prefix, _ in rows]),
+		array("H", [port for _, port in rows]),
+		array("B", [prefix[1] for prefix, _ in rows]))
+
+###############################################################################
+# Func: Replay                                                                #
+# Desc: Applies a Flow Table Delta Packet the way a switch does.              #
+# Args: held {dict} - the table at the delta's base (ignored if it is 0).     #
+#       packet {bytes} - the packet.                                          #
+# Retn: {int} - the delta's base and new seq.                                 #
+#       {dict} - the table after the delta.                                   #
+###############################################################################
+def Replay(held, packet):
+	(epoch, baseSeq, newSeq, upAddrs, upLengths, upPorts, removed,
+		removedLengths) = DecodeFlowDelta(packet)
+	assert epoch == controller.flowEpoch
+	table = dict(held) if baseSeq != 0 else {}
+	for prefix in zip(removed, removedLengths):
+		del table[prefix]
+	table.update(GroupPorts(upAddrs, upLengths, upPorts))
+	return baseSeq, newSeq, table
+
+def test_flow_history_replay():
+	controller.historySize = 3
+	a, b, c = AddrToInt("10.0.0.1"), AddrToInt("10.0.0.2"), \
+		AddrToInt("10.1.0.0")
+	tables = [{(a, 32): 1}, {(a, 32): 1, (b, 32): 2},
+		{(a, 32): (1, 2), (c, 16): 3}, {(a, 32): (1, 2), (c, 16): 3}]
+	history = controller.FlowHistory()
+	for version, table in enumerate(tables):
+		history.Record(TableBytes(table), version)
+	assert history.seq == 3				# The repeated table is not a new seq.
+	history.Record(TableBytes({}), 1)	# Older than the newest: ignored.
+	assert history.seq == 3
+	epoch = controller.flowEpoch
+	for heldSeq, held in [(1, tables[0]), (2, tables[1]), (3, tables[2])]:
+		baseSeq, newSeq, table = Replay(held, history.Delta((epoch, heldSeq)))
+		assert (baseSeq, newSeq, table) == (heldSeq, 3, tables[2])
+	# A table from another epoch, or one no longer kept, gets a full table.
+	history.Record(TableBytes(tables[0]), 4)
+	for held in [(epoch, 1), (epoch + 1, 3), (0, 0)]:
+		baseSeq, newSeq, table = Replay({}, history.Delta(held))
+		assert (baseSeq, newSeq, table) == (0, 4, tables[0])
+
+###############################################################################
+# Func: Recover                                                               #
+# Desc: Empties the controller's indexes and recovers the network from a      #
+#       snapshot and write-ahead log, as on a restart.                        #
+# Args: name {string} - path of the files, without the extension.             #
+# Retn: {set: tuple} - the recovered links.                                   #
+#       {int} - the number of hosts recovered.                                #
+###############################################################################
+def Recover(name):
+	if controller.topologyLog is not None:
+		controller.topologyLog.file.close()
+	NewNetwork(0)
+	controller.topologyLog = controller.TopologyLog(name, 0, 1000)
+	controller.topologyLog.Recover(None)
+	return Links(), len(controller.addressMapList)
+
+def test_wal_replay_after_truncation(tmp_path):
+	name = str(tmp_path/"net")
+	NewNetwork(3)
+	controller.topologyLog = controller.TopologyLog(name, 0, 1000)
+	controller.topologyLog.Snapshot()
+	states = [(Links(), 3)]
+	controller.ApplyUpdate("0, ADD, 2, " + HostAddress(2))	# 1 record.
+	states.append((Links(), 3))
+	controller.ApplyUpdates("1, DELETE, 1, 0.0.0.0\n"		# 3 records.
+		"1, ADD, 3, " + HostAddress(3))
+	states.append((Links(), 4))
+	controller.ApplyUpdate("2, ADD, 3, " + HostAddress(4))	# 1 record.
+	states.append((Links(), 5))
+	controller.topologyLog.file.flush()
+	with open(name + ".wal", 'rb') as logFile:
+		data = logFile.read()
+	record = controller.walRecord.size + controller.walCRC.size
+	start = controller.logHeader.size
+	assert len(data) == start + 5*record
+	assert Recover(name) == states[3]
+	# A torn record, a torn transaction or a bad CRC ends the log there.
+	for end, state in [(start + 5*record - 1, states[2]),
+			(start + 4*record, states[2]), (start + 3*record, states[1]),
+			(start + record + 7, states[1]), (start + 1, states[0])]:
+		with open(name + ".wal", 'wb') as logFile:
+			logFile.write(data[:end])
+		assert Recover(name) == state
+	with open(name + ".wal", 'wb') as logFile:
+		logFile.write(data[:start + 2*record] + b"\0" + data[start + 2*record
+			+ 1:])
+	assert Recover(name) == states[1]
+	# The tail is dropped, so what is logged next is replayed after it.
+	assert controller.topologyLog.file.tell() == start + record
+	controller.ApplyUpdate("2, ADD, 3, " + HostAddress(4))
+	expected = (Links(), 4)
+	controller.topologyLog.file.flush()
+	assert Recover(name) == expected
+	controller.topologyLog.file.close()
+	controller.topologyLog = None
+
+def test_batch_all_or_nothing(tmp_path):
+	name = str(tmp_path/"net")
+	NewNetwork(3)
+	controller.topologyLog = controller.TopologyLog(name, 0, 1000)
+	controller.topologyLog.Snapshot()
+	before = (Links(), 3)
+	# The last operation fails (10.0.0.3 is a neighbor by then): none apply.
+	controller.ApplyUpdates("0, DELETE, 1, 0.0.0.0\n"
+		"0, ADD, 2, " + HostAddress(2) + "\n"
+		"0, ADD, 3, 10.9.0.1\n"
+		"0, ADD, 4, " + HostAddress(2))
+	assert (Links(), len(controller.addressMapList)) == before
+	assert controller.topologyVersion == 0
+	assert controller.topologyLog.seq == 0
+	controller.ApplyUpdates("0, DELETE, 1, 0.0.0.0\n"
+		"0, ADD, 1, " + HostAddress(2) + "\n"
+		"0, ADD, 3, 10.9.0.1\n"
+		"0, ADD, 0, 0.0.0.0")
+	after = (Links(), 4)
+	assert Links() == {(0, 1, 2), (2, 1, 0), (0, 3, 3), (3, 1, 0),
+		(1, 1, 2), (2, 2, 1)}
+	assert controller.topologyVersion == 1
+	assert controller.topologyLog.seq == 4	# Begin and three records.
+	controller.topologyLog.file.flush()
+	assert Recover(name) == after
+	controller.topologyLog.file.close()
+	controller.topologyLog = None
+
+###############################################################################
+# Func: Coalesced                                                             #
+# Desc: Asks for the tables of two switches from one coalesced recompute,     #
+#       whose router request raises an error.                                 #
+# Args: error {Exception} - the error.                                        #
+# Retn: {list} - what each request got.                                       #
+###############################################################################
+def Coalesced(error):
+	async def BatchFlowTables(switchIDs):
+		raise error
+	async def Main():
+		requests = [controller.CoalescedTable(ID, ID) for ID in (0, 1)]
+		return await asyncio.wait_for(asyncio.gather(*requests,
+			return_exceptions=True), 5)
+	batch = controller.BatchFlowTables
+	controller.BatchFlowTables = BatchFlowTables
+	controller.debounceWindow = 0
+	controller.pendingTables, controller.pendingWriters = {}, set()
+	controller.pendingFlush = None
+	try:
+		return asyncio.run(Main())
+	finally:
+		controller.BatchFlowTables = batch
+
+def test_coalesced_requests_fail_with_the_batch():
+	NewNetwork(2)
+	error = ConnectionError("router connection lost")
+	assert Coalesced(error) == [error, error]
+	for result in Coalesced(KeyError(3)):		# Not just router errors.
+		assert type(result) is OSError
+	assert controller.pendingFlush is None
@@ -0,0 +1,54 @@
+###############################################################################
+# Name: test_protocol.py                                                      #
+#                                                                             #
+# Round-trip tests for the binary packet encodings of protocol.py, run with   #
+# "python -m pytest tests" from the repository root. Each packet is encoded,  #
+# decoded and compared column by column, with ports up to MAX_PORT, the       #
+# highest a uint16 column holds without reading as a backup port.             #
+###############################################################################
+
+from array import array
+
+from protocol import *
+
+def test_address_round_trip():
+	for address in ["0.0.0.0", "10.1.2.3", "192.168.0.255", "255.255.255.255"]:
+		assert IntToAddr(AddrToInt(address)) == address
+
+def test_adjacency_round_trip():
+	addrs = [AddrToInt("10.0.0.1"), AddrToInt("10.0.0.2"),
+		AddrToInt("10.0.0.3")]
+	linkSrc, linkDst = [0, 1, 1, 2], [1, 0, 2, 1]
+	linkCost, linkPort = [1, 1, 7, 7], [1, 1, MAX_PORT, 2]
+	srcID, *columns = DecodeAdjacency(EncodeAdjacency(2, addrs, linkSrc,
+		linkDst, linkCost, linkPort))
+	assert srcID == 2
+	assert [list(column) for column in columns] == [addrs, linkSrc, linkDst,
+		linkCost, linkPort]
+
+def test_adjacency_empty():
+	srcID, *columns = DecodeAdjacency(EncodeAdjacency(0, [], [], [], [], []))
+	assert srcID == 0
+	assert [len(column) for column in columns] == [0]*5
+
+def test_flow_table_round_trip():
+	addrs = [AddrToInt("10.0.0.2"), AddrToInt("10.1.0.0"),
+		AddrToInt("10.1.0.0")]
+	ports, lengths = [1, 2, 3 | BACKUP_PORT], [32, 16, 16]
+	decoded = DecodeFlowTable(EncodeFlowTable(addrs, ports, lengths))
+	assert [list(column) for column in decoded] == [addrs, ports, lengths]
+
+def test_flow_table_host_routes():
+	addrs, ports, lengths = DecodeFlowTable(EncodeFlowTable(
+		array("I", [1, 2]), array("H", [MAX_PORT, 1])))
+	assert list(lengths) == [32, 32]
+	assert list(ports) == [MAX_PORT, 1]
+
+def test_flow_delta_round_trip():
+	upAddrs, upLengths = [AddrToInt("10.0.0.2")]*2, [32, 32]
+	upPorts, removed, removedLengths = [1, 2], [AddrToInt("10.1.0.0")], [16]
+	decoded = DecodeFlowDelta(EncodeFlowDelta(7, 3, 5, upAddrs, upLengths,
+		upPorts, removed, removedLengths))
+	assert decoded[:3] == (7, 3, 5)
+	assert [list(column) for column in decoded[3:]] == [upAddrs, upLengths,
+		upPorts, removed, removedLengths]
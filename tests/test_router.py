@@ -0,0 +1,139 @@
+###############################################################################
+# Name: test_router.py                                                        #
+#                                                                             #
+# Regression tests for the router's shortest-path and flow table code, run    #
+# with "python -m pytest tests" from the repository root. A 50k-node line is  #
+# the deepest topology of its size: every path from one end is as long as     #
+# the line, which overflowed the recursion limit when ports were found by     #
+# walking prev lists recursively.                                             #
+###############################################################################
+
+from collections import OrderedDict
+import random
+
+from protocol import MSG_ADJ_MATRIX, MSG_FLOW_TABLE, EncodeTopologyDelta
+import router
+from bench.topology import Line, ToColumns
+
+lineNodes = 50000
+
+###############################################################################
+# Func: LinePacket                                                            #
+# Desc: Creates the text Adj. Matrix Packet of a line, as an edge list. Node  #
+#       i has port 1 towards i - 1 and port 2 towards i + 1.                  #
+# Args: source {int} - the source vertex.                                     #
+# Retn: {string} - the packet.                                                #
+###############################################################################
+def LinePacket(source):
+	lines = [str(source) + ", " + str(lineNodes) + ", sparse"]
+	lines.extend(str(ID) + "=" + LineAddress(ID) for ID in range(lineNodes))
+	lines.append("")
+	for u in range(lineNodes - 1):
+		lines.append(str(u) + ", " + str(u + 1) + ", 2")
+		lines.append(str(u + 1) + ", " + str(u) + ", 1")
+	return "\n".join(lines)
+
+###############################################################################
+# Func: LineAddress                                                           #
+# Desc: The address of a node of the line.                                    #
+# Args: ID {int} - ID of the node.                                            #
+# Retn: {string} - IPv4 address.                                              #
+###############################################################################
+def LineAddress(ID):
+	return "10.%d.%d.%d" % (ID >> 16, (ID >> 8) & 0xff, ID & 0xff)
+
+###############################################################################
+# Func: LineTable                                                             #
+# Desc: Sends the line to the router as an Adj. Matrix Packet, in the         #
+#       default mode (one Dijkstra run), and reads the Flow Table Packet.     #
+# Args: source {int} - the source vertex.                                     #
+# Retn: {dict} - destination address -> port.                                 #
+###############################################################################
+def LineTable(source):
+	router.useLinkCost = False
+	router.useEcmp = False
+	router.useIncremental = False
+	router.maxBackups = 0
+	replyType, packet = router.ComputeFlowTable(MSG_ADJ_MATRIX,
+		LinePacket(source).encode())
+	assert replyType == MSG_FLOW_TABLE
+	rows = [row.split(", ") for row in packet.splitlines()]
+	return {address: int(port) for address, port in rows}
+
+def test_line_packet_from_end():
+	table = LineTable(0)
+	assert table == {LineAddress(ID): 2 for ID in range(1, lineNodes)}
+
+def test_line_packet_from_middle():
+	source = lineNodes//2
+	table = LineTable(source)
+	assert len(table) == lineNodes - 1
+	for ID in range(lineNodes):
+		if ID != source:
+			assert table[LineAddress(ID)] == (1 if ID < source else 2)
+
+###############################################################################
+# Func: LoadLine                                                              #
+# Desc: Loads a line into the router as a synced topology (so --incremental   #
+#       is repaired from Topology Delta Packets) and resets the SPF modes.    #
+# Args: source {int} - the source vertex.                                     #
+#       ecmp {bool} - use EqualCostDijkstra.                                  #
+#       incremental {bool} - use IncrementalDijkstra.                         #
+# Retn: {dict} - (u, v) -> (port, cost) for every directed link.              #
+###############################################################################
+def LoadLine(source, ecmp=False, incremental=False):
+	links = Line(lineNodes, random.Random(2))
+	router.useLinkCost = False
+	router.useEcmp = ecmp
+	router.useIncremental = incremental
+	router.maxBackups = 0
+	router.spfTrees = OrderedDict()
+	router.sourceVertex = source
+	router.addressList = list(range(lineNodes))
+	router.BuildCSR(lineNodes, *ToColumns(links))
+	router.syncEpoch = 1
+	return links
+
+###############################################################################
+# Func: FlowTable                                                             #
+# Desc: Runs the router's shortest-path computation and builds the table.     #
+# Args: N/A                                                                   #
+# Retn: {dict} - destination -> port (or tuple of ports).                     #
+###############################################################################
+def FlowTable():
+	router.prevList, router.portList = router.SourceSPF(lineNodes)
+	return dict(zip(*router.BuildTable(lineNodes)))
+
+###############################################################################
+# Func: CheckLine                                                             #
+# Desc: Checks that every other host of the line is in the table, on the      #
+#       port of the link towards it.                                          #
+# Args: table {dict} - the flow table.                                        #
+#       links {dict} - the line's links.                                      #
+#       source {int} - the source vertex.                                     #
+# Retn: N/A                                                                   #
+###############################################################################
+def CheckLine(table, links, source):
+	assert len(table) == lineNodes - 1
+	for dest in range(lineNodes):
+		if dest < source:
+			assert table[dest] == links[(source, source - 1)][0]
+		elif dest > source:
+			assert table[dest] == links[(source, source + 1)][0]
+
+def test_line_ecmp():
+	links = LoadLine(0, ecmp=True)
+	CheckLine(FlowTable(), links, 0)
+
+def test_line_incremental_cut():
+	links = LoadLine(0, incremental=True)
+	CheckLine(FlowTable(), links, 0)
+	u = lineNodes//2
+	(portUV, costUV), (portVU, costVU) = links[(u, u + 1)], links[(u + 1, u)]
+	router.ApplyTopologyDelta(EncodeTopologyDelta([], [], [], [], [],
+		[u, u + 1], [portUV, portVU]))
+	table = FlowTable()
+	assert sorted(table) == list(range(1, u + 1))
+	router.ApplyTopologyDelta(EncodeTopologyDelta([], [u, u + 1], [u + 1, u],
+		[costUV, costVU], [portUV, portVU], [], []))
+	CheckLine(FlowTable(), links, 0)
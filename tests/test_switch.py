@@ -0,0 +1,170 @@
+###############################################################################
+# Name: test_switch.py                                                        #
+#                                                                             #
+# Tests for the switch's command parsing and forwarding table, run with       #
+# "python -m pytest tests" from the repository root.                          #
+###############################################################################
+
+import random
+
+import switch
+from protocol import *
+
+###############################################################################
+# Func: RandomTable                                                           #
+# Desc: Fills a table with random prefixes, nested inside each other so many  #
+#       addresses have several matches, some of them with port sets.          #
+# Args: rng {Random} - the random numbers.                                    #
+#       numPrefixes {int} - the number of prefixes.                           #
+# Retn: {ForwardingTable} - the table.                                        #
+#       {dict} - (network, length) -> port or tuple of ports.                 #
+###############################################################################
+def RandomTable(rng, numPrefixes):
+	table = switch.ForwardingTable()
+	routes = {}
+	for _ in range(numPrefixes):
+		length = rng.choice([8, 12, 16, 20, 24, 28, 32])
+		network = (0x0A000000 | rng.getrandbits(12) << 12) & \
+			switch.Netmask(length)
+		port = (rng.randint(1, 8) if rng.random() < 0.7 else
+			tuple(sorted(rng.sample(range(1, 9), rng.randint(2, 4)))))
+		table.Set(network, length, port)
+		routes[(network, length)] = port
+	table.Compile()
+	return table, routes
+
+###############################################################################
+# Func: LongestMatch                                                          #
+# Desc: Finds the longest prefix matching an address by trying each one.      #
+# Args: routes {dict} - (network, length) -> port or tuple of ports.          #
+#       address {int} - packed address.                                       #
+# Retn: {int|tuple} - port of the longest match, or None.                     #
+###############################################################################
+def LongestMatch(routes, address):
+	matches = [(length, port) for (network, length), port in routes.items()
+		if address & switch.Netmask(length) == network]
+	return max(matches)[1] if len(matches) > 0 else None
+
+def test_longest_prefix_match():
+	rng = random.Random(12)
+	table, routes = RandomTable(rng, 300)
+	addrs = [network + offset for network, length in routes
+		for offset in [0, (1 << 32 - length) - 1, 1 << 32 - length]]
+	addrs += [0x0A000000 | rng.getrandbits(24) for _ in range(2000)]
+	addrs += [0, 0xFFFFFFFF, 0x09FFFFFF]
+	for address in addrs:
+		address &= 0xFFFFFFFF
+		assert table.Match(address) == LongestMatch(routes, address)
+	# Removing a prefix uncovers the shorter ones around it.
+	for prefix in rng.sample(sorted(routes), 100):
+		table.Remove(*prefix)
+		del routes[prefix]
+	table.Compile()
+	for address in addrs:
+		address &= 0xFFFFFFFF
+		assert table.Match(address) == LongestMatch(routes, address)
+
+def test_lookup_many():
+	rng = random.Random(13)
+	table, routes = RandomTable(rng, 200)
+	addrs = [0x0A000000 | rng.getrandbits(24) for _ in range(5000)]
+	sources = [rng.getrandbits(32) for _ in range(5000)]
+	expected = [-1 if port is None else port
+		for port in map(table.Lookup, addrs, sources)]
+	numpy = switch.numpy
+	try:
+		for switch.numpy in [numpy, None]:
+			assert list(table.LookupMany(addrs, sources)) == expected
+	finally:
+		switch.numpy = numpy
+
+def test_ecmp_lookup():
+	switch.hashSalt = 6
+	table = switch.ForwardingTable()
+	network = AddrToInt("10.2.0.0")
+	table.Set(network, 16, (1, 2, 3))
+	table.Set(network | 7, 32, (4, 5))
+	table.Compile()
+	used = set()
+	for source in range(1000):
+		port = table.Lookup(network | 9, source)
+		assert port in (1, 2, 3)
+		assert table.Lookup(network | 9, source) == port	# Same flow.
+		used.add(port)
+		assert table.Lookup(network | 7, source) in (4, 5)
+	assert used == {1, 2, 3}
+	assert table.Match(network | 9) == (1, 2, 3)
+	assert table.Lookup(AddrToInt("10.3.0.1")) is None
+
+def test_parse_ports():
+	assert switch.ParseOperation("ADD 0") == ("ADD", 0, "0.0.0.0")
+	assert switch.ParseOperation("A 1 10.0.0.2") == ("ADD", 1, "10.0.0.2")
+	assert switch.ParseOperation("ADD " + str(MAX_PORT) + " 10.0.0.2") == \
+		("ADD", MAX_PORT, "10.0.0.2")
+	assert switch.ParseOperation("D " + str(MAX_PORT)) == \
+		("DELETE", MAX_PORT, "0.0.0.0")
+
+def test_parse_ports_out_of_range():
+	for port in ["-1", "01", str(MAX_PORT + 1), "65535", "70000"]:
+		assert switch.ParseOperation("ADD " + port + " 10.0.0.2") is None
+		assert switch.ParseOperation("DELETE " + port) is None
+	assert switch.ParseOperation("DELETE 0") is None
+
+def test_delta_needs_its_base():
+	switch.flowTable, switch.flowEpoch, switch.flowSeq = None, 0, 0
+	switch.downPorts = set()
+	host = AddrToInt("10.0.0.2")
+	full = EncodeFlowDelta(5, 0, 2, [host], [32], [1], [], [])
+	assert switch.InstallFlowTable(MSG_FLOW_DELTA, full)
+	assert (switch.flowEpoch, switch.flowSeq) == (5, 2)
+	# A delta from a table the switch does not hold is refused...
+	stale = EncodeFlowDelta(5, 1, 3, [host], [32], [2], [], [])
+	assert not switch.InstallFlowTable(MSG_FLOW_DELTA, stale)
+	assert switch.flowSeq == 2 and switch.flowTable.Lookup(host) == 1
+	# ...and the full table asked for instead replaces whatever it holds.
+	assert switch.CreateUpdatePacket("ADD", 0, "0.0.0.0", "0:0").endswith(
+		", 0:0")
+	full = EncodeFlowDelta(5, 0, 3, [host], [32], [2], [], [])
+	assert switch.InstallFlowTable(MSG_FLOW_DELTA, full)
+	assert switch.flowSeq == 3 and switch.flowTable.Lookup(host) == 2
+
+###############################################################################
+# Func: SendUpdates                                                           #
+# Desc: Fails over locally and queues updates for the sender thread, with     #
+#       the controller replaced by a function, then waits for them.           #
+# Args: operations {list: tuple} - (command, portNum, IPaddr) of each update. #
+#       Handler {function} - answers each update packet in place of           #
+#                            ControllerHandler.                               #
+# Retn: N/A                                                                   #
+###############################################################################
+def SendUpdates(operations, Handler):
+	handler = switch.ControllerHandler
+	switch.ControllerHandler = Handler
+	try:
+		for operation in operations:
+			switch.LocalReroute([operation])
+			switch.NotifyController([operation], wait=operation is
+				operations[-1])
+	finally:
+		switch.ControllerHandler = handler
+
+def test_deleted_port_released_once_answered():
+	switch.downPorts = set()
+	switch.flowTable = switch.ForwardingTable(switch.downPorts)
+	host = AddrToInt("10.0.0.2")
+	switch.flowTable.Set(host, 32, (1, 2))
+	delete = ("DELETE", 1, "0.0.0.0")
+	def Fail(packet, msgType=MSG_UPDATE):
+		raise KeyError(packet)
+	SendUpdates([delete], Fail)			# The sender thread survives it.
+	assert switch.downPorts == {1} and switch.flowTable.Match(host) == 2
+	seen = []
+	def Answer(packet, msgType=MSG_UPDATE):
+		seen.append(set(switch.downPorts))
+		return True
+	# Rejected (the table still has port 1): the port is back once both
+	# DELETEs are answered, not after the first.
+	SendUpdates([delete, delete], Answer)
+	assert seen == [{1}, {1}]
+	assert switch.downPorts == set() and switch.flowTable.Match(host) == (1, 2)
+	assert len(switch.unacknowledged) == 0